@@ -0,0 +1,141 @@
+"""Audio decoding without a codec library for the formats the corpora ship in.
+
+Headerless 16-bit PCM (ETRI's KsponSpeech ``.pcm``) and PCM or float WAV are memory-mapped with numpy
+and converted to float tensors in one pass; their length and rate are read from the file size and the
+WAV header. Anything else (compressed formats, WAV encodings not handled here) falls back to torchaudio.
+"""
+
+import io
+import struct
+from typing import NamedTuple, Optional, Tuple
+
+import numpy as np
+import torch
+from common import SAMPLE_RATE
+
+PCM_BYTES_PER_SAMPLE = 2
+# WAV headers of the corpora fit in the first few hundred bytes; this leaves room for metadata chunks.
+WAV_HEADER_BYTES = 4096
+
+_WAVE_FORMAT_PCM = 1
+_WAVE_FORMAT_IEEE_FLOAT = 3
+_WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+class AudioInfo(NamedTuple):
+    """Layout of an audio file's samples.
+
+    ``dtype`` is ``None`` for encodings that are decoded by torchaudio rather than memory-mapped.
+    """
+
+    num_frames: int
+    sample_rate: int
+    num_channels: int
+    data_offset: int
+    dtype: Optional[str]
+
+
+def _wav_dtype(format_tag: int, bits_per_sample: int) -> Optional[str]:
+    if format_tag == _WAVE_FORMAT_PCM and bits_per_sample == 16:
+        return "<i2"
+    if format_tag == _WAVE_FORMAT_PCM and bits_per_sample == 32:
+        return "<i4"
+    if format_tag == _WAVE_FORMAT_IEEE_FLOAT and bits_per_sample == 32:
+        return "<f4"
+    return None
+
+
+def parse_wav_header(header: bytes, num_bytes: int, file_path: str) -> AudioInfo:
+    """Find the format and data chunks of a WAV file from its first bytes.
+
+    Args:
+        header (bytes): First bytes of the file, at least ``WAV_HEADER_BYTES`` of them or the whole file.
+        num_bytes (int): Size of the file.
+        file_path (str): Path of the file, for error messages.
+    """
+    if header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+        raise ValueError(f"{file_path} is not a WAV file")
+    fmt, data_offset, data_size = None, None, None
+    offset = 12
+    while offset + 8 <= len(header):
+        chunk_id, chunk_size = struct.unpack_from("<4sI", header, offset)
+        if chunk_id == b"fmt ":
+            fmt = struct.unpack_from("<HHIIHH", header, offset + 8)
+            if fmt[0] == _WAVE_FORMAT_EXTENSIBLE and chunk_size >= 40:
+                # The actual format tag leads the sub-format GUID.
+                fmt = (struct.unpack_from("<H", header, offset + 32)[0],) + fmt[1:]
+        elif chunk_id == b"data":
+            data_offset = offset + 8
+            # Streamed files may leave the data size unset, in which case the data runs to the end of the file.
+            data_size = num_bytes - data_offset if chunk_size in (0, 0xFFFFFFFF) else min(chunk_size, num_bytes - data_offset)
+            break
+        offset += 8 + chunk_size + chunk_size % 2
+    if fmt is None or data_offset is None:
+        raise ValueError(f"Could not find the format and data chunks in the header of {file_path}")
+
+    format_tag, num_channels, sample_rate, _, block_align, bits_per_sample = fmt
+    return AudioInfo(data_size // block_align, sample_rate, num_channels, data_offset, _wav_dtype(format_tag, bits_per_sample))
+
+
+def probe_header(header: bytes, num_bytes: int, file_path: str) -> AudioInfo:
+    """:py:func:`probe` from the first bytes and the size of a file, e.g. one stored in an archive."""
+    if file_path.endswith(".pcm"):
+        return AudioInfo(num_bytes // PCM_BYTES_PER_SAMPLE, SAMPLE_RATE, 1, 0, "<i2")
+    return parse_wav_header(header, num_bytes, file_path)
+
+
+def probe(file_path: str) -> AudioInfo:
+    """Number of frames, sample rate and layout of an audio file, without decoding it.
+
+    Headerless ``.pcm`` files are 16-bit mono at 16 kHz, like ETRI's KsponSpeech. Other files are
+    parsed as WAV, and formats torchaudio would have to decode are probed with ``torchaudio.info``.
+    """
+    with open(file_path, "rb") as f:
+        header = f.read(WAV_HEADER_BYTES)
+        num_bytes = f.seek(0, io.SEEK_END)
+    if file_path.endswith(".pcm") or header[:4] == b"RIFF":
+        return probe_header(header, num_bytes, file_path)
+
+    import torchaudio
+
+    info = torchaudio.info(file_path)
+    return AudioInfo(info.num_frames, info.sample_rate, info.num_channels, 0, None)
+
+
+def _to_float_tensor(samples: np.ndarray) -> torch.Tensor:
+    # ``samples`` is (frames, channels); the result is (channels, frames) float32 in [-1, 1).
+    if samples.dtype == np.int16:
+        waveform = samples.T.astype(np.float32) / 32768
+    elif samples.dtype == np.int32:
+        waveform = samples.T.astype(np.float32) / 2147483648
+    else:
+        waveform = samples.T.astype(np.float32)
+    return torch.from_numpy(np.ascontiguousarray(waveform))
+
+
+def load_audio(file_path: str) -> Tuple[torch.Tensor, int]:
+    """Decode an audio file like ``torchaudio.load``, returning a `(channels, frames)` float32 tensor and its rate."""
+    info = probe(file_path)
+    if info.dtype is None:
+        import torchaudio
+
+        return torchaudio.load(file_path)
+    if info.num_frames == 0:
+        return torch.zeros(info.num_channels, 0), info.sample_rate
+    samples = np.memmap(
+        file_path, dtype=info.dtype, mode="r", offset=info.data_offset, shape=(info.num_frames, info.num_channels)
+    )
+    return _to_float_tensor(samples), info.sample_rate
+
+
+def decode_audio_bytes(data: bytes, file_path: str) -> Tuple[torch.Tensor, int]:
+    """:py:func:`load_audio` for the bytes of a file, e.g. a member read from an archive."""
+    info = probe_header(data[:WAV_HEADER_BYTES], len(data), file_path)
+    if info.dtype is None:
+        import torchaudio
+
+        return torchaudio.load(io.BytesIO(data))
+    samples = np.frombuffer(
+        data, dtype=info.dtype, count=info.num_frames * info.num_channels, offset=info.data_offset
+    ).reshape(info.num_frames, info.num_channels)
+    return _to_float_tensor(samples), info.sample_rate
@@ -0,0 +1,176 @@
+"""Waveform-level augmentation: speed perturbation, reverberation and additive noise.
+
+:py:class:`WaveformAugmentation` is applied to single utterances in DataLoader workers by
+``transforms.TrainTransform``, or once per utterance by ``feature_cache.py`` to precompute augmented
+variants of a feature cache. Speed perturbation resamples with kernels built once per factor (0.9 and
+1.1 reduce to 9:10 and 11:10 polyphase filters), and noise segments are read through memory maps of the
+noise files, so neither decodes or filters more audio than the utterance needs.
+"""
+
+import random
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+import torchaudio
+from audio_io import load_audio, probe
+from common import SAMPLE_RATE
+
+SPEED_FACTORS = (0.9, 1.0, 1.1)
+
+_AUDIO_PATTERNS = ("*.wav", "*.pcm")
+
+
+def find_audio_files(directory: str) -> List[str]:
+    """WAV and headerless PCM files under ``directory``, sorted."""
+    return sorted(path.as_posix() for pattern in _AUDIO_PATTERNS for path in Path(directory).rglob(pattern))
+
+
+def _speed_resampler(speed_factor: float) -> torchaudio.transforms.Resample:
+    # Playing ``SAMPLE_RATE * speed_factor`` samples per second at ``SAMPLE_RATE`` changes tempo and pitch by
+    # ``speed_factor``, as Kaldi's speed perturbation does.
+    return torchaudio.transforms.Resample(round(SAMPLE_RATE * speed_factor), SAMPLE_RATE)
+
+
+def _fast_fft_size(n: int) -> int:
+    # Smallest size of at least ``n`` with no prime factors above 5, which FFTs handle fastest.
+    while True:
+        m = n
+        for factor in (2, 3, 5):
+            while m % factor == 0:
+                m //= factor
+        if m == 1:
+            return n
+        n += 1
+
+
+def _reverberate(waveform: torch.Tensor, rir: torch.Tensor) -> torch.Tensor:
+    # ``torchaudio.functional.fftconvolve`` transforms at the exact output length, whose large prime factors
+    # make the FFT several times slower than at the next 5-smooth size.
+    num_samples = waveform.size(-1)
+    n_fft = _fast_fft_size(num_samples + rir.size(-1) - 1)
+    spectrum = torch.fft.rfft(waveform, n_fft) * torch.fft.rfft(rir, n_fft)
+    return torch.fft.irfft(spectrum, n_fft)[..., :num_samples]
+
+
+class WaveformAugmentation:
+    """Randomly speed-perturbs, reverberates and adds noise to 16 kHz waveforms.
+
+    Each call draws a speed factor uniformly from ``speed_factors``, then convolves with a random room
+    impulse response with probability ``rir_prob`` and mixes in a random noise segment at an SNR drawn
+    uniformly from ``snr_range`` with probability ``noise_prob``; digitally silent segments are not mixed
+    in. Speed perturbation changes the length of the waveform, so batches planned with ``--max-frames``
+    may grow by up to ``1 / min(speed_factors)``.
+
+    Args:
+        speed_factors (list of float, optional): Speed factors to draw from. (Default: ``(0.9, 1.0, 1.1)``)
+        noise_paths (list of str, optional): 16 kHz noise recordings. (Default: none)
+        rir_paths (list of str, optional): 16 kHz room impulse responses. (Default: none)
+        noise_prob (float, optional): Probability of adding noise. (Default: 0.5)
+        rir_prob (float, optional): Probability of reverberation. (Default: 0.3)
+        snr_range (float, float, optional): Range of signal-to-noise ratios in dB. (Default: ``(5.0, 20.0)``)
+    """
+
+    def __init__(
+        self,
+        speed_factors: Sequence[float] = SPEED_FACTORS,
+        noise_paths: Sequence[str] = (),
+        rir_paths: Sequence[str] = (),
+        noise_prob: float = 0.5,
+        rir_prob: float = 0.3,
+        snr_range: Tuple[float, float] = (5.0, 20.0),
+    ):
+        self.speed_factors = list(speed_factors)
+        self.resamplers = {factor: _speed_resampler(factor) for factor in self.speed_factors if factor != 1.0}
+        self.noise_paths = list(noise_paths)
+        self.noise_infos = [probe(path) for path in self.noise_paths]
+        for path, info in zip(self.noise_paths, self.noise_infos):
+            if info.sample_rate != SAMPLE_RATE or info.dtype is None or info.num_frames == 0:
+                raise ValueError(f"Noise {path} must be non-empty 16 kHz PCM or float WAV")
+        for n, path in enumerate(self.noise_paths):
+            if not self._noise_samples(n).any():
+                raise ValueError(f"Noise {path} is entirely silent")
+        self.rir_paths = list(rir_paths)
+        self.rirs = [self._load_rir(path) for path in self.rir_paths]
+        self.noise_prob = noise_prob if self.noise_paths else 0.0
+        self.rir_prob = rir_prob if self.rirs else 0.0
+        self.snr_range = snr_range
+
+    @staticmethod
+    def _load_rir(rir_path: str) -> torch.Tensor:
+        rir, sample_rate = load_audio(rir_path)
+        if sample_rate != SAMPLE_RATE:
+            raise ValueError(f"Room impulse response {rir_path} must be 16 kHz, but has rate {sample_rate}")
+        rir = rir.mean(0)
+        # Starting at the direct path keeps the reverberant speech aligned with its transcript.
+        rir = rir[int(rir.abs().argmax()) :]
+        return rir / rir.norm()
+
+    @property
+    def adds_noise_or_reverb(self) -> bool:
+        return self.noise_prob > 0 or self.rir_prob > 0
+
+    def settings(self) -> dict:
+        """Parameters of the augmentation, recorded with features precomputed from it."""
+        return {
+            "speed_factors": self.speed_factors,
+            "noise_paths": self.noise_paths,
+            "rir_paths": self.rir_paths,
+            "noise_prob": self.noise_prob,
+            "rir_prob": self.rir_prob,
+            "snr_range": list(self.snr_range),
+        }
+
+    def _noise_samples(self, n: int) -> np.memmap:
+        info = self.noise_infos[n]
+        return np.memmap(
+            self.noise_paths[n], dtype=info.dtype, mode="r", offset=info.data_offset, shape=(info.num_frames, info.num_channels)
+        )
+
+    def _noise_segment(self, num_samples: int) -> torch.Tensor:
+        n = random.randrange(len(self.noise_paths))
+        info = self.noise_infos[n]
+        samples = self._noise_samples(n)
+        start = random.randrange(max(info.num_frames - num_samples, 0) + 1)
+        noise = torch.from_numpy(samples[start : start + num_samples].mean(1, dtype=np.float32))
+        if samples.dtype == np.int16:
+            noise /= 32768
+        elif samples.dtype == np.int32:
+            noise /= 2147483648
+        if len(noise) < num_samples:
+            noise = noise.repeat(num_samples // len(noise) + 1)[:num_samples]
+        return noise
+
+    def speed_perturb(self, waveform: torch.Tensor, speed_factor: float) -> torch.Tensor:
+        if speed_factor == 1.0:
+            return waveform
+        if speed_factor not in self.resamplers:
+            self.resamplers[speed_factor] = _speed_resampler(speed_factor)
+        return self.resamplers[speed_factor](waveform)
+
+    def __call__(self, waveform: torch.Tensor, speed_factor: Optional[float] = None) -> torch.Tensor:
+        """
+        Args:
+            waveform (torch.Tensor): Waveform, with shape `(1, S)` or `(S,)`.
+            speed_factor (float or None, optional): Speed factor to apply instead of a random one. (Default: ``None``)
+
+        Returns:
+            torch.Tensor: Augmented waveform, with the same number of dimensions as ``waveform``.
+        """
+        if speed_factor is None:
+            speed_factor = random.choice(self.speed_factors)
+        waveform = self.speed_perturb(waveform, speed_factor)
+        num_samples = waveform.size(-1)
+        if num_samples == 0:
+            return waveform
+
+        if random.random() < self.rir_prob:
+            waveform = _reverberate(waveform, random.choice(self.rirs))
+        if random.random() < self.noise_prob:
+            noise = self._noise_segment(num_samples)
+            # ``add_noise`` scales by the speech-to-noise energy ratio, which is NaN for a digitally silent segment.
+            if noise.any():
+                snr = torch.full(waveform.shape[:-1], random.uniform(*self.snr_range))
+                waveform = torchaudio.functional.add_noise(waveform, noise.expand_as(waveform), snr)
+        return waveform
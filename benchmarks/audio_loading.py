@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""Time waveform loading and probing of each corpus with ``audio_io`` against torchaudio.
+
+For every corpus, the same random subset of utterances is loaded with the previous path (``torchaudio.load``
+for WAV, reading the file and copying it through ``torch.frombuffer`` for headerless PCM) and with
+``audio_io.load_audio``, checking that both yield identical waveforms, and probed with ``torchaudio.info``
+against ``audio_io.probe``. Files are read once beforehand so both paths run against the page cache.
+
+Example:
+python -m benchmarks.audio_loading --dataset-path ./speech_data --corpora etri solugate --num-files 2000
+"""
+
+import logging
+import pathlib
+import random
+import time
+from argparse import ArgumentParser, RawTextHelpFormatter
+
+import torch
+import torchaudio
+from audio_io import load_audio, probe
+from corpora import CORPORA, get_corpus
+
+logger = logging.getLogger()
+
+
+def _baseline_load(file_path: str):
+    if file_path.endswith(".pcm"):
+        with open(file_path, "rb") as f:
+            data = f.read()
+        return (torch.frombuffer(bytearray(data), dtype=torch.int16).to(torch.float32) / 32768).unsqueeze(0), 16000
+    return torchaudio.load(file_path)
+
+
+def _baseline_probe(file_path: str):
+    if file_path.endswith(".pcm"):
+        return pathlib.Path(file_path).stat().st_size // 2, 16000
+    info = torchaudio.info(file_path)
+    return info.num_frames, info.sample_rate
+
+
+def _time(fn, paths):
+    start = time.perf_counter()
+    results = [fn(path) for path in paths]
+    return time.perf_counter() - start, results
+
+
+def parse_args():
+    parser = ArgumentParser(description=__doc__, formatter_class=RawTextHelpFormatter)
+    parser.add_argument(
+        "--dataset-path",
+        required=True,
+        type=pathlib.Path,
+        help="Path to the directory holding the corpora.",
+    )
+    parser.add_argument(
+        "--corpora",
+        nargs="+",
+        default=CORPORA,
+        choices=CORPORA,
+        help="Corpora to benchmark. (Default: all)",
+    )
+    parser.add_argument(
+        "--num-files",
+        default=1000,
+        type=int,
+        help="Number of files sampled from the training split of each corpus. (Default: 1000)",
+    )
+    parser.add_argument(
+        "--seed",
+        default=0,
+        type=int,
+        help="Seed for sampling files. (Default: 0)",
+    )
+    return parser.parse_args()
+
+
+def cli_main():
+    args = parse_args()
+    print(f"{'corpus':12}{'files':>8}{'load s':>10}{'new s':>10}{'speedup':>9}{'probe s':>10}{'new s':>10}{'speedup':>9}")
+    for name in args.corpora:
+        dataset = get_corpus(name, args.dataset_path, True)
+        indices = random.Random(args.seed).sample(range(len(dataset)), min(args.num_files, len(dataset)))
+        paths = [dataset._manifest.audio_path(n) for n in indices]
+        for path in paths:
+            with open(path, "rb") as f:
+                f.read()
+
+        load_seconds, baseline = _time(_baseline_load, paths)
+        new_load_seconds, loaded = _time(load_audio, paths)
+        for path, (expected, expected_rate), (waveform, sample_rate) in zip(paths, baseline, loaded):
+            if sample_rate != expected_rate or not torch.equal(waveform, expected):
+                raise AssertionError(f"audio_io.load_audio disagrees with torchaudio on {path}")
+
+        probe_seconds, baseline = _time(_baseline_probe, paths)
+        new_probe_seconds, probed = _time(probe, paths)
+        for path, expected, info in zip(paths, baseline, probed):
+            if (info.num_frames, info.sample_rate) != expected:
+                raise AssertionError(f"audio_io.probe disagrees with torchaudio on {path}")
+
+        print(
+            f"{name:12}{len(paths):8}{load_seconds:10.2f}{new_load_seconds:10.2f}{load_seconds / new_load_seconds:8.1f}x"
+            f"{probe_seconds:10.2f}{new_probe_seconds:10.2f}{probe_seconds / new_probe_seconds:8.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    cli_main()
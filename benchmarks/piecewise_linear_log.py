@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""Compare ``piecewise_linear_log`` against the masked gather/scatter version it replaced.
+
+Example:
+python -m benchmarks.piecewise_linear_log --num-threads 4
+"""
+
+import math
+from argparse import ArgumentParser, RawTextHelpFormatter
+
+import torch
+import torch.utils.benchmark as benchmark
+from common import GAIN, piecewise_linear_log, spectrogram_transform
+
+# (batch size, frames) of a single utterance and of typical buckets under max_tokens=700.
+_SHAPES = [(1, 500), (1, 1500), (8, 800), (32, 1500)]
+
+
+def _masked_piecewise_linear_log(x):
+    x = x * GAIN
+    x[x > math.e] = torch.log(x[x > math.e])
+    x[x <= math.e] = x[x <= math.e] / math.e
+    return x
+
+
+def _realistic_mel_features(batch_size: int, num_frames: int) -> torch.Tensor:
+    # Mel power of noise at speech-like levels, so both branches of the function are exercised.
+    waveform = torch.randn(batch_size, num_frames * 160) * 0.05
+    return spectrogram_transform(waveform).transpose(1, 2).contiguous()
+
+
+def parse_args():
+    parser = ArgumentParser(description=__doc__, formatter_class=RawTextHelpFormatter)
+    parser.add_argument("--num-threads", default=1, type=int, help="Number of torch threads. (Default: 1)")
+    parser.add_argument("--min-run-time", default=1.0, type=float, help="Seconds to time each case. (Default: 1.0)")
+    return parser.parse_args()
+
+
+def cli_main():
+    args = parse_args()
+    results = []
+    for batch_size, num_frames in _SHAPES:
+        x = _realistic_mel_features(batch_size, num_frames)
+        assert torch.equal(piecewise_linear_log(x), _masked_piecewise_linear_log(x))
+
+        for label, fn in [("masked", _masked_piecewise_linear_log), ("fused", piecewise_linear_log)]:
+            timer = benchmark.Timer(
+                stmt="fn(x)",
+                globals={"fn": fn, "x": x},
+                num_threads=args.num_threads,
+                label="piecewise_linear_log",
+                sub_label=f"{batch_size}x{num_frames}x80",
+                description=label,
+            )
+            results.append(timer.blocked_autorange(min_run_time=args.min_run_time))
+
+    benchmark.Compare(results).print()
+
+
+if __name__ == "__main__":
+    cli_main()
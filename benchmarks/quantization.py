@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""Compare dynamic int8 quantization against fp32 on the same utterances through ``eval.py``.
+
+Both runs use the evaluation flags given after the ones below, write their per-utterance results to
+``--output-dir`` (``fp32.jsonl`` and ``int8.jsonl``, resumed if present) and are reported side by side
+with the WER/CER delta and decoding speedup. Decoding is timed on CPU, and the speedup compares real-time
+factors, since a resumed run only times the utterances it had not finished.
+
+Example:
+python -m benchmarks.quantization --output-dir ./exp/quantization -- --checkpoint-path ./exp/checkpoints/last.ckpt \\
+    --korspeech-path ./speech_data --sp-model-path ./baseline.model --max-utterances 2000 --decoding greedy
+"""
+
+import logging
+import pathlib
+from argparse import ArgumentParser, RawTextHelpFormatter
+
+import torch
+from eval import parse_args as parse_eval_args
+from eval import run_eval
+from lightning import QUANTIZATION_DYNAMIC, QUANTIZATION_NONE
+
+logger = logging.getLogger()
+
+
+def _rates(totals):
+    return totals.word_errors / max(totals.words, 1), totals.char_errors / max(totals.chars, 1)
+
+
+def parse_args():
+    parser = ArgumentParser(description=__doc__, formatter_class=RawTextHelpFormatter)
+    parser.add_argument(
+        "--output-dir",
+        required=True,
+        type=pathlib.Path,
+        help="Directory for the per-utterance results of both runs.",
+    )
+    parser.add_argument(
+        "--num-threads",
+        default=None,
+        type=int,
+        help="Number of torch threads used for decoding. (Default: torch default)",
+    )
+    parser.add_argument("eval_args", nargs="*", help="Arguments of eval.py, after '--'.")
+    return parser.parse_args()
+
+
+def cli_main():
+    args = parse_args()
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+
+    results = {}
+    for name, quantization in [("fp32", QUANTIZATION_NONE), ("int8", QUANTIZATION_DYNAMIC)]:
+        eval_args = parse_eval_args(args.eval_args + ["--output-path", str(args.output_dir / f"{name}.jsonl")])
+        if eval_args.use_cuda:
+            raise ValueError("Quantization is compared on CPU; drop --use-cuda.")
+        eval_args.quantization = quantization
+        results[name] = run_eval(eval_args)
+
+    (fp32_totals, fp32_timing), (int8_totals, int8_timing) = results["fp32"], results["int8"]
+    fp32_wer, fp32_cer = _rates(fp32_totals)
+    int8_wer, int8_cer = _rates(int8_totals)
+    print(f"{'':6}{'WER':>10}{'CER':>10}{'decode s':>12}{'RTF':>10}")
+    print(f"{'fp32':6}{fp32_wer:10.4f}{fp32_cer:10.4f}{fp32_timing.decode_seconds:12.1f}{fp32_timing.real_time_factor:10.4f}")
+    print(f"{'int8':6}{int8_wer:10.4f}{int8_cer:10.4f}{int8_timing.decode_seconds:12.1f}{int8_timing.real_time_factor:10.4f}")
+    print(f"{'delta':6}{int8_wer - fp32_wer:+10.4f}{int8_cer - fp32_cer:+10.4f}")
+    if fp32_timing.audio_seconds and int8_timing.audio_seconds and int8_timing.decode_seconds:
+        print(f"Speedup: {fp32_timing.real_time_factor / int8_timing.real_time_factor:.2f}x")
+    else:
+        print("Speedup: not measured; a run was resumed from finished results only.")
+
+
+if __name__ == "__main__":
+    cli_main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""Send concurrent transcription requests to a running ``server.py`` and report latency and throughput.
+
+Requests carry the given audio files in turn, or random noise of ``--seconds`` seconds when no file is
+given, so the server can be exercised on CPU without any dataset.
+
+Example:
+python -m benchmarks.server_load --port 8000 --num-requests 200 --concurrency 32 --audio-paths ./sample.wav
+"""
+
+import asyncio
+import json
+import time
+from argparse import ArgumentParser, RawTextHelpFormatter
+from typing import List, Tuple
+
+import numpy as np
+
+_SAMPLE_RATE = 16000
+
+
+async def _request(host: str, port: int, method: str, path: str, body: bytes = b"") -> Tuple[int, dict]:
+    reader, writer = await asyncio.open_connection(host, port)
+    head = f"{method} {path} HTTP/1.1\r\nHost: {host}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n"
+    writer.write(head.encode() + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, payload = response.partition(b"\r\n\r\n")
+    return int(head.split()[1]), json.loads(payload)
+
+
+def _noise_pcm(seconds: float, rng: np.random.Generator) -> bytes:
+    num_samples = int(seconds * _SAMPLE_RATE * rng.uniform(0.5, 1.5))
+    return (rng.standard_normal(num_samples) * 3000).astype("<i2").tobytes()
+
+
+async def _run(args) -> None:
+    rng = np.random.default_rng(0)
+    if args.audio_paths:
+        bodies = [open(path, "rb").read() for path in args.audio_paths]
+    else:
+        bodies = [_noise_pcm(args.seconds, rng) for _ in range(16)]
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies: List[float] = []
+    failures = 0
+
+    async def one(n: int):
+        nonlocal failures
+        async with semaphore:
+            start = time.perf_counter()
+            status, _ = await _request(args.host, args.port, "POST", "/transcribe", bodies[n % len(bodies)])
+            latencies.append(time.perf_counter() - start)
+            failures += status != 200
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(n) for n in range(args.num_requests)))
+    elapsed = time.perf_counter() - start
+
+    p50, p95, p99 = np.percentile(np.array(latencies), [50, 95, 99]) * 1000
+    print(f"{args.num_requests} requests ({failures} failed) in {elapsed:.2f} s: {args.num_requests / elapsed:.1f} requests/s")
+    print(f"Client latency p50 {p50:.1f} ms, p95 {p95:.1f} ms, p99 {p99:.1f} ms")
+    _, metrics = await _request(args.host, args.port, "GET", "/metrics")
+    print(json.dumps(metrics, indent=2))
+
+
+def parse_args():
+    parser = ArgumentParser(description=__doc__, formatter_class=RawTextHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1", type=str, help="Server address. (Default: '127.0.0.1')")
+    parser.add_argument("--port", default=8000, type=int, help="Server port. (Default: 8000)")
+    parser.add_argument("--num-requests", default=100, type=int, help="Number of requests to send. (Default: 100)")
+    parser.add_argument("--concurrency", default=16, type=int, help="Number of requests in flight. (Default: 16)")
+    parser.add_argument("--audio-paths", nargs="*", default=[], help="WAV or 16 kHz PCM files to send.")
+    parser.add_argument(
+        "--seconds", default=4.0, type=float, help="Mean duration of the noise sent without audio files. (Default: 4.0)"
+    )
+    return parser.parse_args()
+
+
+def cli_main():
+    asyncio.run(_run(parse_args()))
+
+
+if __name__ == "__main__":
+    cli_main()
@@ -23,16 +23,24 @@ ETRI_DIR_NAME = "한국어 음성"
 
 DECIBEL = 2 * 20 * math.log10(torch.iinfo(torch.int16).max)
 GAIN = pow(10, 0.05 * DECIBEL)
-spectrogram_transform = torchaudio.transforms.MelSpectrogram(sample_rate=16000, n_fft=400, n_mels=80, hop_length=160)
+N_FFT = 400
+HOP_LENGTH = 160
+N_MELS = 80
+# Output vocabulary (SentencePiece pieces and blank) and encoder frame stride of ``ConformerRNNTModule``.
+NUM_SYMBOLS = 6001
+TIME_REDUCTION_STRIDE = 1
+spectrogram_transform = torchaudio.transforms.MelSpectrogram(sample_rate=16000, n_fft=N_FFT, n_mels=N_MELS, hop_length=HOP_LENGTH)
 
 Batch = namedtuple("Batch", ["features", "feature_lengths", "targets", "target_lengths"])
 
 
-def piecewise_linear_log(x):
-    x = x * GAIN
-    x[x > math.e] = torch.log(x[x > math.e])
-    x[x <= math.e] = x[x <= math.e] / math.e
-    return x
+def piecewise_linear_log(x, gain: float = GAIN):
+    # Single mask and no masked gather/scatter; the division reuses the buffer of ``x * GAIN``.
+    # ``gain`` is an argument rather than a global so that the function can be scripted.
+    x = x * gain
+    is_log_region = x > math.e
+    log_x = torch.log(x)
+    return torch.where(is_log_region, log_x, x.div_(math.e))
 
 
 def batch_by_token_count(idx_target_lengths, token_limit):
@@ -92,13 +100,133 @@ class GlobalStatsNormalization(torch.nn.Module):
         with open(global_stats_path) as f:
             blob = json.loads(f.read())
 
-        self.mean = torch.tensor(blob["mean"])
-        self.invstddev = torch.tensor(blob["invstddev"])
+        # Non-persistent buffers follow the module across devices without entering checkpoints.
+        self.register_buffer("mean", torch.tensor(blob["mean"]), persistent=False)
+        self.register_buffer("invstddev", torch.tensor(blob["invstddev"]), persistent=False)
 
     def forward(self, input):
         return (input - self.mean) * self.invstddev
 
 
+def get_train_data_pipeline(global_stats_path):
+    # SpecAugment is applied per utterance by ``ConformerRNNTModule`` once the batch is on the training device.
+    return torch.nn.Sequential(
+        GlobalStatsNormalization(global_stats_path),
+    )
+
+
+def get_valid_data_pipeline(global_stats_path):
+    return torch.nn.Sequential(
+        GlobalStatsNormalization(global_stats_path),
+    )
+
+
+def get_feature_lengths(waveform_lengths: torch.Tensor, hop_length: int = HOP_LENGTH) -> torch.Tensor:
+    """Number of frames ``spectrogram_transform`` produces for waveforms of the given lengths (centered STFT)."""
+    return (waveform_lengths // hop_length + 1).to(torch.int32)
+
+
+class SpecAugment(torch.nn.Module):
+    """SpecAugment frequency and time masking of a padded batch, with independent masks for each utterance.
+
+    Masks are drawn like ``torchaudio.transforms.FrequencyMasking`` and ``TimeMasking``, but per utterance
+    rather than once per batch, and time masks are bounded by each utterance's number of valid frames
+    (including the ``time_mask_p`` cap on their width), so padding is never masked in place of speech.
+    Features are masked in place in their `(B, T, F)` layout, without transposing or copying them.
+
+    Args:
+        freq_mask_param (int, optional): Maximum width of a frequency mask. (Default: 31)
+        num_freq_masks (int, optional): Number of frequency masks per utterance. (Default: 2)
+        time_mask_param (int, optional): Maximum width of a time mask. (Default: 41)
+        num_time_masks (int, optional): Number of time masks per utterance. (Default: 2)
+        time_mask_p (float, optional): Maximum width of a time mask as a fraction of the utterance's frames.
+            (Default: 0.2)
+    """
+
+    def __init__(
+        self,
+        freq_mask_param: int = 31,
+        num_freq_masks: int = 2,
+        time_mask_param: int = 41,
+        num_time_masks: int = 2,
+        time_mask_p: float = 0.2,
+    ):
+        super().__init__()
+        self.freq_mask_param = freq_mask_param
+        self.num_freq_masks = num_freq_masks
+        self.time_mask_param = time_mask_param
+        self.num_time_masks = num_time_masks
+        self.time_mask_p = time_mask_p
+
+    @staticmethod
+    def _masks(sizes: torch.Tensor, mask_params: torch.Tensor, num_masks: int, axis_size: int) -> torch.Tensor:
+        # Width ~ U[0, mask_param) and start ~ U[0, size - width), floored, as in ``torchaudio.functional.mask_along_axis``.
+        widths = torch.rand(sizes.size(0), num_masks, device=sizes.device) * mask_params[:, None]
+        starts = (torch.rand_like(widths) * (sizes[:, None] - widths)).floor()
+        ends = starts + widths.floor()
+        positions = torch.arange(axis_size, device=sizes.device)
+        return ((positions >= starts[..., None]) & (positions < ends[..., None])).any(1)
+
+    def forward(self, features: torch.Tensor, feature_lengths: torch.Tensor) -> torch.Tensor:
+        """
+        Args:
+            features (torch.Tensor): Padded features, with shape `(B, T, F)`.
+            feature_lengths (torch.Tensor): Number of valid frames of each utterance, with shape `(B,)`.
+
+        Returns:
+            torch.Tensor: ``features``, masked in place.
+        """
+        batch_size, num_frames, num_bins = features.shape
+        frames = feature_lengths.to(device=features.device, dtype=torch.float32)
+        bins = torch.full((batch_size,), float(num_bins), device=features.device)
+        freq_mask = self._masks(bins, bins.new_full((batch_size,), float(self.freq_mask_param)), self.num_freq_masks, num_bins)
+        time_mask_params = torch.clamp(frames * self.time_mask_p, max=self.time_mask_param).floor()
+        time_mask = self._masks(frames, time_mask_params, self.num_time_masks, num_frames)
+        return features.masked_fill_(time_mask[:, :, None] | freq_mask[:, None, :], 0.0)
+
+
+class BatchedFeatureExtractor(torch.nn.Module):
+    """Log-mel features of a whole batch of padded waveforms with a single STFT and mel projection.
+
+    Computes the same features as ``piecewise_linear_log(spectrogram_transform(waveform))`` per utterance,
+    except for the last few frames of an utterance, whose window overlaps zero padding rather than
+    reflection padding. Frames past each utterance's length are zeroed, as ``pad_sequence`` would.
+    The window and filterbank are non-persistent buffers, so the module can live inside a model on
+    the training device without changing its checkpoints.
+    """
+
+    def __init__(self):
+        super().__init__()
+        # Attributes rather than globals, so that the module can be scripted.
+        self.n_fft = N_FFT
+        self.hop_length = HOP_LENGTH
+        self.register_buffer("window", torch.hann_window(N_FFT), persistent=False)
+        self.register_buffer(
+            "mel_filterbank",
+            torchaudio.functional.melscale_fbanks(N_FFT // 2 + 1, 0.0, SAMPLE_RATE / 2, N_MELS, SAMPLE_RATE),
+            persistent=False,
+        )
+
+    def forward(self, waveforms: torch.Tensor, waveform_lengths: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Args:
+            waveforms (torch.Tensor): Padded waveforms, with shape `(B, S)`.
+            waveform_lengths (torch.Tensor): Number of valid samples of each waveform, with shape `(B,)`.
+
+        Returns:
+            (torch.Tensor, torch.Tensor):
+                Log-mel features, with shape `(B, T, 80)`, and number of valid frames of each, with shape `(B,)`.
+        """
+        spectrogram = torch.stft(
+            waveforms, self.n_fft, hop_length=self.hop_length, window=self.window, center=True, pad_mode="reflect", return_complex=True
+        ).abs().pow(2)
+        features = piecewise_linear_log(torch.matmul(spectrogram.transpose(1, 2), self.mel_filterbank))
+
+        feature_lengths = get_feature_lengths(waveform_lengths, self.hop_length)
+        padding_mask = torch.arange(features.size(1), device=features.device) >= feature_lengths.to(features.device)[:, None]
+        return features.masked_fill(padding_mask.unsqueeze(-1), 0.0), feature_lengths
+
+
 class WarmupLR(torch.optim.lr_scheduler._LRScheduler):
     def __init__(self, optimizer, warmup_updates, last_epoch=-1, verbose=False):
         self.warmup_updates = warmup_updates
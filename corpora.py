@@ -0,0 +1,28 @@
+from typing import Optional
+
+import dataset_modules.diquest_normalspeech as diquest_normalspeech
+import dataset_modules.etri_converspeech as etri_converspeech
+import dataset_modules.hallym_dysarthricspeech as hallym_dysarthricspeech
+import dataset_modules.solugate_converspeech as solugate_converspeech
+from storage import FileStorage
+
+CORPUS_ETRI = "etri"
+CORPUS_SOLUGATE = "solugate"
+CORPUS_DIQUEST = "diquest"
+CORPUS_DYSARTHRIC = "dysarthric"
+
+CORPORA = [CORPUS_ETRI, CORPUS_SOLUGATE, CORPUS_DIQUEST, CORPUS_DYSARTHRIC]
+
+
+def get_corpus(name: str, path, training: bool, storage: Optional[FileStorage] = None):
+    """Open the training or validation split of a corpus by name."""
+    if name == CORPUS_ETRI:
+        return etri_converspeech.ETRISPEECH(path, training, storage=storage)
+    elif name == CORPUS_SOLUGATE:
+        return solugate_converspeech.SOLUGATESPEECH(path, training, "all", storage=storage)
+    elif name == CORPUS_DIQUEST:
+        return diquest_normalspeech.DIQUESTSPEECH(path, training, storage=storage)
+    elif name == CORPUS_DYSARTHRIC:
+        return hallym_dysarthricspeech.KORDYSARTHRICSPEECH(path, training, storage=storage)
+    else:
+        raise ValueError(f"Encountered unsupported corpus {name}.")
@@ -1,27 +1,62 @@
+import logging
+import math
 import os
 import random
 
+import numpy as np
 import torch
 from pytorch_lightning import LightningDataModule
 import dataset_modules.etri_converspeech as etri_converspeech
 import dataset_modules.solugate_converspeech as solugate_converspeech
 import dataset_modules.diquest_normalspeech as diquest_normalspeech
 import dataset_modules.hallym_dysarthricspeech as hallym_dysarthricspeech
-from script_normalization import cleanup_transcript
-from solugate_converspeech import SUBDIR_GETTER
+from corpora import CORPUS_ETRI, get_corpus
+from common import HOP_LENGTH, NUM_SYMBOLS, SAMPLE_RATE, TIME_REDUCTION_STRIDE
+from feature_cache import FeatureCacheDataset, get_features_dir
+from shards import ShardedIterableDataset
+from token_cache import TOKENS_FILENAME, TokenizedDataset, load_or_encode_targets
+from untar_unzip import PCM_BYTES_PER_SAMPLE, WAV_HEADER_BYTES, _num_samples_from_header
 
-def _batch_by_token_count(idx_target_lengths, max_tokens, batch_size=None):
+logger = logging.getLogger()
+
+
+def _joiner_elements(batch_size, num_frames, target_length):
+    # The RNN-T joiner output is (batch, encoder frames, target length + 1, vocabulary), all padded.
+    return batch_size * math.ceil(num_frames / TIME_REDUCTION_STRIDE) * (target_length + 1) * NUM_SYMBOLS
+
+
+def _batch_by_cost(idx_lengths_frames, max_tokens, batch_size=None, max_frames=None, max_joiner_elements=None):
+    """Split ``(idx, target length, frames)`` triples, in order, into batches within every given limit.
+
+    ``max_tokens`` caps the sum of target lengths, ``max_frames`` the padded frame count
+    (batch size × longest utterance) and ``max_joiner_elements`` the padded joiner output size.
+    An utterance over a limit on its own still gets a batch of its own.
+    """
     batches = []
     current_batch = []
     current_token_count = 0
-    for idx, target_length in idx_target_lengths:
-        if current_token_count + target_length > max_tokens or (batch_size and len(current_batch) == batch_size):
+    current_max_frames = 0
+    current_max_length = 0
+    for idx, target_length, num_frames in idx_lengths_frames:
+        new_size = len(current_batch) + 1
+        new_max_frames = max(current_max_frames, num_frames)
+        new_max_length = max(current_max_length, target_length)
+        if current_batch and (
+            current_token_count + target_length > max_tokens
+            or (batch_size and len(current_batch) == batch_size)
+            or (max_frames and new_size * new_max_frames > max_frames)
+            or (max_joiner_elements and _joiner_elements(new_size, new_max_frames, new_max_length) > max_joiner_elements)
+        ):
             batches.append(current_batch)
             current_batch = [idx]
             current_token_count = target_length
+            current_max_frames = num_frames
+            current_max_length = target_length
         else:
             current_batch.append(idx)
             current_token_count += target_length
+            current_max_frames = new_max_frames
+            current_max_length = new_max_length
 
     if current_batch:
         batches.append(current_batch)
@@ -29,88 +64,254 @@ def _batch_by_token_count(idx_target_lengths, max_tokens, batch_size=None):
     return batches
 
 
+def get_sample_frames(korspeech_dataset):
+    """Number of feature frames of every utterance, from audio sizes and headers without decoding audio."""
+    if isinstance(korspeech_dataset, TokenizedDataset):
+        korspeech_dataset = korspeech_dataset.dataset
+    if isinstance(korspeech_dataset, FeatureCacheDataset):
+        return korspeech_dataset.lengths.tolist()
+
+    manifest = korspeech_dataset._manifest
+    storage = korspeech_dataset.storage
+    is_pcm = np.array([audio_path.endswith(".pcm") for audio_path in manifest.audio_paths], dtype=bool)
+    num_samples = manifest.num_bytes // PCM_BYTES_PER_SAMPLE
+    for n in np.flatnonzero(~is_pcm):
+        audio_path = manifest.audio_path(n)
+        header = storage.read_header(audio_path, WAV_HEADER_BYTES)
+        num_samples[n] = _num_samples_from_header(header, int(manifest.num_bytes[n]), audio_path, SAMPLE_RATE)
+    return (num_samples // HOP_LENGTH + 1).tolist()
+
+
 def get_sample_lengths(korspeech_dataset):
-    fileid_to_target_length = {}
-    
-    def _etri_target_length(filename: str):
-        pass
-    def _diquest_length(filename: str):
-        pass
-    def _hallym_target_length(filename: str):
-        pass
-    def _solugate_target_length(filename: str):
-        if filename not in fileid_to_target_length:
-            subset_type, index = filename.split("_")      
-
-            index = int(index)-1
-            parent = korspeech_dataset.dataset_path
-            subdir = f"{subset_type}_{(index//SUBDIR_GETTER)+1:02d}"
-            filename_with_ext = f"{subdir}_scripts{korspeech_dataset._ext_txt}"
-
-            filepath = os.path.join(parent, subdir, filename_with_ext)
-
-            with open(filepath) as f:
-                for line in f:
-                    audio_default_path, transcript = line.split(" :: ", 1)
-                    fileid_text = audio_default_path.split("/", 6)[-1].split(".")[0]
-                    transcript = cleanup_transcript(transcript.strip())
-                    if transcript is not None:
-                        fileid_to_target_length[fileid_text] = len(transcript)
-
-        return fileid_to_target_length[filename]
-
-    if isinstance(korspeech_dataset, solugate_converspeech.SOLUGATESPEECH):
-        return [_solugate_target_length(filename) for filename in korspeech_dataset._walker]
-    elif isinstance(korspeech_dataset, diquest_normalspeech.DIQUESTSPEECH):
-        return [_diquest_length(filename) for filename in korspeech_dataset._walker]
-    elif isinstance(korspeech_dataset, hallym_dysarthricspeech.KORDYSARTHRICSPEECH):
-        return [_hallym_target_length(filename) for filename in korspeech_dataset._walker]
-    elif isinstance(korspeech_dataset, hallym_dysarthricspeech.KORDYSARTHRICSPEECH):
-        return [_etri_target_length(filename) for filename in korspeech_dataset._walker]
-
-class CustomBucketDataset(torch.utils.data.Dataset):
+    """Target length of every utterance.
+
+    Corpus datasets read all transcripts in bulk when building their manifest (one pass over ETRI's
+    ``.trn`` file and Solugate's script files, a process pool over DiQuest and Hallym JSON labels), and
+    the manifest is cached next to the dataset, so lengths come from it without opening any file.
+    """
+    if isinstance(korspeech_dataset, TokenizedDataset):
+        korspeech_dataset = korspeech_dataset.dataset
+    if isinstance(korspeech_dataset, FeatureCacheDataset):
+        return korspeech_dataset.target_lengths.tolist()
+    elif isinstance(
+        korspeech_dataset,
+        (
+            etri_converspeech.ETRISPEECH,
+            solugate_converspeech.SOLUGATESPEECH,
+            diquest_normalspeech.DIQUESTSPEECH,
+            hallym_dysarthricspeech.KORDYSARTHRICSPEECH,
+        ),
+    ):
+        return korspeech_dataset._manifest.target_lengths.tolist()
+    else:
+        raise ValueError(f"Encountered unsupported dataset {type(korspeech_dataset).__name__}.")
+
+
+class BucketBatchSampler(torch.utils.data.Sampler):
+    """Yields batches of indices of length-bucketed utterances, one batch per rank and step.
+
+    Utterances are bucketed by frames when known (by target length otherwise) and batched within each
+    bucket under the limits of :py:func:`_batch_by_cost`. Batches are then sorted by padded cost and
+    consecutive runs of ``num_replicas`` batches form a step, so ranks run batches of similar cost at
+    every step; steps are shuffled. Every rank computes the same steps from ``seed`` and the epoch, and the
+    batch list is padded by repetition to a whole number of steps, as with ``DistributedSampler``.
+
+    Args:
+        lengths (list of int): Target length of every utterance.
+        max_tokens (int): Maximum sum of target lengths in a batch.
+        num_buckets (int): Number of length buckets.
+        shuffle (bool, optional): Whether to shuffle utterances within buckets and the order of steps. (Default: ``False``)
+        batch_size (int or None, optional): Maximum number of utterances in a batch. (Default: ``None``)
+        frames (list of int or None, optional): Feature frames of every utterance. (Default: ``None``)
+        max_frames (int or None, optional): Maximum padded frames in a batch. (Default: ``None``)
+        max_joiner_elements (int or None, optional): Maximum padded joiner output size of a batch. (Default: ``None``)
+        num_replicas (int or None, optional): Number of ranks; taken from ``torch.distributed`` if ``None``.
+        rank (int or None, optional): Rank of this process; taken from ``torch.distributed`` if ``None``.
+        seed (int, optional): Base seed, combined with the epoch. (Default: 0)
+    """
+
     def __init__(
         self,
-        dataset,
         lengths,
         max_tokens,
         num_buckets,
         shuffle=False,
         batch_size=None,
+        frames=None,
+        max_frames=None,
+        max_joiner_elements=None,
+        num_replicas=None,
+        rank=None,
+        seed=0,
     ):
-        super().__init__()
-
-        assert len(dataset) == len(lengths)
-
-        self.dataset = dataset
-
-        max_length = max(lengths)
-        min_length = min(lengths)
-
-        assert max_tokens >= max_length
-
-        buckets = torch.linspace(min_length, max_length, num_buckets)
-        lengths = torch.tensor(lengths)
-        bucket_assignments = torch.bucketize(lengths, buckets)
-
-        idx_length_buckets = [(idx, length, bucket_assignments[idx]) for idx, length in enumerate(lengths)]
-        if shuffle:
-            idx_length_buckets = random.sample(idx_length_buckets, len(idx_length_buckets))
-        else:
-            idx_length_buckets = sorted(idx_length_buckets, key=lambda x: x[1], reverse=True)
-
-        sorted_idx_length_buckets = sorted(idx_length_buckets, key=lambda x: x[2])
-        self.batches = _batch_by_token_count(
-            [(idx, length) for idx, length, _ in sorted_idx_length_buckets],
-            max_tokens,
-            batch_size=batch_size,
-        )
+        if frames is None and (max_frames or max_joiner_elements):
+            raise ValueError("Frame counts are required to limit batches by frames or joiner size.")
+        num_too_long = sum(length > max_tokens for length in lengths)
+        if num_too_long:
+            # ``_batch_by_cost`` gives each of them a batch of its own.
+            logger.warning(f"{num_too_long} utterances have more than {max_tokens} target tokens and are batched alone")
+
+        distributed = torch.distributed.is_available() and torch.distributed.is_initialized()
+        self.num_replicas = num_replicas if num_replicas is not None else (torch.distributed.get_world_size() if distributed else 1)
+        self.rank = rank if rank is not None else (torch.distributed.get_rank() if distributed else 0)
+        self.lengths = lengths
+        self.frames = frames if frames is not None else [0] * len(lengths)
+        self.max_tokens = max_tokens
+        self.batch_size = batch_size
+        self.max_frames = max_frames
+        self.max_joiner_elements = max_joiner_elements
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self.start_step = 0
+        self._steps = None
+
+        # Compute and memory of the encoder scale with frames, so utterances are bucketed by audio length when known.
+        bucket_keys = lengths if frames is None else frames
+        boundaries = torch.linspace(min(bucket_keys), max(bucket_keys), num_buckets)
+        bucket_assignments = torch.bucketize(torch.tensor(bucket_keys), boundaries).tolist()
+        buckets = {}
+        for idx in sorted(range(len(lengths)), key=lambda idx: bucket_keys[idx], reverse=True):
+            buckets.setdefault(bucket_assignments[idx], []).append(idx)
+        self.buckets = [buckets[bucket] for bucket in sorted(buckets)]
+
+    def set_epoch(self, epoch):
+        if epoch != self.epoch:
+            self._steps = None
+        self.epoch = epoch
+
+    def state_dict(self):
+        return {"epoch": self.epoch, "step": self.start_step}
+
+    def load_state_dict(self, state_dict):
+        """Resume at step ``state_dict["step"]`` of epoch ``state_dict["epoch"]`` on the next iteration."""
+        self.set_epoch(state_dict["epoch"])
+        self.start_step = state_dict["step"]
+
+    def _batch_cost(self, batch):
+        if self.max_joiner_elements:
+            return _joiner_elements(
+                len(batch), max(self.frames[idx] for idx in batch), max(self.lengths[idx] for idx in batch)
+            )
+        if self.max_frames:
+            return len(batch) * max(self.frames[idx] for idx in batch)
+        return sum(self.lengths[idx] for idx in batch)
+
+    def _get_steps(self):
+        if self._steps is not None:
+            return self._steps
+
+        rng = random.Random(self.seed + self.epoch)
+        batches = []
+        for bucket in self.buckets:
+            if self.shuffle:
+                bucket = rng.sample(bucket, len(bucket))
+            batches += _batch_by_cost(
+                [(idx, self.lengths[idx], self.frames[idx]) for idx in bucket],
+                self.max_tokens,
+                batch_size=self.batch_size,
+                max_frames=self.max_frames,
+                max_joiner_elements=self.max_joiner_elements,
+            )
+
+        padding = -len(batches) % self.num_replicas
+        batches += (batches * math.ceil(padding / len(batches)))[:padding]
+        batches.sort(key=self._batch_cost)
+        steps = [batches[start:start + self.num_replicas] for start in range(0, len(batches), self.num_replicas)]
+        if self.shuffle:
+            rng.shuffle(steps)
+        self._steps = steps
+        return steps
+
+    def __iter__(self):
+        steps = self._get_steps()
+        start_step, self.start_step = self.start_step, 0
+        for step in steps[start_step:]:
+            yield step[self.rank]
 
-    def __getitem__(self, idx):
-        return [self.dataset[subidx] for subidx in self.batches[idx]]
+    def __len__(self):
+        return len(self._get_steps())
+
+
+class MixtureBatchSampler(torch.utils.data.Sampler):
+    """Interleaves the batches of one :py:class:`BucketBatchSampler` per corpus of a ``ConcatDataset``.
+
+    At every step a corpus is drawn with probability proportional to ``weight ** (1 / temperature)``
+    and its sampler's next batch is yielded, offset into the ``ConcatDataset``; each batch therefore
+    comes from a single corpus and stays length-homogeneous. Sources are iterated lazily, and a source
+    that runs out before the epoch ends starts over with a different shuffle. An epoch has as many
+    steps as all sources together. Draws depend only on ``seed`` and the epoch, so every rank picks the
+    same corpus at the same step.
+
+    Args:
+        samplers (list of BucketBatchSampler): Batch sampler of every corpus, in ``ConcatDataset`` order.
+        dataset_sizes (list of int): Number of utterances of every corpus.
+        weights (list of float or None, optional): Sampling weight of every corpus; corpus sizes if ``None``.
+        temperature (float, optional): Values above 1 flatten the distribution towards uniform. (Default: 1.0)
+        shuffle (bool, optional): Whether to draw sources at random. If ``False``, every source is
+            iterated once, in order. (Default: ``True``)
+        seed (int, optional): Base seed, combined with the epoch. (Default: 0)
+    """
+
+    # Sub-epochs of a source within one epoch, which must stay below this for shuffles not to collide.
+    _MAX_CYCLES = 1000
+
+    def __init__(self, samplers, dataset_sizes, weights=None, temperature=1.0, shuffle=True, seed=0):
+        if weights is not None and len(weights) != len(samplers):
+            raise ValueError(f"Expected {len(samplers)} corpus weights, but got {len(weights)}.")
+        self.samplers = samplers
+        self.offsets = [sum(dataset_sizes[:source]) for source in range(len(dataset_sizes))]
+        weights = torch.tensor(dataset_sizes if weights is None else weights, dtype=torch.float64)
+        probs = weights ** (1 / temperature)
+        self.probs = (probs / probs.sum()).tolist()
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self.start_step = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def state_dict(self):
+        return {"epoch": self.epoch, "step": self.start_step}
+
+    def load_state_dict(self, state_dict):
+        """Resume at step ``state_dict["step"]`` of epoch ``state_dict["epoch"]`` on the next iteration."""
+        self.set_epoch(state_dict["epoch"])
+        self.start_step = state_dict["step"]
+
+    def _iter_source(self, source):
+        sampler = self.samplers[source]
+        cycles = range(self._MAX_CYCLES) if self.shuffle else range(1)
+        for cycle in cycles:
+            sampler.set_epoch(self.epoch * self._MAX_CYCLES + cycle)
+            for batch in sampler:
+                yield [self.offsets[source] + idx for idx in batch]
+
+    def _iter_batches(self):
+        if not self.shuffle:
+            for source in range(len(self.samplers)):
+                yield from self._iter_source(source)
+            return
+
+        rng = random.Random(self.seed + self.epoch)
+        sources = rng.choices(range(len(self.samplers)), weights=self.probs, k=len(self))
+        iterators = [self._iter_source(source) for source in range(len(self.samplers))]
+        for source in sources:
+            yield next(iterators[source])
+
+    def __iter__(self):
+        start_step, self.start_step = self.start_step, 0
+        for step, batch in enumerate(self._iter_batches()):
+            # Skipped batches are still drawn so that sources and their samplers advance as in the original run.
+            if step >= start_step:
+                yield batch
 
     def __len__(self):
-        return len(self.batches)
+        # The number of batches of a source varies with its shuffle, so the first sub-epoch of each source sets it.
+        for sampler in self.samplers:
+            sampler.set_epoch(self.epoch * self._MAX_CYCLES)
+        return sum(len(sampler) for sampler in self.samplers)
 
 
 class TransformDataset(torch.utils.data.Dataset):
@@ -126,8 +327,6 @@ class TransformDataset(torch.utils.data.Dataset):
 
 
 class korSpeechDataModule(LightningDataModule):
-    etrispeech_cls = etri_converspeech.ETRISPEECH
-
     def __init__(
         self,
         *,
@@ -140,9 +339,25 @@ class korSpeechDataModule(LightningDataModule):
         train_num_buckets=50,
         train_shuffle=True,
         num_workers=2,
+        train_shards_path=None,
+        features_path=None,
+        max_frames=None,
+        max_joiner_elements=None,
+        corpora=(CORPUS_ETRI,),
+        corpus_weights=None,
+        temperature=1.0,
+        sp_model_path=None,
+        speed_factors=None,
+        augmented_features=False,
     ):
         super().__init__()
+        if train_shards_path and features_path:
+            raise ValueError("Shards hold raw audio and cannot be combined with precomputed features.")
+        if features_path and len(corpora) > 1:
+            raise ValueError("A feature cache holds a single corpus and cannot be mixed with other corpora.")
         self.korspeech_path = korspeech_path
+        self.train_datasets = None
+        self.val_datasets = None
         self.train_dataset_lengths = None
         self.val_dataset_lengths = None
         self.train_transform = train_transform
@@ -153,62 +368,168 @@ class korSpeechDataModule(LightningDataModule):
         self.train_num_buckets = train_num_buckets
         self.train_shuffle = train_shuffle
         self.num_workers = num_workers
+        self.train_shards_path = train_shards_path
+        self.train_shards_dataset = None
+        self.features_path = features_path
+        self.max_frames = max_frames
+        self.max_joiner_elements = max_joiner_elements
+        self.train_dataset_frames = None
+        self.val_dataset_frames = None
+        self.train_batch_sampler = None
+        self.val_batch_sampler = None
+        self.train_resume_state = None
+        self.corpora = list(corpora)
+        self.corpus_weights = corpus_weights
+        self.temperature = temperature
+        self.sp_model_path = sp_model_path
+        # Speed-perturbed variants of the training features written by ``feature_cache.py``, read as separate sources.
+        self.speed_factors = list(speed_factors) if speed_factors else [1.0]
+        # Whether those variants are the noise/reverb-augmented ones, which ``feature_cache.py`` keeps apart from clean ones.
+        self.augmented_features = augmented_features
+
+    def _tokenize(self, dataset):
+        # Token ids are encoded once and cached next to the manifest or feature cache they come from.
+        if isinstance(dataset, FeatureCacheDataset):
+            cache_path = os.path.join(dataset.features_dir, TOKENS_FILENAME)
+            ids, transcripts = dataset._walker, dataset.transcripts
+        else:
+            manifest = dataset._manifest
+            cache_path = f"{os.path.splitext(manifest.path)[0]}.{TOKENS_FILENAME}"
+            ids, transcripts = manifest.ids, manifest.transcripts
+        return TokenizedDataset(dataset, load_or_encode_targets(cache_path, ids, transcripts, self.sp_model_path))
+
+    def _get_datasets(self, training):
+        if self.features_path:
+            speed_factors, augmented = (self.speed_factors, self.augmented_features) if training else ([1.0], False)
+            datasets = [
+                FeatureCacheDataset(get_features_dir(self.features_path, training, speed_factor, augmented))
+                for speed_factor in speed_factors
+            ]
+        else:
+            datasets = [get_corpus(name, self.korspeech_path, training) for name in self.corpora]
+        if self.sp_model_path is not None:
+            datasets = [self._tokenize(dataset) for dataset in datasets]
+        return datasets
+
+    def _get_dataset_frames(self, datasets):
+        if not (self.max_frames or self.max_joiner_elements):
+            return [None] * len(datasets)
+        return [get_sample_frames(dataset) for dataset in datasets]
+
+    def _sharded_train_dataloader(self):
+        if self.train_shards_dataset is None:
+            self.train_shards_dataset = ShardedIterableDataset(
+                self.train_shards_path,
+                self.max_tokens,
+                batch_size=self.batch_size,
+                shuffle=self.train_shuffle,
+            )
+        if self.trainer is not None:
+            self.train_shards_dataset.set_epoch(self.trainer.current_epoch)
+
+        # Items are already batches, so the transform is applied to each of them as is.
+        return torch.utils.data.DataLoader(
+            self.train_shards_dataset,
+            num_workers=self.num_workers,
+            batch_size=None,
+            collate_fn=self.train_transform,
+        )
 
-    def train_dataloader(self):
-        datasets = [
-            self.etrispeech_cls(self.korspeech_path, True),
+    def _get_batch_sampler(self, datasets, lengths, frames, num_buckets, shuffle):
+        samplers = [
+            BucketBatchSampler(
+                source_lengths,
+                self.max_tokens,
+                num_buckets,
+                shuffle=shuffle,
+                batch_size=self.batch_size,
+                frames=source_frames,
+                max_frames=self.max_frames,
+                max_joiner_elements=self.max_joiner_elements,
+                seed=source,
+            )
+            for source, (source_lengths, source_frames) in enumerate(zip(lengths, frames))
         ]
+        if len(samplers) == 1:
+            return samplers[0]
+        return MixtureBatchSampler(
+            samplers,
+            [len(dataset) for dataset in datasets],
+            weights=self.corpus_weights,
+            temperature=self.temperature,
+            shuffle=shuffle,
+        )
+
+    def state_dict(self):
+        if self.trainer is None or self.train_batch_sampler is None:
+            return {}
+        # Batches finished in the current epoch, so a mid-epoch checkpoint resumes at the next batch.
+        step = self.trainer.fit_loop.epoch_loop.batch_progress.current.completed
+        return {"epoch": self.trainer.current_epoch, "step": step}
+
+    def load_state_dict(self, state_dict):
+        self.train_resume_state = state_dict or None
+
+    def train_dataloader(self):
+        if self.train_shards_path:
+            return self._sharded_train_dataloader()
+
+        # Dataloaders are reloaded every epoch, but the datasets and the sampler only need to be built once.
+        if not self.train_datasets:
+            self.train_datasets = self._get_datasets(True)
+        datasets = self.train_datasets
 
         if not self.train_dataset_lengths:
             self.train_dataset_lengths = [get_sample_lengths(dataset) for dataset in datasets]
+        if not self.train_dataset_frames:
+            self.train_dataset_frames = self._get_dataset_frames(datasets)
+
+        if self.train_batch_sampler is None:
+            self.train_batch_sampler = self._get_batch_sampler(
+                datasets, self.train_dataset_lengths, self.train_dataset_frames, self.train_num_buckets, self.train_shuffle
+            )
+        epoch = self.trainer.current_epoch if self.trainer is not None else 0
+        self.train_batch_sampler.set_epoch(epoch)
+        if self.train_resume_state is not None:
+            if self.train_resume_state["epoch"] == epoch:
+                self.train_batch_sampler.load_state_dict(self.train_resume_state)
+            self.train_resume_state = None
 
-        dataset = torch.utils.data.ConcatDataset(
-            [
-                CustomBucketDataset(
-                    dataset,
-                    lengths,
-                    self.max_tokens,
-                    self.train_num_buckets,
-                    batch_size=self.batch_size,
-                )
-                for dataset, lengths in zip(datasets, self.train_dataset_lengths)
-            ]
-        )
-        dataset = TransformDataset(dataset, self.train_transform)
         dataloader = torch.utils.data.DataLoader(
-            dataset,
+            torch.utils.data.ConcatDataset(datasets),
+            batch_sampler=self.train_batch_sampler,
+            collate_fn=self.train_transform,
             num_workers=self.num_workers,
-            batch_size=None,
-            shuffle=self.train_shuffle,
         )
         return dataloader
 
     def val_dataloader(self):
-        datasets = [
-            self.etrispeech_cls(self.korspeech_path, False),
-        ]
+        if not self.val_datasets:
+            self.val_datasets = self._get_datasets(False)
+        datasets = self.val_datasets
 
         if not self.val_dataset_lengths:
             self.val_dataset_lengths = [get_sample_lengths(dataset) for dataset in datasets]
+        if not self.val_dataset_frames:
+            self.val_dataset_frames = self._get_dataset_frames(datasets)
 
-        dataset = torch.utils.data.ConcatDataset(
-            [
-                CustomBucketDataset(
-                    dataset,
-                    lengths,
-                    self.max_tokens,
-                    1,
-                    batch_size=self.batch_size,
-                )
-                for dataset, lengths in zip(datasets, self.val_dataset_lengths)
-            ]
+        if self.val_batch_sampler is None:
+            self.val_batch_sampler = self._get_batch_sampler(
+                datasets, self.val_dataset_lengths, self.val_dataset_frames, 1, False
+            )
+
+        dataloader = torch.utils.data.DataLoader(
+            torch.utils.data.ConcatDataset(datasets),
+            batch_sampler=self.val_batch_sampler,
+            collate_fn=self.val_transform,
+            num_workers=self.num_workers,
         )
-        dataset = TransformDataset(dataset, self.val_transform)
-        dataloader = torch.utils.data.DataLoader(dataset, batch_size=None, num_workers=self.num_workers)
         return dataloader
 
     def test_dataloader(self):
-        dataset = self.etrispeech_cls(self.korspeech_path, False)
+        dataset = torch.utils.data.ConcatDataset(
+            [get_corpus(name, self.korspeech_path, False) for name in self.corpora]
+        )
         dataset = TransformDataset(dataset, self.test_transform)
         dataloader = torch.utils.data.DataLoader(dataset, batch_size=None)
         return dataloader
@@ -1,12 +1,12 @@
 import os
-import multiprocessing as mp
 import json
+from functools import partial
 from pathlib import Path
-from typing import Tuple
+from typing import Iterator, Optional, Tuple
 
 from torch import Tensor
 from torch.utils.data import Dataset
-from untar_unzip import _extract_zip, _load_waveform
+from untar_unzip import _extract_zip
 from script_normalization import diquest_speech_normalize
 
 from common import(
@@ -14,18 +14,20 @@ from common import(
     TRAIN_SUBDIR_NAME,
     VALID_SUBDIR_NAME,
 )
+from manifest import directory_sources, get_manifest_path, load_or_build_manifest, parallel_map
+from storage import FileStorage
 
 SUBDIR_HEADER = '일반남여'
 
-def _get_script_from_json(transcript_path):
-    with open(transcript_path) as f:
+def _get_script_from_json(transcript_path, storage: FileStorage):
+    with storage.open(transcript_path) as f:
         data = json.load(f)
         modified_line = diquest_speech_normalize(data['발화정보']['stt'].strip('\\'))
     
     return modified_line
 
 
-def _unpack_diquestSpeech(source_path: str | Path, n_directories_stripped: int=0):
+def _unpack_diquestSpeech(source_path: str | Path, n_directories_stripped: int=0, storage: Optional[FileStorage] = None):
     ext_archive = ".zip"
         
     zip_files = Path(source_path).glob(f"*{ext_archive}")
@@ -35,13 +37,11 @@ def _unpack_diquestSpeech(source_path: str | Path, n_directories_stripped: int=0
     for file in zip_files:
         args.append((file.as_posix(), source_path, False, n_directories_stripped))
     
-    pool = mp.Pool(min(mp.cpu_count(), len(args)))
-    
-    pool.starmap(_extract_zip, args, chunksize=1)
+    (storage or FileStorage()).unpack(_extract_zip, args)
 
 
 def _get_korConverseSpeech_metadata(
-    filename: str, dataset_path: str, ext_audio: str, ext_script: str,
+    filename: str, dataset_path: str, ext_audio: str, ext_script: str, storage: FileStorage,
 ) -> Tuple[str, int, str]:
 
     transcript_filename = filename+ext_script
@@ -53,7 +53,7 @@ def _get_korConverseSpeech_metadata(
     audio_filepath = os.path.join(dataset_path, subdir_name, audio_filename)
 
     # Load text
-    transcript = _get_script_from_json(transcript_path)
+    transcript = _get_script_from_json(transcript_path, storage)
     if transcript is None:
         # Translation not found
         raise FileNotFoundError(f"Translation not found for {filename}")
@@ -65,11 +65,24 @@ def _get_korConverseSpeech_metadata(
     )
 
 
+def _scan_diquestSpeech(
+    dataset_path: str, ext_audio: str, ext_script: str, storage: FileStorage,
+) -> Iterator[Tuple[str, str, str]]:
+    file_names = [Path(path).stem for path in storage.glob(dataset_path, "*/*"+ext_audio)]
+    get_metadata = partial(
+        _get_korConverseSpeech_metadata, dataset_path=dataset_path, ext_audio=ext_audio, ext_script=ext_script, storage=storage
+    )
+    for file_name, (audio_filepath, _, transcript) in zip(file_names, parallel_map(get_metadata, file_names)):
+        yield file_name, audio_filepath, transcript
+
+
 class DIQUESTSPEECH(Dataset):
     """
     Args:
         root (str or Path): Path to the directory where the dataset is found or downloaded.
-        subset_type (str): Type of subset to be trained on.
+        training (bool): Whether to load the training or the validation split.
+        storage (FileStorage, optional): Backend used to read archives and files.
+            Pass :py:class:`storage.ArchiveStorage` to read audio without extracting archives. (default: ``None``)
     """
 
     _ext_script = ".json"
@@ -79,8 +92,10 @@ class DIQUESTSPEECH(Dataset):
         self,
         root: str | Path,
         training: bool,
+        storage: Optional[FileStorage] = None,
     ) -> None:
         self.root = os.fspath(root)
+        self.storage = storage if storage is not None else FileStorage()
         
         if training:
             dataset_path = os.path.join(root, TRAIN_SUBDIR_NAME)
@@ -89,14 +104,16 @@ class DIQUESTSPEECH(Dataset):
             
         self.dataset_path = dataset_path
 
-        _unpack_diquestSpeech(self.dataset_path)
-        
-        audio_files_path = Path(self.dataset_path).glob("*/*"+self._ext_audio)
+        _unpack_diquestSpeech(self.dataset_path, storage=self.storage)
         
-        self._walker = []
-
-        for path in audio_files_path:
-            self._walker.append(path.stem)                     
+        self._manifest = load_or_build_manifest(
+            get_manifest_path(self.dataset_path, "diquest" + self.storage.manifest_suffix),
+            self.dataset_path,
+            directory_sources(self.dataset_path),
+            lambda: _scan_diquestSpeech(self.dataset_path, self._ext_audio, self._ext_script, self.storage),
+            self.storage.getsize,
+        )
+        self._walker = self._manifest.ids
 
     def get_metadata(self, n: int) -> Tuple[str, int, str]:
         """Get metadata for the n-th sample from the dataset. Returns filepath instead of waveform,
@@ -115,8 +132,11 @@ class DIQUESTSPEECH(Dataset):
             str:
                 Transcript
         """
-        file_name = self._walker[n]
-        return _get_korConverseSpeech_metadata(file_name, self.dataset_path, self._ext_audio, self._ext_script)
+        return (
+            self._manifest.audio_path(n),
+            SAMPLE_RATE,
+            self._manifest.transcripts[n],
+        )
 
     def __getitem__(self, n: int) -> Tuple[Tensor, int, str]:
         """Load the n-th sample from the dataset.
@@ -135,7 +155,7 @@ class DIQUESTSPEECH(Dataset):
                 Transcript
         """
         metadata = self.get_metadata(n)
-        waveform = _load_waveform(metadata[0], metadata[1])
+        waveform = self.storage.load_waveform(metadata[0], metadata[1])
         return (waveform, ) + metadata[1:]
 
     def __len__(self) -> int:
@@ -1,13 +1,16 @@
 import os
-import multiprocessing as mp
+from functools import partial
 from pathlib import Path
-from typing import Tuple
+from typing import Iterator, Optional, Tuple
 
 from torch import Tensor
 from torch.utils.data import Dataset
-from untar_unzip import _extract_zip, _load_waveform
-from script_normalization import etri_normalize
+from untar_unzip import _extract_zip
+from script_normalization import etri_normalize_utterance, etri_normalize_variants, etri_normalize_version
 from common import SAMPLE_RATE
+from manifest import get_manifest_path, load_or_build_manifest
+from storage import FileStorage
+from transcript_cache import load_or_normalize
 
 _NAME_HEADER = 'KsponSpeech'
 _VAL_DATA_DIR = '평가용_데이터'
@@ -23,13 +26,14 @@ def _get_all_scripts(transcript_filepath, separator):
     new_list = []
     with open(transcript_filepath) as f:
         for line in f:
-            modified_line = etri_normalize(line.split(separator, 1)[-1].strip())
-            if modified_line is not None:
-                new_list.append(modified_line)
+            # Both forms of numbers, since training targets use either depending on the utterance.
+            variants = etri_normalize_variants(line.split(separator, 1)[-1].strip())
+            if variants is not None:
+                new_list.extend(dict.fromkeys(variants))
         return new_list
 
 
-def _unpack_speechData(source_path: str | Path, n_directories_stripped: int = 0):
+def _unpack_speechData(source_path: str | Path, n_directories_stripped: int = 0, storage: Optional[FileStorage] = None):
     ext_archive = '.zip'
         
     zip_files = Path(source_path).glob(f"*{ext_archive}")
@@ -39,46 +43,48 @@ def _unpack_speechData(source_path: str | Path, n_directories_stripped: int = 0)
     for file in zip_files:
         args.append((file.as_posix(), source_path, False, n_directories_stripped))
     
-    pool = mp.Pool(min(mp.cpu_count(), len(args)))
-    
-    pool.starmap(_extract_zip, args, chunksize=1)
-
-
-def _get_etrispeech_metadata(
-    file_idx: str, dataset_path: str, ext_audio: str, ext_txt: str,
-) -> Tuple[str, int, str]:
-    
-    index_subdir_getter = int(1000)
-
-    index = int(file_idx)-1
-
-    transcript_filename = f"{_NAME_HEADER}_{file_idx}{ext_txt}"
-    audio_filename = f"{_NAME_HEADER}_{file_idx}{ext_audio}"
-    
-    indexed_dir = f"{_NAME_HEADER}_{(index//index_subdir_getter)+1:04d}"
-    
-    transcript_filepath = os.path.join(dataset_path, indexed_dir, transcript_filename)
-    audio_filepath = os.path.join(dataset_path, indexed_dir, audio_filename)
-
-    # Load text
-    with open(transcript_filepath) as f:
-        transcript = etri_normalize(f.readline().strip())
-        if transcript is None:
-            # Translation not found
-            raise FileNotFoundError(f"Translation not found for {transcript_filepath}")
-    
-    return (
-        audio_filepath,
-        SAMPLE_RATE,
-        transcript,
+    (storage or FileStorage()).unpack(_extract_zip, args)
+
+
+def _scan_etrispeech(
+    scripts_filepath: str,
+    dataset_path: str,
+    separator: str,
+    storage: FileStorage,
+    transcripts_cache_path: str,
+    spelling_seed: int,
+) -> Iterator[Tuple[str, str, str]]:
+    file_ids, audio_filepaths, raw_transcripts = [], [], []
+    with storage.open(scripts_filepath) as f:
+        for line in f:
+            relative_path, transcript = line.split(separator, 1)
+            relative_path = relative_path.strip()
+            file_ids.append(Path(relative_path).stem.split('_')[-1])
+            # Paths in the script file keep the archive's top directory, which is stripped on extraction.
+            audio_filepaths.append(os.path.join(dataset_path, relative_path.split('/', 1)[-1]))
+            raw_transcripts.append(transcript.strip())
+
+    transcripts = load_or_normalize(
+        transcripts_cache_path,
+        file_ids,
+        raw_transcripts,
+        partial(etri_normalize_utterance, seed=spelling_seed),
+        etri_normalize_version(spelling_seed),
     )
+    for file_idx, audio_filepath, transcript in zip(file_ids, audio_filepaths, transcripts):
+        if transcript is not None:
+            yield file_idx, audio_filepath, transcript
 
 
 class ETRISPEECH(Dataset):
     """
     Args:
         root (str or Path): Path to the directory where the dataset is found or downloaded.
-        subset_type (str): Type of subset to be trained on.
+        training (bool): Whether to load the training or the evaluation split.
+        storage (FileStorage, optional): Backend used to read archives and files.
+            Pass :py:class:`storage.ArchiveStorage` to read audio without extracting archives. (default: ``None``)
+        spelling_seed (int, optional): Seed of the per-utterance choice between the written and phonetic
+            form of numbers in transcripts, see :py:func:`script_normalization.spelling_choice`. (default: ``0``)
     """
 
     _ext_txt = ".txt"
@@ -89,11 +95,14 @@ class ETRISPEECH(Dataset):
         self,
         root: str | Path,
         training: bool,
+        storage: Optional[FileStorage] = None,
+        spelling_seed: int = 0,
     ) -> None:
         scripts_dataset_path = os.path.join(root, _SCRIPTS_FILES_DIR)
         
         self.root = os.fspath(root)
         self.scripts_dataset_path = scripts_dataset_path
+        self.storage = storage if storage is not None else FileStorage()
 
         if training:
             audio_dataset_path = os.path.join(root, _TRAIN_DATA_DIR)
@@ -104,14 +113,25 @@ class ETRISPEECH(Dataset):
             
         self.audio_dataset_path = audio_dataset_path
 
-        _unpack_speechData(scripts_dataset_path)
-        _unpack_speechData(audio_dataset_path, n_directories_stripped=1)
+        _unpack_speechData(scripts_dataset_path, storage=self.storage)
+        _unpack_speechData(audio_dataset_path, n_directories_stripped=1, storage=self.storage)
         
         scripts_filepath = os.path.join(scripts_dataset_path, scripts_filename)
-
-        with open(scripts_filepath) as f:
-            self._walker = [Path(line.split('::')[0].strip()).stem.split('_')[-1] for line in f]
-                                   
+        # Transcripts depend on the spelling seed, so each seed has its own manifest.
+        manifest_name = Path(scripts_filename).stem + (f".seed{spelling_seed}" if spelling_seed else "")
+        transcripts_cache_path = get_manifest_path(audio_dataset_path, manifest_name + ".transcripts")
+
+        self._manifest = load_or_build_manifest(
+            get_manifest_path(audio_dataset_path, manifest_name + self.storage.manifest_suffix),
+            audio_dataset_path,
+            [scripts_filepath, audio_dataset_path],
+            lambda: _scan_etrispeech(
+                scripts_filepath, audio_dataset_path, '::', self.storage, transcripts_cache_path, spelling_seed
+            ),
+            self.storage.getsize,
+            etri_normalize_version(spelling_seed),
+        )
+        self._walker = self._manifest.ids
 
     def get_metadata(self, n: int) -> Tuple[str, int, str]:
         """Get metadata for the n-th sample from the dataset. Returns filepath instead of waveform,
@@ -130,8 +150,11 @@ class ETRISPEECH(Dataset):
             str:
                 Transcript
         """
-        file_index = self._walker[n]
-        return _get_etrispeech_metadata(file_index, self.dataset_path, self._ext_audio, self._ext_txt)
+        return (
+            self._manifest.audio_path(n),
+            SAMPLE_RATE,
+            self._manifest.transcripts[n],
+        )
 
     def __getitem__(self, n: int) -> Tuple[Tensor, int, str]:
         """Load the n-th sample from the dataset.
@@ -150,7 +173,7 @@ class ETRISPEECH(Dataset):
                 Transcript
         """
         metadata = self.get_metadata(n)
-        waveform = _load_waveform(metadata[0], metadata[1])
+        waveform = self.storage.load_waveform(metadata[0], metadata[1])
         return (waveform, ) + metadata[1:]
 
     def __len__(self) -> int:
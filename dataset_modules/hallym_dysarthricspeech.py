@@ -1,28 +1,31 @@
 import os
-import multiprocessing as mp
 import json
+from functools import partial
 from pathlib import Path
-from typing import Tuple
+from typing import Iterator, Optional, Tuple
 
 from torch import Tensor
 from torch.utils.data import Dataset
-from untar_unzip import _extract_zip, _load_waveform
+from untar_unzip import _extract_zip
 from common import(
     SAMPLE_RATE,
     TRAIN_SUBDIR_NAME,
     VALID_SUBDIR_NAME,
 )
+from manifest import directory_sources, get_manifest_path, load_or_build_manifest, parallel_map
+from resample_cache import ResampledAudio, get_resampled_dir
+from storage import FileStorage
 
 TOP_SUBDIR_NAME = "01.데이터"
 LABEL_DIR_NAME = "라벨링데이터"
 SOURCE_DIR_NAME = "원천데이터"
 
-def _get_script_from_json(transcript_path):
-    with open(transcript_path) as f:
+def _get_script_from_json(transcript_path, storage: FileStorage):
+    with storage.open(transcript_path) as f:
         data = json.load(f)
         return data['Transcript'].strip()
 
-def _unpack_dysarthricSpeech(datasets_parentPath, n_directories_stripped: int=1):
+def _unpack_dysarthricSpeech(datasets_parentPath, n_directories_stripped: int=1, storage: Optional[FileStorage] = None):
     ext_archive = ".zip"
 
     zip_files = Path(datasets_parentPath).glob(f"*/*{ext_archive}")
@@ -30,15 +33,13 @@ def _unpack_dysarthricSpeech(datasets_parentPath, n_directories_stripped: int=1)
     args = []
     
     for file in zip_files:
-        args.append((file.as_posix(), file.with_suffix("").as_posix(), n_directories_stripped))
+        args.append((file.as_posix(), file.with_suffix("").as_posix(), False, n_directories_stripped))
     
-    pool = mp.Pool(min(mp.cpu_count(), len(args)))
-    
-    pool.starmap(_extract_zip, args, chunksize=1)
+    (storage or FileStorage()).unpack(_extract_zip, args)
 
 
 def _get_korDysarthricSpeech_metadata(
-    relative_filepath: str, dataset_path: str, ext_audio: str, ext_script: str
+    relative_filepath: str, dataset_path: str, ext_audio: str, ext_script: str, storage: FileStorage
 ) -> Tuple[str, int, str]:
     
     audio_relative_filepath = f"{relative_filepath}{ext_audio}"
@@ -47,7 +48,7 @@ def _get_korDysarthricSpeech_metadata(
     audio_filepath = os.path.join(dataset_path, SOURCE_DIR_NAME, audio_relative_filepath)
     transcript_filepath = os.path.join(dataset_path, LABEL_DIR_NAME, script_relative_filepath)
     
-    transcript = _get_script_from_json(transcript_filepath)
+    transcript = _get_script_from_json(transcript_filepath, storage)
 
     return (
         audio_filepath,
@@ -56,12 +57,32 @@ def _get_korDysarthricSpeech_metadata(
     )
 
 
+def _scan_korDysarthricSpeech(
+    dataset_path: str, audio_dataset_path: str, ext_audio: str, ext_script: str, storage: FileStorage,
+) -> Iterator[Tuple[str, str, str]]:
+    audio_filepaths = list(storage.glob(audio_dataset_path, "*/*"+ext_audio))
+    relative_filepaths = [
+        Path(audio_filepath).relative_to(audio_dataset_path).as_posix().rsplit(".")[0] for audio_filepath in audio_filepaths
+    ]
+    get_metadata = partial(
+        _get_korDysarthricSpeech_metadata, dataset_path=dataset_path, ext_audio=ext_audio, ext_script=ext_script, storage=storage
+    )
+    for relative_filepath, audio_filepath, (_, _, transcript) in zip(
+        relative_filepaths, audio_filepaths, parallel_map(get_metadata, relative_filepaths)
+    ):
+        yield relative_filepath, audio_filepath, transcript
+
+
 class KORDYSARTHRICSPEECH(Dataset):
     """
     Args:
         root (str or Path): Path to the directory where the dataset is found or downloaded.
         folder_in_archive (str, optional):
             The top-level directory of the dataset. (default: ````)
+        storage (FileStorage, optional): Backend used to read archives and files.
+            Pass :py:class:`storage.ArchiveStorage` to read audio without extracting archives. (default: ``None``)
+        use_resampled (bool, optional): Serve 16 kHz audio written by ``resample_cache.py`` when it matches
+            the split, instead of resampling the 44.1 kHz source on every access. (default: ``True``)
     """
 
     _ext_json = ".json"
@@ -71,9 +92,12 @@ class KORDYSARTHRICSPEECH(Dataset):
         self,
         root: str | Path,
         training: bool,
+        storage: Optional[FileStorage] = None,
+        use_resampled: bool = True,
     ) -> None:
 
         self.root = os.fspath(root)
+        self.storage = storage if storage is not None else FileStorage()
         
         if training:
             dataset_path = os.path.join(root, TOP_SUBDIR_NAME, f"1.{TRAIN_SUBDIR_NAME}")
@@ -83,11 +107,18 @@ class KORDYSARTHRICSPEECH(Dataset):
         self.dataset_path = dataset_path
         self.audio_dataset_path = os.path.join(self.dataset_path, SOURCE_DIR_NAME)
         
-        _unpack_dysarthricSpeech(self.dataset_path)
-
-        audio_files_path = Path(self.audio_dataset_path).glob("*/*"+self._ext_audio)
+        _unpack_dysarthricSpeech(self.dataset_path, storage=self.storage)
 
-        self._walker = [audio_filepath.relative_to(self.audio_dataset_path).as_posix().rsplit(".")[0] for audio_filepath in audio_files_path]
+        self._manifest = load_or_build_manifest(
+            get_manifest_path(self.dataset_path, "dysarthric" + self.storage.manifest_suffix),
+            self.dataset_path,
+            directory_sources(self.audio_dataset_path) + directory_sources(os.path.join(self.dataset_path, LABEL_DIR_NAME)),
+            lambda: _scan_korDysarthricSpeech(self.dataset_path, self.audio_dataset_path, self._ext_audio, self._ext_json, self.storage),
+            self.storage.getsize,
+        )
+        self._walker = self._manifest.ids
+        self.resampled_dir = get_resampled_dir(self.dataset_path)
+        self._resampled = ResampledAudio.load(self.resampled_dir, self._manifest) if use_resampled else None
 
 
     def get_metadata(self, n: int) -> Tuple[str, int, str]:
@@ -107,8 +138,11 @@ class KORDYSARTHRICSPEECH(Dataset):
             str:
                 Transcript
         """
-        relative_filepath = self._walker[n]
-        return _get_korDysarthricSpeech_metadata(relative_filepath, self.dataset_path, self._ext_audio, self._ext_json)
+        return (
+            self._manifest.audio_path(n),
+            SAMPLE_RATE,
+            self._manifest.transcripts[n],
+        )
 
 
     def __getitem__(self, n: int) -> Tuple[Tensor, int, str]:
@@ -128,7 +162,10 @@ class KORDYSARTHRICSPEECH(Dataset):
                 Transcript
         """
         metadata = self.get_metadata(n)
-        waveform = _load_waveform(metadata[0], metadata[1])
+        if self._resampled is not None:
+            waveform = self._resampled[n]
+        else:
+            waveform = self.storage.load_waveform(metadata[0], metadata[1])
         return (waveform, ) + metadata[1:]
 
 
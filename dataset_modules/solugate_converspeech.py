@@ -1,17 +1,20 @@
 import os
-import multiprocessing as mp
+from functools import partial
 from pathlib import Path
-from typing import Tuple
+from typing import Iterator, Optional, Tuple
 
 from torch import Tensor
 from torch.utils.data import Dataset
-from untar_unzip import _extract_tar, _load_waveform
-from script_normalization import etri_normalize
+from untar_unzip import _extract_tar
+from script_normalization import etri_normalize_utterance, etri_normalize_variants, etri_normalize_version
 from common import(
     SAMPLE_RATE,
     TRAIN_SUBDIR_NAME,
     VALID_SUBDIR_NAME,
 )
+from manifest import directory_sources, get_manifest_path, load_or_build_manifest, parallel_map
+from storage import FileStorage
+from transcript_cache import load_or_normalize
 
 _DATA_SUBSETS = [
     "broadcast",
@@ -32,13 +35,14 @@ def _get_all_scripts(transcript_path, separator):
     new_list = list()
     with open(transcript_path) as f:
         for line in f:
-            modified_line = etri_normalize(line.split(separator, 1)[-1].strip())
-            if modified_line is not None:
-                new_list.append(modified_line)
+            # Both forms of numbers, since training targets use either depending on the utterance.
+            variants = etri_normalize_variants(line.split(separator, 1)[-1].strip())
+            if variants is not None:
+                new_list.extend(dict.fromkeys(variants))
         return new_list
 
 
-def _unpack_solugateSpeech(source_path: str | Path, subset_type: str, n_directories_stripped: int=9):
+def _unpack_solugateSpeech(source_path: str | Path, subset_type: str, n_directories_stripped: int=9, storage: Optional[FileStorage] = None):
     ext_archive = '.tar'
         
     if subset_type == 'all':
@@ -51,45 +55,48 @@ def _unpack_solugateSpeech(source_path: str | Path, subset_type: str, n_director
     for file in tar_files:
         args.append((file.as_posix(), source_path, False, n_directories_stripped))
     
-    pool = mp.Pool(min(mp.cpu_count(), len(args)))
-    
-    pool.starmap(_extract_tar, args, chunksize=1)
-
-
-def _get_korConverseSpeech_metadata(
-    filename: str, dataset_path: str, ext_audio: str, ext_txt: str,
-) -> Tuple[str, int, str]:
-    subset_type, index = filename.split("_")
-
-    index = int(index)-1
-
-    transcript_file = filename+ext_txt
-    audio_file = filename+ext_audio
-    subset_subdir = f"{subset_type}_{(index//SUBDIR_GETTER)+1:02d}"
-    indexed_dir = f"{(index//INDEX_SUBDIR_GETTER)+1:03d}"
-    
-    transcript_filepath = os.path.join(dataset_path, subset_subdir, indexed_dir, transcript_file)
-    audio_filepath = os.path.join(dataset_path, subset_subdir, indexed_dir, audio_file)
-
-    # Load text
-    with open(transcript_filepath) as f:
-        transcript = etri_normalize(f.readline().strip())
-        if transcript is None:
-            # Translation not found
-            raise FileNotFoundError(f"Translation not found for {filename}")
-
-    return (
-        audio_filepath,
-        SAMPLE_RATE,
-        transcript,
+    (storage or FileStorage()).unpack(_extract_tar, args)
+
+
+def _read_raw_transcript(audio_filepath: str, ext_txt: str, storage: FileStorage) -> str:
+    with storage.open(Path(audio_filepath).with_suffix(ext_txt).as_posix()) as f:
+        return f.readline().strip()
+
+
+def _scan_solugateSpeech(
+    dataset_path: str,
+    audio_pattern: str,
+    ext_txt: str,
+    storage: FileStorage,
+    transcripts_cache_path: str,
+    spelling_seed: int,
+) -> Iterator[Tuple[str, str, str]]:
+    audio_filepaths = list(storage.rglob(dataset_path, audio_pattern))
+    file_ids = [Path(audio_filepath).stem for audio_filepath in audio_filepaths]
+    raw_transcripts = list(parallel_map(partial(_read_raw_transcript, ext_txt=ext_txt, storage=storage), audio_filepaths))
+
+    transcripts = load_or_normalize(
+        transcripts_cache_path,
+        file_ids,
+        raw_transcripts,
+        partial(etri_normalize_utterance, seed=spelling_seed),
+        etri_normalize_version(spelling_seed),
     )
+    for file_id, audio_filepath, transcript in zip(file_ids, audio_filepaths, transcripts):
+        if transcript is not None:
+            yield file_id, audio_filepath, transcript
 
 
 class SOLUGATESPEECH(Dataset):
     """
     Args:
         root (str or Path): Path to the directory where the dataset is found or downloaded.
+        training (bool): Whether to load the training or the validation split.
         subset_type (str): Type of subset to be trained on.
+        storage (FileStorage, optional): Backend used to read archives and files.
+            Pass :py:class:`storage.ArchiveStorage` to read audio without extracting archives. (default: ``None``)
+        spelling_seed (int, optional): Seed of the per-utterance choice between the written and phonetic
+            form of numbers in transcripts, see :py:func:`script_normalization.spelling_choice`. (default: ``0``)
     """
 
     _ext_txt = ".txt"
@@ -100,8 +107,11 @@ class SOLUGATESPEECH(Dataset):
         root: str | Path,
         training: bool,
         subset_type: str,
+        storage: Optional[FileStorage] = None,
+        spelling_seed: int = 0,
     ) -> None:
         self.root = os.fspath(root)
+        self.storage = storage if storage is not None else FileStorage()
         self.subset_type = subset_type.lower()
         
         if training:
@@ -113,20 +123,31 @@ class SOLUGATESPEECH(Dataset):
 
         assert(self.subset_type in _DATA_SUBSETS)
 
-        _unpack_solugateSpeech(self.dataset_path, self.subset_type)
+        _unpack_solugateSpeech(self.dataset_path, self.subset_type, storage=self.storage)
         
         if self.subset_type == "all":
-            audio_files_path = Path(self.dataset_path).rglob("*"+self._ext_audio)
+            audio_pattern = "*"+self._ext_audio
         else:
-            audio_files_path = Path(self.dataset_path).rglob(f"{subset_type}_*"+self._ext_audio)
-        
-        self._walker = []
-
-        for path in audio_files_path:
-            with open(path.with_suffix(self._ext_txt)) as f:
-                transcript = etri_normalize(f.readline().strip())
-                if transcript is not None:
-                    self._walker.append(path.stem)                        
+            audio_pattern = f"{self.subset_type}_*"+self._ext_audio
+
+        # Transcripts depend on the spelling seed, so each seed has its own manifest.
+        manifest_name = self.subset_type + (f".seed{spelling_seed}" if spelling_seed else "")
+        self._manifest = load_or_build_manifest(
+            get_manifest_path(self.dataset_path, manifest_name + self.storage.manifest_suffix),
+            self.dataset_path,
+            directory_sources(self.dataset_path),
+            lambda: _scan_solugateSpeech(
+                self.dataset_path,
+                audio_pattern,
+                self._ext_txt,
+                self.storage,
+                get_manifest_path(self.dataset_path, manifest_name + ".transcripts"),
+                spelling_seed,
+            ),
+            self.storage.getsize,
+            etri_normalize_version(spelling_seed),
+        )
+        self._walker = self._manifest.ids
 
     def get_metadata(self, n: int) -> Tuple[str, int, str]:
         """Get metadata for the n-th sample from the dataset. Returns filepath instead of waveform,
@@ -145,8 +166,11 @@ class SOLUGATESPEECH(Dataset):
             str:
                 Transcript
         """
-        file_name = self._walker[n]
-        return _get_korConverseSpeech_metadata(file_name, self.dataset_path, self._ext_audio, self._ext_txt)
+        return (
+            self._manifest.audio_path(n),
+            SAMPLE_RATE,
+            self._manifest.transcripts[n],
+        )
 
     def __getitem__(self, n: int) -> Tuple[Tensor, int, str]:
         """Load the n-th sample from the dataset.
@@ -165,7 +189,7 @@ class SOLUGATESPEECH(Dataset):
                 Transcript
         """
         metadata = self.get_metadata(n)
-        waveform = _load_waveform(metadata[0], metadata[1])
+        waveform = self.storage.load_waveform(metadata[0], metadata[1])
         return (waveform, ) + metadata[1:]
 
     def __len__(self) -> int:
@@ -0,0 +1,171 @@
+from typing import TYPE_CHECKING, Dict, List, NamedTuple, Optional, Tuple
+
+import torch
+
+if TYPE_CHECKING:
+    # Only needed for annotations, which keeps torchaudio out of ``runtime.py``.
+    from torchaudio.models import RNNT
+
+# Predictor output and LSTM state of a single hypothesis, shapes (1, 1, D) and (1, H) per layer and gate.
+_PredictorState = Tuple[torch.Tensor, List[List[torch.Tensor]]]
+
+
+class GreedySearchState(NamedTuple):
+    """Tokens emitted so far for every utterance, with the predictor output `(B, 1, D)` and LSTM state after them."""
+
+    hypotheses: List[List[int]]
+    pred_out: torch.Tensor
+    state: List[List[torch.Tensor]]
+
+
+class BatchedGreedyDecoder:
+    r"""Greedy RNN-T decoding that advances every utterance of a batch together.
+
+    Every utterance is encoded on its own unpadded features, since padding frames of a batch would leak
+    into shorter utterances through the encoder's convolutions and make the output depend on the batch.
+    At each encoder frame the joiner runs on the utterances that may still emit, and the predictor runs
+    only on those that emitted a non-blank token; other utterances keep their predictor output and state.
+    Predictor outputs and states are cached by token prefix, so utterances (or later batches) starting
+    with the same tokens share predictor steps. The cache assumes fixed weights; call :py:meth:`reset`
+    after the model changes.
+
+    Args:
+        model (RNNT): Transducer to decode with, or any module with its ``transcribe``, ``predict`` and
+            ``join`` methods.
+        blank (int): Index of the blank symbol.
+        max_symbols_per_frame (int, optional): Maximum number of tokens emitted for one encoder frame. (Default: 10)
+        cache_size (int, optional): Maximum number of cached non-empty prefixes, at least the batch size;
+            the least recently used are evicted first. (Default: 4096)
+    """
+
+    def __init__(self, model: "RNNT", blank: int, max_symbols_per_frame: int = 10, cache_size: int = 4096):
+        if cache_size < 1:
+            raise ValueError(f"cache_size must be positive, but got {cache_size}.")
+        self.model = model
+        self.blank = blank
+        self.max_symbols_per_frame = max_symbols_per_frame
+        self.cache_size = cache_size
+        # Predictor output and state before any token, which every search starts from and is never evicted.
+        self._root: Optional[_PredictorState] = None
+        # Ordered from least to most recently used.
+        self._cache: Dict[Tuple[int, ...], _PredictorState] = {}
+
+    def reset(self):
+        self._root = None
+        self._cache = {}
+
+    def _evict(self):
+        while len(self._cache) > self.cache_size:
+            self._cache.pop(next(iter(self._cache)))
+
+    def _initial_state(self, batch_size: int, device: torch.device) -> _PredictorState:
+        if self._root is None or self._root[0].device != device:
+            self.reset()
+            targets = torch.tensor([[self.blank]], device=device)
+            pred_out, _, state = self.model.predict(targets, torch.ones(1, dtype=torch.int32, device=device), None)
+            self._root = (pred_out, state)
+        pred_out, state = self._root
+        return pred_out.repeat(batch_size, 1, 1), [[gate.repeat(batch_size, 1) for gate in layer] for layer in state]
+
+    def _advance(
+        self, indices: List[int], hypotheses: List[List[int]], pred_out: torch.Tensor, state: List[List[torch.Tensor]]
+    ):
+        # Updates ``pred_out`` and ``state`` in place for utterances ``indices``, whose hypotheses just grew by one token.
+        # Prefixes of this step are marked as most recently used and nothing is evicted until all of them are read.
+        misses = []
+        for n in indices:
+            prefix = tuple(hypotheses[n])
+            if prefix in self._cache:
+                self._cache[prefix] = self._cache.pop(prefix)
+            else:
+                misses.append(n)
+        if misses:
+            device = pred_out.device
+            miss_idx = torch.tensor(misses, device=device)
+            targets = torch.tensor([[hypotheses[n][-1]] for n in misses], device=device)
+            miss_state = [[gate[miss_idx] for gate in layer] for layer in state]
+            new_pred_out, _, new_state = self.model.predict(
+                targets, torch.ones(len(misses), dtype=torch.int32, device=device), miss_state
+            )
+            for row, n in enumerate(misses):
+                self._cache[tuple(hypotheses[n])] = (
+                    new_pred_out[row : row + 1],
+                    [[gate[row : row + 1] for gate in layer] for layer in new_state],
+                )
+
+        for n in indices:
+            cached_pred_out, cached_state = self._cache[tuple(hypotheses[n])]
+            pred_out[n] = cached_pred_out[0]
+            for layer, cached_layer in zip(state, cached_state):
+                for gate, cached_gate in zip(layer, cached_layer):
+                    gate[n] = cached_gate[0]
+        self._evict()
+
+    @torch.no_grad()
+    def start(self, batch_size: int, device: torch.device) -> GreedySearchState:
+        """Search state of ``batch_size`` utterances that have not seen any encoder frame yet."""
+        if batch_size > self.cache_size:
+            raise ValueError(f"cache_size {self.cache_size} is smaller than the batch size {batch_size}.")
+        pred_out, state = self._initial_state(batch_size, device)
+        return GreedySearchState([[] for _ in range(batch_size)], pred_out, state)
+
+    @torch.no_grad()
+    def search(self, encoder_out: torch.Tensor, encoder_lengths: torch.Tensor, search_state: GreedySearchState):
+        r"""Advance ``search_state`` in place over encoder frames, e.g. the next chunk of a stream.
+
+        Args:
+            encoder_out (torch.Tensor): Encoder output, with shape `(B, T, D)`.
+            encoder_lengths (torch.Tensor): Number of valid frames of every utterance, with shape `(B,)`.
+            search_state (GreedySearchState): State returned by :py:meth:`start` or advanced by earlier calls.
+        """
+        device = encoder_out.device
+        hypotheses, pred_out, state = search_state
+        for t in range(int(encoder_lengths.max()) if encoder_lengths.numel() else 0):
+            active = (encoder_lengths > t).nonzero().squeeze(1)
+            for _ in range(self.max_symbols_per_frame):
+                if active.numel() == 0:
+                    break
+                ones = torch.ones(active.numel(), dtype=torch.int32, device=device)
+                joined, _, _ = self.model.join(encoder_out[active, t : t + 1], ones, pred_out[active], ones)
+                tokens = joined[:, 0, 0].argmax(-1)
+                emitted = tokens != self.blank
+                active, tokens = active[emitted], tokens[emitted]
+
+                indices = active.tolist()
+                for n, token in zip(indices, tokens.tolist()):
+                    hypotheses[n].append(token)
+                self._advance(indices, hypotheses, pred_out, state)
+
+    @torch.no_grad()
+    def encode(self, features: torch.Tensor, feature_lengths: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        r"""Encode every utterance on its own unpadded features and pad the encoder outputs into a batch.
+
+        Args:
+            features (torch.Tensor): Features, with shape `(B, T, D)`.
+            feature_lengths (torch.Tensor): Number of valid frames of every utterance, with shape `(B,)`.
+
+        Returns:
+            (torch.Tensor, torch.Tensor): Encoder output, with shape `(B, T', D')`, and valid frames of each, `(B,)`.
+        """
+        encoder_outs, encoder_lengths = [], []
+        for n, length in enumerate(feature_lengths.tolist()):
+            encoder_out, encoder_length = self.model.transcribe(features[n : n + 1, :length], feature_lengths[n : n + 1])
+            encoder_outs.append(encoder_out[0, : int(encoder_length[0])])
+            encoder_lengths.append(encoder_length)
+        return torch.nn.utils.rnn.pad_sequence(encoder_outs, batch_first=True), torch.cat(encoder_lengths)
+
+    @torch.no_grad()
+    def __call__(self, features: torch.Tensor, feature_lengths: torch.Tensor) -> List[List[int]]:
+        r"""Decode a padded batch of features.
+
+        Args:
+            features (torch.Tensor): Features, with shape `(B, T, D)`.
+            feature_lengths (torch.Tensor): Number of valid frames of every utterance, with shape `(B,)`.
+
+        Returns:
+            list of list of int: Emitted tokens of every utterance, without blanks.
+        """
+        encoder_out, encoder_lengths = self.encode(features, feature_lengths)
+        search_state = self.start(encoder_out.size(0), encoder_out.device)
+        self.search(encoder_out, encoder_lengths, search_state)
+        return search_state.hypotheses
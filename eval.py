@@ -1,46 +1,241 @@
+#!/usr/bin/env python3
+"""Evaluate a checkpoint on the validation split of one or more corpora.
+
+Utterances are decoded in length-sorted batches while DataLoader workers prepare the next ones, and
+scored in a process pool. One JSON line per utterance is appended to ``--output-path``; when that file
+already exists, utterances listed in it are skipped and their errors count towards the totals, so an
+interrupted run can be resumed. WER is computed over whitespace-separated words and CER over characters
+with whitespace removed. ``--max-utterances`` evaluates a fixed random subset, e.g. to compare
+``--quantization dynamic`` against fp32 with ``benchmarks/quantization.py``.
+
+Example:
+python eval.py --checkpoint-path ./exp/checkpoints/last.ckpt --korspeech-path ./speech_data \\
+    --sp-model-path ./baseline.model --corpora etri diquest --output-path ./exp/eval.jsonl
+"""
+
+import json
 import logging
+import multiprocessing as mp
+import os
 import pathlib
-from argparse import ArgumentParser
+import time
+from argparse import ArgumentParser, RawTextHelpFormatter
+from collections import deque
+from typing import List, Optional, Sequence, Set, Tuple
 
+import numpy as np
 import sentencepiece as spm
 
 import torch
-import torchaudio
-from lightning import ConformerRNNTModule
-from transforms import get_data_module
+from corpora import CORPORA, CORPUS_ETRI, get_corpus
+from data_module import BucketBatchSampler, get_sample_lengths
+from common import HOP_LENGTH, SAMPLE_RATE
+from lightning import DECODING_BEAM, DECODING_GREEDY, QUANTIZATION_DYNAMIC, QUANTIZATION_NONE, ConformerRNNTModule
+from transforms import ValTransform
 
 
 logger = logging.getLogger()
 
+_LOG_INTERVAL = 100
+
+
+def _edit_distance(ref: np.ndarray, hyp: np.ndarray) -> int:
+    # Levenshtein distance one reference token (row) at a time. Insertions along a row are resolved with a
+    # running minimum, min_k(row[k] + j - k) = min.accumulate(row - j) + j, so each row is a few numpy ops.
+    positions = np.arange(len(hyp) + 1)
+    row = positions.copy()
+    for i, token in enumerate(ref, 1):
+        substitution = row[:-1] + (hyp != token)
+        next_row = np.empty_like(row)
+        next_row[0] = i
+        next_row[1:] = np.minimum(row[1:] + 1, substitution)
+        row = np.minimum.accumulate(next_row - positions) + positions
+    return int(row[-1])
+
+
+def _word_ids(words: Sequence[str], vocabulary: dict) -> np.ndarray:
+    return np.array([vocabulary.setdefault(word, len(vocabulary)) for word in words], dtype=np.int64)
+
+
+def _char_ids(text: str) -> np.ndarray:
+    return np.frombuffer("".join(text.split()).encode("utf-32-le"), dtype=np.uint32)
+
 
 def compute_word_level_distance(seq1, seq2):
-    return torchaudio.functional.edit_distance(seq1.lower().split(), seq2.lower().split())
+    vocabulary = {}
+    return _edit_distance(_word_ids(seq1.lower().split(), vocabulary), _word_ids(seq2.lower().split(), vocabulary))
 
 
-def run_eval(args):
-    sp_model = spm.SentencePieceProcessor(model_file=str(args.sp_model_path))
-    model = ConformerRNNTModule.load_from_checkpoint(args.checkpoint_path, sp_model=sp_model).eval()
-    data_module = get_data_module(str(args.librispeech_path), str(args.global_stats_path), str(args.sp_model_path))
+def compute_char_level_distance(seq1, seq2):
+    return _edit_distance(_char_ids(seq1), _char_ids(seq2))
+
+
+def _score_batch(utterances: List[Tuple[str, str, str]]) -> List[dict]:
+    results = []
+    for utterance_id, reference, hypothesis in utterances:
+        results.append(
+            {
+                "id": utterance_id,
+                "reference": reference,
+                "hypothesis": hypothesis,
+                "word_errors": compute_word_level_distance(reference, hypothesis),
+                "words": len(reference.split()),
+                "char_errors": compute_char_level_distance(reference, hypothesis),
+                "chars": len(_char_ids(reference)),
+            }
+        )
+    return results
+
+
+class _Totals:
+    def __init__(self):
+        self.utterances = 0
+        self.word_errors = 0
+        self.words = 0
+        self.char_errors = 0
+        self.chars = 0
+
+    def add(self, result: dict):
+        self.utterances += 1
+        self.word_errors += result["word_errors"]
+        self.words += result["words"]
+        self.char_errors += result["char_errors"]
+        self.chars += result["chars"]
+
+    def __str__(self):
+        return (
+            f"{self.utterances} utterances; WER: {self.word_errors / max(self.words, 1)}; "
+            f"CER: {self.char_errors / max(self.chars, 1)}"
+        )
 
+
+def _read_finished(output_path: str, totals: _Totals, selected_ids: Set[str]) -> Set[str]:
+    # Results of utterances outside ``selected_ids``, e.g. from a run with another ``--seed``, are kept in
+    # the file but not counted.
+    finished = set()
+    if not os.path.isfile(output_path):
+        return finished
+    with open(output_path, "rb+") as f:
+        valid_bytes = 0
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # An interrupted run can leave a partial last line behind.
+                break
+            if result["id"] in selected_ids:
+                finished.add(result["id"])
+                totals.add(result)
+            valid_bytes += len(line)
+        f.truncate(valid_bytes)
+    return finished
+
+
+class _IndexedDataset(torch.utils.data.Dataset):
+    def __init__(self, dataset, indices: List[int]):
+        self.dataset = dataset
+        self.indices = indices
+
+    def __getitem__(self, n: int):
+        return self.indices[n], self.dataset[self.indices[n]]
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+
+class _EvalCollate:
+    def __init__(self, transform: ValTransform):
+        self.transform = transform
+
+    def __call__(self, items):
+        indices, samples = zip(*items)
+        return list(indices), self.transform(list(samples)), [sample[2] for sample in samples]
+
+
+class _Timing:
+    def __init__(self):
+        self.decode_seconds = 0.0
+        self.audio_seconds = 0.0
+
+    @property
+    def real_time_factor(self) -> float:
+        return self.decode_seconds / max(self.audio_seconds, 1e-9)
+
+    def __str__(self):
+        return (
+            f"decoded {self.audio_seconds:.1f} s of audio in {self.decode_seconds:.1f} s; "
+            f"real-time factor: {self.real_time_factor}"
+        )
+
+
+def run_eval(args) -> Tuple[_Totals, _Timing]:
+    sp_model = spm.SentencePieceProcessor(model_file=str(args.sp_model_path))
+    model = ConformerRNNTModule.load_from_checkpoint(args.checkpoint_path, sp_model=sp_model, map_location="cpu").eval()
+    if args.quantization != QUANTIZATION_NONE:
+        if args.use_cuda:
+            raise ValueError("Quantized models only run on CPU.")
+        model.quantize(args.quantization)
     if args.use_cuda:
         model = model.to(device="cuda")
 
-    total_edit_distance = 0
-    total_length = 0
-    dataloader = data_module.test_dataloader()
-    with torch.no_grad():
-        for idx, (batch, sample) in enumerate(dataloader):
-            actual = sample[0][2]
-            predicted = model(batch)
-            total_edit_distance += compute_word_level_distance(actual, predicted)
-            total_length += len(actual.split())
-            if idx % 100 == 0:
-                logger.warning(f"Processed elem {idx}; WER: {total_edit_distance / total_length}")
-    logger.warning(f"Final WER: {total_edit_distance / total_length}")
+    datasets = [get_corpus(name, args.korspeech_path, False) for name in args.corpora]
+    utterance_ids = [f"{name}/{file_id}" for name, dataset in zip(args.corpora, datasets) for file_id in dataset._walker]
+    lengths = [length for dataset in datasets for length in get_sample_lengths(dataset)]
+    selected = range(len(utterance_ids))
+    if args.max_utterances is not None and args.max_utterances < len(utterance_ids):
+        # A seeded subset, so that resumed runs and runs of different models see the same utterances.
+        rng = np.random.default_rng(args.seed)
+        selected = np.sort(rng.choice(len(utterance_ids), args.max_utterances, replace=False)).tolist()
 
+    totals, timing = _Totals(), _Timing()
+    finished = _read_finished(str(args.output_path), totals, {utterance_ids[n] for n in selected})
+    pending = [n for n in selected if utterance_ids[n] not in finished]
+    if finished:
+        logger.warning(f"Resuming after {len(finished)} finished utterances; {totals}")
+    if not pending:
+        logger.warning(f"Final {totals}")
+        return totals, timing
 
-def cli_main():
-    parser = ArgumentParser()
+    batch_sampler = BucketBatchSampler(
+        [lengths[n] for n in pending], args.max_tokens, 1, batch_size=args.batch_size, num_replicas=1, rank=0
+    )
+    dataloader = torch.utils.data.DataLoader(
+        _IndexedDataset(torch.utils.data.ConcatDataset(datasets), pending),
+        batch_sampler=batch_sampler,
+        collate_fn=_EvalCollate(ValTransform(str(args.global_stats_path), str(args.sp_model_path))),
+        num_workers=args.num_workers,
+        pin_memory=args.use_cuda,
+    )
+
+    def write_results(f, scored):
+        for result in scored.get():
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+            totals.add(result)
+            if totals.utterances % _LOG_INTERVAL == 0:
+                logger.warning(f"Processed {totals}")
+        f.flush()
+
+    with open(args.output_path, "a") as f, mp.Pool(args.scoring_workers) as pool, torch.no_grad():
+        in_flight = deque()
+        for indices, batch, references in dataloader:
+            start = time.perf_counter()
+            hypotheses = model.decode(batch, beam_width=args.beam_width, method=args.decoding)
+            timing.decode_seconds += time.perf_counter() - start
+            timing.audio_seconds += int(batch.feature_lengths.sum()) * HOP_LENGTH / SAMPLE_RATE
+            utterances = [(utterance_ids[n], ref, hyp) for n, ref, hyp in zip(indices, references, hypotheses)]
+            in_flight.append(pool.apply_async(_score_batch, (utterances,)))
+            # Results are written in decoding order, as soon as scoring catches up.
+            while in_flight and in_flight[0].ready():
+                write_results(f, in_flight.popleft())
+        while in_flight:
+            write_results(f, in_flight.popleft())
+
+    logger.warning(f"Final {totals}; {timing}")
+    return totals, timing
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = ArgumentParser(description=__doc__, formatter_class=RawTextHelpFormatter)
     parser.add_argument(
         "--checkpoint-path",
         type=pathlib.Path,
@@ -54,9 +249,9 @@ def cli_main():
         help="Path to JSON file containing feature means and stddevs.",
     )
     parser.add_argument(
-        "--librispeech-path",
+        "--korspeech-path",
         type=pathlib.Path,
-        help="Path to LibriSpeech datasets.",
+        help="Path to Korean speech datasets.",
         required=True,
     )
     parser.add_argument(
@@ -65,15 +260,85 @@ def cli_main():
         help="Path to SentencePiece model.",
         required=True,
     )
+    parser.add_argument(
+        "--corpora",
+        nargs="+",
+        default=[CORPUS_ETRI],
+        choices=CORPORA,
+        help="Corpora whose validation split is evaluated. (Default: etri)",
+    )
+    parser.add_argument(
+        "--output-path",
+        default=pathlib.Path("eval.jsonl"),
+        type=pathlib.Path,
+        help="JSONL file of per-utterance results, resumed if it exists. (Default: './eval.jsonl')",
+    )
+    parser.add_argument(
+        "--max-tokens",
+        default=700,
+        type=int,
+        help="Maximum sum of reference lengths in a batch. (Default: 700)",
+    )
+    parser.add_argument(
+        "--batch-size",
+        default=None,
+        type=int,
+        help="Maximum number of utterances in a batch. (Default: no limit)",
+    )
+    parser.add_argument(
+        "--decoding",
+        default=DECODING_BEAM,
+        choices=[DECODING_BEAM, DECODING_GREEDY],
+        help="Beam search per utterance, or batched greedy decoding. (Default: beam)",
+    )
+    parser.add_argument(
+        "--beam-width",
+        default=20,
+        type=int,
+        help="Beam width of the beam search. (Default: 20)",
+    )
+    parser.add_argument(
+        "--num-workers",
+        default=4,
+        type=int,
+        help="Number of DataLoader workers loading audio and computing features. (Default: 4)",
+    )
+    parser.add_argument(
+        "--scoring-workers",
+        default=4,
+        type=int,
+        help="Number of processes computing edit distances. (Default: 4)",
+    )
+    parser.add_argument(
+        "--quantization",
+        default=QUANTIZATION_NONE,
+        choices=[QUANTIZATION_NONE, QUANTIZATION_DYNAMIC],
+        help="Run in fp32, or with int8 weights for linear and LSTM layers (CPU only). (Default: none)",
+    )
+    parser.add_argument(
+        "--max-utterances",
+        default=None,
+        type=int,
+        help="Evaluate a random subset of this many utterances. (Default: all)",
+    )
+    parser.add_argument(
+        "--seed",
+        default=0,
+        type=int,
+        help="Seed of the subset drawn with --max-utterances. (Default: 0)",
+    )
     parser.add_argument(
         "--use-cuda",
         action="store_true",
         default=False,
         help="Run using CUDA.",
     )
-    args = parser.parse_args()
-    run_eval(args)
+    return parser.parse_args(argv)
+
+
+def cli_main():
+    run_eval(parse_args())
 
 
 if __name__ == "__main__":
-    cli_main()
\ No newline at end of file
+    cli_main()
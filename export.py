@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""Export a checkpoint as a self-contained TorchScript inference pipeline.
+
+The exported file holds feature extraction (mel spectrogram, ``piecewise_linear_log`` and global
+normalization), the Conformer encoder, predictor and joiner, with the SentencePiece model and decoding
+settings stored alongside, so ``runtime.py`` can decode from it without Lightning, torchaudio or the
+training code.
+
+Example:
+python export.py --checkpoint-path ./exp/checkpoints/last.ckpt --sp-model-path ./baseline.model \\
+    --output-path ./exp/model.ts
+"""
+
+import json
+import logging
+import pathlib
+from argparse import ArgumentParser, RawTextHelpFormatter
+from typing import List, Optional, Tuple
+
+import sentencepiece as spm
+import torch
+from common import SAMPLE_RATE, BatchedFeatureExtractor, GlobalStatsNormalization
+from lightning import ConformerRNNTModule
+from runtime import CONFIG_FILE, SP_MODEL_FILE
+from torchaudio.models import RNNT
+
+logger = logging.getLogger()
+
+
+class InferencePipeline(torch.nn.Module):
+    r"""Waveforms to encoder output, plus the predictor and joiner steps decoding needs.
+
+    Exposes ``predict`` and ``join`` with the signatures of :py:class:`torchaudio.models.RNNT`, so the
+    scripted pipeline can stand in for the model in :py:class:`decoding.BatchedGreedyDecoder`.
+
+    Args:
+        model (RNNT): Trained transducer.
+        global_stats_path (str): Path to JSON file containing feature means and stddevs.
+    """
+
+    def __init__(self, model: RNNT, global_stats_path: str):
+        super().__init__()
+        self.feature_extractor = BatchedFeatureExtractor()
+        self.normalization = GlobalStatsNormalization(global_stats_path)
+        self.model = model
+
+    def forward(self, waveforms: torch.Tensor, waveform_lengths: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Args:
+            waveforms (torch.Tensor): Padded 16 kHz waveforms, with shape `(B, S)`.
+            waveform_lengths (torch.Tensor): Number of valid samples of each waveform, with shape `(B,)`.
+
+        Returns:
+            (torch.Tensor, torch.Tensor): Encoder output, with shape `(B, T, D)`, and valid frames of each, `(B,)`.
+        """
+        features, feature_lengths = self.feature_extractor(waveforms, waveform_lengths)
+        return self.model.transcribe(self.normalization(features), feature_lengths)
+
+    @torch.jit.export
+    def transcribe(self, features: torch.Tensor, feature_lengths: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        return self.model.transcribe(features, feature_lengths)
+
+    @torch.jit.export
+    def predict(
+        self, targets: torch.Tensor, target_lengths: torch.Tensor, state: Optional[List[List[torch.Tensor]]]
+    ) -> Tuple[torch.Tensor, torch.Tensor, List[List[torch.Tensor]]]:
+        return self.model.predict(targets, target_lengths, state)
+
+    @torch.jit.export
+    def join(
+        self,
+        source_encodings: torch.Tensor,
+        source_lengths: torch.Tensor,
+        target_encodings: torch.Tensor,
+        target_lengths: torch.Tensor,
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        return self.model.join(source_encodings, source_lengths, target_encodings, target_lengths)
+
+
+def export_pipeline(module: ConformerRNNTModule, global_stats_path: str, sp_model_path: str, output_path: str):
+    """Script the inference pipeline of ``module`` and save it, with its SentencePiece model, to ``output_path``."""
+    pipeline = InferencePipeline(module.model, global_stats_path).eval()
+    scripted = torch.jit.freeze(torch.jit.script(pipeline), preserved_attrs=["transcribe", "predict", "join"])
+
+    sp_model = module.sp_model
+    config = {
+        "blank": module.blank_idx,
+        "sample_rate": SAMPLE_RATE,
+        "remove_ids": [sp_model.unk_id(), sp_model.eos_id(), sp_model.pad_id()],
+    }
+    with open(sp_model_path, "rb") as f:
+        extra_files = {SP_MODEL_FILE: f.read(), CONFIG_FILE: json.dumps(config)}
+    torch.jit.save(scripted, output_path, _extra_files=extra_files)
+
+
+def parse_args():
+    parser = ArgumentParser(description=__doc__, formatter_class=RawTextHelpFormatter)
+    parser.add_argument(
+        "--checkpoint-path",
+        type=pathlib.Path,
+        help="Path to checkpoint to export.",
+        required=True,
+    )
+    parser.add_argument(
+        "--global-stats-path",
+        default=pathlib.Path("global_stats.json"),
+        type=pathlib.Path,
+        help="Path to JSON file containing feature means and stddevs.",
+    )
+    parser.add_argument(
+        "--sp-model-path",
+        type=pathlib.Path,
+        help="Path to SentencePiece model.",
+        required=True,
+    )
+    parser.add_argument(
+        "--output-path",
+        default=pathlib.Path("model.ts"),
+        type=pathlib.Path,
+        help="File to save the scripted pipeline to. (Default: './model.ts')",
+    )
+    return parser.parse_args()
+
+
+def cli_main():
+    args = parse_args()
+    sp_model = spm.SentencePieceProcessor(model_file=str(args.sp_model_path))
+    module = ConformerRNNTModule.load_from_checkpoint(args.checkpoint_path, sp_model=sp_model, map_location="cpu").eval()
+    export_pipeline(module, str(args.global_stats_path), str(args.sp_model_path), str(args.output_path))
+    logger.warning(f"Saved scripted pipeline to {args.output_path}")
+
+
+if __name__ == "__main__":
+    cli_main()
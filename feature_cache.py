@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""Precompute log-mel features of a corpus into a memory-mapped cache.
+
+All frames of a split are stored back to back in one float16 array of shape ``(total_frames, 80)``
+(``features.f16``), next to an index of utterance ids, frame offsets, frame counts and transcripts
+(``index.npz``). Features are taken after ``piecewise_linear_log`` and before global normalization,
+so only normalization and SpecAugment remain to be done during training.
+
+With ``--speed-factors``, a speed-perturbed variant of the training split is written per factor (in
+``train-speed0.9`` and so on, ``train`` for 1.0), for training with ``--speed-factors`` in ``train.py``.
+Variants that are also reverberated or mixed with noise (``--rir-dir``, ``--noise-dir``) go to
+``train-speed1-aug``, ``train-speed0.9-aug`` and so on, so they never replace clean features, and are
+read with ``--augmented-features``. The augmentation settings are recorded in ``index.npz``.
+
+Example:
+python feature_cache.py --dataset etri --dataset-path "./speech_data/한국어 음성" --features-path ./features
+python feature_cache.py --dataset etri --dataset-path "./speech_data/한국어 음성" --features-path ./features \
+    --speed-factors 0.9 1.0 1.1 --noise-dir ./musan/noise
+"""
+
+import json
+import logging
+import os
+import pathlib
+from argparse import ArgumentParser, RawTextHelpFormatter
+from typing import Optional, Tuple
+
+import numpy as np
+import torch
+from augmentation import WaveformAugmentation, find_audio_files
+from common import SAMPLE_RATE, piecewise_linear_log, spectrogram_transform
+from manifest import _pack_strings, _unpack_strings
+from corpora import CORPORA, get_corpus
+
+logger = logging.getLogger()
+
+FEATURES_FILENAME = "features.f16"
+INDEX_FILENAME = "index.npz"
+TRAIN_FEATURES_DIR = "train"
+VALID_FEATURES_DIR = "valid"
+
+_NUM_MELS = 80
+
+
+def get_features_dir(features_path: str, training: bool, speed_factor: float = 1.0, augmented: bool = False) -> str:
+    """Directory of the features of a split, or of one of its speed-perturbed or noise/reverb-augmented variants."""
+    features_dir = os.path.join(features_path, TRAIN_FEATURES_DIR if training else VALID_FEATURES_DIR)
+    if augmented:
+        return f"{features_dir}-speed{speed_factor:g}-aug"
+    return features_dir if speed_factor == 1.0 else f"{features_dir}-speed{speed_factor:g}"
+
+
+class _LogMelDataset(torch.utils.data.Dataset):
+    def __init__(self, dataset, augmentation: Optional[WaveformAugmentation] = None, speed_factor: float = 1.0):
+        self.dataset = dataset
+        self.augmentation = augmentation
+        self.speed_factor = speed_factor
+
+    def __getitem__(self, n: int):
+        waveform = self.dataset[n][0]
+        if self.augmentation is not None:
+            waveform = self.augmentation(waveform, self.speed_factor)
+        mel_features = spectrogram_transform(waveform.squeeze()).transpose(1, 0)
+        return piecewise_linear_log(mel_features).to(torch.float16)
+
+    def __len__(self) -> int:
+        return len(self.dataset)
+
+
+def write_feature_cache(
+    dataset,
+    output_dir: str,
+    num_workers: int = 4,
+    augmentation: Optional[WaveformAugmentation] = None,
+    speed_factor: float = 1.0,
+) -> int:
+    """Compute log-mel features of every utterance of ``dataset`` and write them to ``output_dir``.
+
+    Args:
+        dataset: Corpus dataset with a manifest.
+        output_dir (str): Directory to write ``features.f16`` and ``index.npz`` to.
+        num_workers (int, optional): Number of DataLoader workers computing features. (Default: 4)
+        augmentation (WaveformAugmentation or None, optional): Applied to every waveform before its
+            features are computed, at ``speed_factor``. (Default: ``None``)
+        speed_factor (float, optional): Speed factor passed to ``augmentation``. (Default: 1.0)
+
+    Returns:
+        int: Total number of frames written.
+    """
+    manifest = dataset._manifest
+    os.makedirs(output_dir, exist_ok=True)
+
+    dataloader = torch.utils.data.DataLoader(
+        _LogMelDataset(dataset, augmentation, speed_factor), batch_size=None, num_workers=num_workers, prefetch_factor=8 if num_workers else None
+    )
+    lengths = np.zeros(len(manifest), dtype=np.int64)
+    features_path = os.path.join(output_dir, FEATURES_FILENAME)
+    with open(f"{features_path}.tmp", "wb") as f:
+        for n, features in enumerate(dataloader):
+            f.write(features.numpy().tobytes())
+            lengths[n] = features.shape[0]
+            if n % 10000 == 0:
+                logger.info(f"Extracted features of {n} utterances")
+    os.replace(f"{features_path}.tmp", features_path)
+
+    offsets = np.zeros(len(manifest), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=offsets[1:])
+    with open(os.path.join(output_dir, INDEX_FILENAME), "wb") as f:
+        np.savez(
+            f,
+            count=np.array(len(manifest)),
+            augmentation=np.array(json.dumps(dict(augmentation.settings(), speed_factor=speed_factor)) if augmentation else ""),
+            ids=_pack_strings(manifest.ids),
+            transcripts=_pack_strings(manifest.transcripts),
+            offsets=offsets,
+            lengths=lengths,
+        )
+    return int(lengths.sum())
+
+
+class FeatureCacheDataset(torch.utils.data.Dataset):
+    """Serves log-mel features written by :py:func:`write_feature_cache`.
+
+    Items are ``(features, sample rate, transcript)`` like the corpus datasets, except that features
+    is a ``(frames, 80)`` float16 tensor sharing memory with the memory-mapped cache. ``augmentation``
+    holds the settings of the waveform augmentation the features were computed with, or ``None``.
+
+    Args:
+        features_dir (str): Directory containing ``features.f16`` and ``index.npz``.
+    """
+
+    def __init__(self, features_dir: str):
+        self.features_dir = features_dir
+        with np.load(os.path.join(features_dir, INDEX_FILENAME)) as blob:
+            count = int(blob["count"])
+            self._walker = _unpack_strings(blob["ids"], count)
+            self.transcripts = _unpack_strings(blob["transcripts"], count)
+            self.offsets = blob["offsets"]
+            self.lengths = blob["lengths"]
+            augmentation = str(blob["augmentation"]) if "augmentation" in blob else ""
+        self.augmentation = json.loads(augmentation) if augmentation else None
+        self.target_lengths = np.array([len(transcript) for transcript in self.transcripts], dtype=np.int32)
+        self._features = None
+
+    def __getstate__(self):
+        # The memory map is re-opened lazily in each DataLoader worker.
+        state = self.__dict__.copy()
+        state["_features"] = None
+        return state
+
+    def _get_features(self) -> np.memmap:
+        if self._features is None:
+            # Copy-on-write mapping yields writable arrays, so ``torch.from_numpy`` shares memory without warning.
+            self._features = np.memmap(os.path.join(self.features_dir, FEATURES_FILENAME), dtype=np.float16, mode="c")
+            self._features = self._features.reshape(-1, _NUM_MELS)
+        return self._features
+
+    def __getitem__(self, n: int) -> Tuple[torch.Tensor, int, str]:
+        offset, length = self.offsets[n], self.lengths[n]
+        features = torch.from_numpy(self._get_features()[offset:offset + length])
+        return features, SAMPLE_RATE, self.transcripts[n]
+
+    def __len__(self) -> int:
+        return len(self._walker)
+
+
+def parse_args():
+    parser = ArgumentParser(description=__doc__, formatter_class=RawTextHelpFormatter)
+    parser.add_argument("--dataset", type=str, choices=CORPORA, required=True)
+    parser.add_argument(
+        "--dataset-path",
+        required=True,
+        type=pathlib.Path,
+        help="Path to dataset.",
+    )
+    parser.add_argument(
+        "--features-path",
+        required=True,
+        type=pathlib.Path,
+        help=f"Directory to write features to, under '{TRAIN_FEATURES_DIR}' or '{VALID_FEATURES_DIR}'.",
+    )
+    parser.add_argument(
+        "--validation",
+        action="store_true",
+        default=False,
+        help="Extract features of the validation split instead of the training split.",
+    )
+    parser.add_argument(
+        "--num-workers",
+        default=4,
+        type=int,
+        help="Number of DataLoader workers computing features. (Default: 4)",
+    )
+    parser.add_argument(
+        "--speed-factors",
+        nargs="+",
+        default=[1.0],
+        type=float,
+        help="Write one speed-perturbed variant of the features per factor. (Default: 1.0)",
+    )
+    parser.add_argument(
+        "--noise-dir",
+        default=None,
+        type=pathlib.Path,
+        help="Directory of 16 kHz noise recordings mixed into the variants. (Default: no noise)",
+    )
+    parser.add_argument(
+        "--rir-dir",
+        default=None,
+        type=pathlib.Path,
+        help="Directory of 16 kHz room impulse responses applied to the variants. (Default: no reverberation)",
+    )
+    return parser.parse_args()
+
+
+def cli_main():
+    args = parse_args()
+    training = not args.validation
+    dataset = get_corpus(args.dataset, args.dataset_path, training)
+    augmentation = None
+    if args.speed_factors != [1.0] or args.noise_dir or args.rir_dir:
+        if not training:
+            raise ValueError("Augmented variants are only written for the training split.")
+        noise_paths = find_audio_files(str(args.noise_dir)) if args.noise_dir else []
+        rir_paths = find_audio_files(str(args.rir_dir)) if args.rir_dir else []
+        if (args.noise_dir and not noise_paths) or (args.rir_dir and not rir_paths):
+            raise ValueError("Found no WAV or PCM files in --noise-dir or --rir-dir.")
+        augmentation = WaveformAugmentation(args.speed_factors, noise_paths, rir_paths)
+    augmented = augmentation is not None and augmentation.adds_noise_or_reverb
+    for speed_factor in args.speed_factors:
+        # Noisy or reverberant variants get their own directories, so they never overwrite clean features.
+        features_dir = get_features_dir(str(args.features_path), training, speed_factor, augmented)
+        total_frames = write_feature_cache(dataset, features_dir, args.num_workers, augmentation, speed_factor)
+        logger.warning(f"Wrote {total_frames} frames of {len(dataset)} utterances to {features_dir}")
+
+
+if __name__ == "__main__":
+    cli_main()
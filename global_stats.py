@@ -1,28 +1,176 @@
 #!/usr/bin/env python3
 """Generate feature statistics for training set.
 
+Utterances are split into chunks whose statistics (frame count, mean and sum of squared deviations per
+mel bin, in float64) are computed in a process pool and merged exactly. Finished chunks are checkpointed
+next to the output file, so an interrupted run resumes where it stopped.
+
 Example:
-python global_stats.py --model-type librispeech --dataset-path /home/librispeech
+python global_stats.py --model-type base --dataset-path ./speech_data --num-workers 16
 """
 
 import json
 import logging
+import multiprocessing as mp
+import os
 import pathlib
 from argparse import ArgumentParser, RawTextHelpFormatter
-import solugate_converspeech
-import dataset_modules.diquest_normalspeech as diquest_normalspeech
-import dataset_modules.hallym_dysarthricspeech as hallym_dysarthricspeech
+from typing import List, Optional, Tuple
 
+import numpy as np
 import torch
 from common import (
     MODEL_BASE,
     MODEL_DISABLED,
+    N_MELS,
     piecewise_linear_log,
     spectrogram_transform,
 )
+from corpora import CORPUS_DIQUEST, CORPUS_DYSARTHRIC, CORPUS_ETRI, CORPUS_SOLUGATE, get_corpus
 
 logger = logging.getLogger()
 
+_CHECKPOINT_VERSION = 1
+
+# Dataset of the current pool worker, set once by ``_init_worker`` instead of being pickled with every chunk.
+_worker_dataset = None
+
+
+class FeatureStatistics:
+    """Frame count, mean and sum of squared deviations from the mean of log-mel features per mel bin.
+
+    Statistics of disjoint sets of frames are combined with the parallel algorithm of Chan et al., which
+    gives the same result as a single pass over all frames without the cancellation of ``E[x^2] - E[x]^2``.
+    """
+
+    def __init__(self, count: int = 0, mean: Optional[np.ndarray] = None, m2: Optional[np.ndarray] = None):
+        self.count = count
+        self.mean = np.zeros(N_MELS, dtype=np.float64) if mean is None else mean
+        self.m2 = np.zeros(N_MELS, dtype=np.float64) if m2 is None else m2
+
+    @classmethod
+    def from_features(cls, features: torch.Tensor) -> "FeatureStatistics":
+        x = features.to(torch.float64).numpy()
+        mean = x.mean(0)
+        return cls(x.shape[0], mean, ((x - mean) ** 2).sum(0))
+
+    def merge(self, other: "FeatureStatistics") -> "FeatureStatistics":
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            return other
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        mean = self.mean + delta * (other.count / count)
+        m2 = self.m2 + other.m2 + delta**2 * (self.count * other.count / count)
+        return FeatureStatistics(count, mean, m2)
+
+    def stddev(self) -> np.ndarray:
+        return np.sqrt(self.m2 / self.count)
+
+
+def _init_worker(dataset):
+    global _worker_dataset
+    torch.set_num_threads(1)
+    _worker_dataset = dataset
+
+
+def _chunk_statistics(chunk: Tuple[int, np.ndarray]) -> Tuple[int, FeatureStatistics]:
+    chunk_idx, indices = chunk
+    stats = FeatureStatistics()
+    for n in indices:
+        waveform = _worker_dataset[int(n)][0]
+        mel_spec = spectrogram_transform(waveform.squeeze()).transpose(1, 0)
+        stats = stats.merge(FeatureStatistics.from_features(piecewise_linear_log(mel_spec)))
+    return chunk_idx, stats
+
+
+def _save_checkpoint(checkpoint_path: str, config: np.ndarray, done: List[int], stats: FeatureStatistics):
+    tmp_path = f"{checkpoint_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(
+            f,
+            version=np.array(_CHECKPOINT_VERSION),
+            config=config,
+            done=np.array(done, dtype=np.int64),
+            count=np.array(stats.count),
+            mean=stats.mean,
+            m2=stats.m2,
+        )
+    os.replace(tmp_path, checkpoint_path)
+
+
+def _load_checkpoint(checkpoint_path: str, config: np.ndarray) -> Tuple[List[int], FeatureStatistics]:
+    if not os.path.isfile(checkpoint_path):
+        return [], FeatureStatistics()
+    with np.load(checkpoint_path) as blob:
+        if int(blob["version"]) != _CHECKPOINT_VERSION or not np.array_equal(blob["config"], config):
+            logger.warning(f"Ignoring checkpoint {checkpoint_path} written with different settings")
+            return [], FeatureStatistics()
+        return blob["done"].tolist(), FeatureStatistics(int(blob["count"]), blob["mean"], blob["m2"])
+
+
+def generate_statistics(
+    dataset,
+    num_workers: int,
+    chunk_size: int = 500,
+    sample_fraction: float = 1.0,
+    seed: int = 0,
+    checkpoint_path: Optional[str] = None,
+    checkpoint_interval: int = 20,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Compute the mean and standard deviation of log-mel features over ``dataset``.
+
+    Args:
+        dataset: Dataset yielding ``(waveform, sample rate, transcript)``.
+        num_workers (int): Number of worker processes; ``0`` computes in the calling process.
+        chunk_size (int, optional): Number of utterances per unit of work. (Default: 500)
+        sample_fraction (float, optional): Fraction of utterances, drawn without replacement, to compute
+            statistics over. (Default: 1.0)
+        seed (int, optional): Seed of the utterance sample. (Default: 0)
+        checkpoint_path (str or None, optional): File finished chunks are saved to and resumed from.
+            (Default: ``None``)
+        checkpoint_interval (int, optional): Number of finished chunks between checkpoints. (Default: 20)
+
+    Returns:
+        (np.ndarray, np.ndarray): Mean and standard deviation per mel bin.
+    """
+    indices = np.arange(len(dataset))
+    if sample_fraction < 1.0:
+        num_samples = max(1, round(len(dataset) * sample_fraction))
+        indices = np.sort(np.random.default_rng(seed).choice(len(dataset), num_samples, replace=False))
+    chunks = [(chunk_idx, indices[start:start + chunk_size]) for chunk_idx, start in enumerate(range(0, len(indices), chunk_size))]
+
+    # A checkpoint is only reused by a run that splits the same utterances into the same chunks.
+    config = np.array([len(dataset), chunk_size, seed, round(sample_fraction * 1e6)], dtype=np.int64)
+    done, stats = [], FeatureStatistics()
+    if checkpoint_path is not None:
+        done, stats = _load_checkpoint(checkpoint_path, config)
+        if done:
+            logger.info(f"Resuming from {len(done)} of {len(chunks)} chunks")
+    done_set = set(done)
+    pending = [chunk for chunk in chunks if chunk[0] not in done_set]
+
+    def merge_results(results):
+        nonlocal stats
+        for chunk_idx, chunk_stats in results:
+            stats = stats.merge(chunk_stats)
+            done.append(chunk_idx)
+            if checkpoint_path is not None and len(done) % checkpoint_interval == 0:
+                _save_checkpoint(checkpoint_path, config, done, stats)
+            logger.info(f"Processed {len(done)} of {len(chunks)} chunks")
+
+    if num_workers == 0:
+        _init_worker(dataset)
+        merge_results(map(_chunk_statistics, pending))
+    else:
+        with mp.Pool(num_workers, initializer=_init_worker, initargs=(dataset,)) as pool:
+            merge_results(pool.imap_unordered(_chunk_statistics, pending))
+
+    if checkpoint_path is not None and os.path.isfile(checkpoint_path):
+        os.remove(checkpoint_path)
+    return stats.mean, stats.stddev()
+
 
 def parse_args():
     parser = ArgumentParser(description=__doc__, formatter_class=RawTextHelpFormatter)
@@ -41,41 +189,44 @@ def parse_args():
         type=pathlib.Path,
         help="File to save feature statistics to. (Default: './global_stats.json')",
     )
+    parser.add_argument(
+        "--num-workers",
+        default=os.cpu_count(),
+        type=int,
+        help="Number of worker processes computing statistics. (Default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        default=500,
+        type=int,
+        help="Number of utterances per unit of work and checkpoint granularity. (Default: 500)",
+    )
+    parser.add_argument(
+        "--sample-fraction",
+        default=1.0,
+        type=float,
+        help="Fraction of utterances to compute statistics over. (Default: 1.0)",
+    )
+    parser.add_argument(
+        "--seed",
+        default=0,
+        type=int,
+        help="Seed for sampling utterances. (Default: 0)",
+    )
     return parser.parse_args()
 
 
-def generate_statistics(samples):
-    E_x = 0
-    E_x_2 = 0
-    N = 0
-
-    for idx, sample in enumerate(samples):
-        mel_spec = spectrogram_transform(sample[0].squeeze()).transpose(1, 0)
-        scaled_mel_spec = piecewise_linear_log(mel_spec)
-        sum = scaled_mel_spec.sum(0)
-        sq_sum = scaled_mel_spec.pow(2).sum(0)
-        M = scaled_mel_spec.size(0)
-
-        E_x = E_x * (N / (N + M)) + sum / (N + M)
-        E_x_2 = E_x_2 * (N / (N + M)) + sq_sum / (N + M)
-        N += M
-
-        if idx % 100 == 0:
-            logger.info(f"Processed {idx}")
-
-    return E_x, (E_x_2 - E_x**2) ** 0.5
-
-
 def get_dataset(args):
     if args.model_type == MODEL_BASE:
         return torch.utils.data.ConcatDataset(
             [
-                solugate_converspeech.ETRISPEECH(args.dataset_path, True, "dialog"),
-                diquest_normalspeech.DIQUESTSPEECH(args.dataset_path, True),
+                get_corpus(CORPUS_ETRI, args.dataset_path, True),
+                get_corpus(CORPUS_SOLUGATE, args.dataset_path, True),
+                get_corpus(CORPUS_DIQUEST, args.dataset_path, True),
             ]
         )
     elif args.model_type == MODEL_DISABLED:
-        return hallym_dysarthricspeech.KORDYSARTHRICSPEECH(args.dataset_path, True, subset_type="뇌신경장애")
+        return get_corpus(CORPUS_DYSARTHRIC, args.dataset_path, True)
     else:
         raise ValueError(f"Encountered unsupported model type {args.model_type}.")
 
@@ -83,8 +234,14 @@ def get_dataset(args):
 def cli_main():
     args = parse_args()
     dataset = get_dataset(args)
-    dataloader = torch.utils.data.DataLoader(dataset, num_workers=2)
-    mean, stddev = generate_statistics(iter(dataloader))
+    mean, stddev = generate_statistics(
+        dataset,
+        args.num_workers,
+        chunk_size=args.chunk_size,
+        sample_fraction=args.sample_fraction,
+        seed=args.seed,
+        checkpoint_path=f"{args.output_path}.partial.npz",
+    )
 
     json_str = json.dumps({"mean": mean.tolist(), "invstddev": (1 / stddev).tolist()}, indent=2)
 
@@ -93,4 +250,4 @@ def cli_main():
 
 
 if __name__ == "__main__":
-    cli_main()
\ No newline at end of file
+    cli_main()
@@ -9,6 +9,15 @@ import torchaudio
 from pytorch_lightning import LightningModule
 from torchaudio.models import Hypothesis, RNNTBeamSearch
 from torchaudio.prototype.models import conformer_rnnt_model
+from decoding import BatchedGreedyDecoder
+from common import (
+    NUM_SYMBOLS,
+    TIME_REDUCTION_STRIDE,
+    BatchedFeatureExtractor,
+    SpecAugment,
+    get_train_data_pipeline,
+    get_valid_data_pipeline,
+)
 
 
 logger = logging.getLogger()
@@ -16,6 +25,12 @@ logger = logging.getLogger()
 _expected_spm_vocab_size = 10000
 
 Batch = namedtuple("Batch", ["features", "feature_lengths", "targets", "target_lengths"])
+DECODING_BEAM = "beam"
+DECODING_GREEDY = "greedy"
+QUANTIZATION_NONE = "none"
+QUANTIZATION_DYNAMIC = "dynamic"
+
+WaveformBatch = namedtuple("WaveformBatch", ["waveforms", "waveform_lengths", "targets", "target_lengths"])
 
 
 class WarmupLR(torch.optim.lr_scheduler._LRScheduler):
@@ -76,7 +91,16 @@ def post_process_hypos(
 
 
 class ConformerRNNTModule(LightningModule):
-    def __init__(self, sp_model):
+    r"""Conformer RNN-T trained with SentencePiece targets.
+
+    Args:
+        sp_model (spm.SentencePieceProcessor): SentencePiece model of the targets.
+        global_stats_path (str or None, optional): If given, the module accepts :py:class:`WaveformBatch`
+            batches and computes features itself on the training device, normalizing them with these
+            statistics. (Default: ``None``)
+    """
+
+    def __init__(self, sp_model, global_stats_path=None):
         super().__init__()
 
         self.sp_model = sp_model
@@ -93,14 +117,14 @@ class ConformerRNNTModule(LightningModule):
         self.model = conformer_rnnt_model(
             input_dim=80,
             encoding_dim=128,
-            time_reduction_stride=1,
+            time_reduction_stride=TIME_REDUCTION_STRIDE,
             conformer_input_dim=128,
             conformer_ffn_dim=512,
             conformer_num_layers=2,
             conformer_num_heads=2,
             conformer_depthwise_conv_kernel_size=31,
             conformer_dropout=0.2,
-            num_symbols=6001,
+            num_symbols=NUM_SYMBOLS,
             symbol_embedding_dim=64,
             num_lstm_layers=2,
             lstm_hidden_dim=64,
@@ -113,6 +137,27 @@ class ConformerRNNTModule(LightningModule):
         self.optimizer = torch.optim.Adam(self.model.parameters(), lr=8e-4, betas=(0.9, 0.98), eps=1e-9)
         self.warmup_lr_scheduler = WarmupLR(self.optimizer, 40, 120, 0.96)
 
+        self._decoders = {}
+
+        self.spec_augment = SpecAugment()
+        self.feature_extractor = None
+        if global_stats_path is not None:
+            self.feature_extractor = BatchedFeatureExtractor()
+            self.train_data_pipeline = get_train_data_pipeline(global_stats_path)
+            self.valid_data_pipeline = get_valid_data_pipeline(global_stats_path)
+
+    def on_after_batch_transfer(self, batch, dataloader_idx):
+        if isinstance(batch, WaveformBatch):
+            features, feature_lengths = self.feature_extractor(batch.waveforms, batch.waveform_lengths)
+            data_pipeline = self.train_data_pipeline if self.trainer.training else self.valid_data_pipeline
+            batch = Batch(data_pipeline(features), feature_lengths, batch.targets, batch.target_lengths)
+
+        if isinstance(batch, Batch) and self.trainer.training:
+            # SpecAugment runs here rather than in DataLoader workers, with masks drawn per utterance. It masks the
+            # transferred batch in place, which the module owns from here on.
+            batch = batch._replace(features=self.spec_augment(batch.features, batch.feature_lengths))
+        return batch
+
     def _step(self, batch, _, step_type):
         if batch is None:
             return None
@@ -138,11 +183,66 @@ class ConformerRNNTModule(LightningModule):
             [{"scheduler": self.warmup_lr_scheduler, "interval": "epoch"}],
         )
 
+    def _get_beam_search(self) -> RNNTBeamSearch:
+        # Decoders are kept in a plain dict so that they are not registered as submodules.
+        if "beam" not in self._decoders:
+            self._decoders["beam"] = RNNTBeamSearch(self.model, self.blank_idx)
+        return self._decoders["beam"]
+
+    def _get_greedy_decoder(self) -> BatchedGreedyDecoder:
+        if "greedy" not in self._decoders:
+            self._decoders["greedy"] = BatchedGreedyDecoder(self.model, self.blank_idx)
+        return self._decoders["greedy"]
+
+    def _tokens_to_text(self, tokens: List[int]) -> str:
+        post_process_remove_list = [self.sp_model.unk_id(), self.sp_model.eos_id(), self.sp_model.pad_id()]
+        return self.sp_model.decode([token for token in tokens if token not in post_process_remove_list])
+
     def forward(self, batch: Batch):
-        decoder = RNNTBeamSearch(self.model, self.blank_idx)
-        hypotheses = decoder(batch.features.to(self.device), batch.feature_lengths.to(self.device), 20)
+        hypotheses = self._get_beam_search()(batch.features.to(self.device), batch.feature_lengths.to(self.device), 20)
         return post_process_hypos(hypotheses, self.sp_model)[0][0]
 
+    def decode(self, batch: Batch, beam_width: int = 20, method: str = DECODING_BEAM) -> List[str]:
+        r"""Best hypothesis of every utterance in ``batch``.
+
+        With ``method="beam"``, each utterance's unpadded features are decoded on their own by
+        :py:class:`torchaudio.models.RNNTBeamSearch`. With ``method="greedy"``, utterances are encoded
+        one at a time and searched together by :py:class:`decoding.BatchedGreedyDecoder`, and ``beam_width``
+        is ignored.
+        """
+        features, feature_lengths = batch.features.to(self.device), batch.feature_lengths.to(self.device)
+        if method == DECODING_GREEDY:
+            return [self._tokens_to_text(tokens) for tokens in self._get_greedy_decoder()(features, feature_lengths)]
+        elif method != DECODING_BEAM:
+            raise ValueError(f"Encountered unsupported decoding method {method}.")
+
+        decoder = self._get_beam_search()
+        transcripts = []
+        for n in range(features.size(0)):
+            hypotheses = decoder(features[n : n + 1, : feature_lengths[n]], feature_lengths[n : n + 1], beam_width)
+            transcripts.append(post_process_hypos(hypotheses, self.sp_model)[0][0])
+        return transcripts
+
+    def quantize(self, method: str = QUANTIZATION_DYNAMIC):
+        r"""Quantize the model in place for CPU inference.
+
+        With ``method="dynamic"``, weights of all linear layers, including the gates of the predictor's
+        LSTM layers, are stored in int8 and activations are quantized on the fly. Convolutions, layer norms
+        and the embedding stay in fp32. The module can no longer be trained afterwards.
+        """
+        if method == QUANTIZATION_NONE:
+            return
+        elif method != QUANTIZATION_DYNAMIC:
+            raise ValueError(f"Encountered unsupported quantization method {method}.")
+        self.model = torch.ao.quantization.quantize_dynamic(self.model, {torch.nn.Linear, torch.nn.LSTM}, dtype=torch.qint8)
+        # Decoders hold a reference to the replaced fp32 model.
+        self._decoders = {}
+
+    def on_train_batch_end(self, outputs, batch, batch_idx):
+        # Cached predictor states of the greedy decoder are stale once the weights change.
+        if "greedy" in self._decoders:
+            self._decoders["greedy"].reset()
+
     def training_step(self, batch: Batch, batch_idx):
         r"""Custom training step.
 
@@ -0,0 +1,198 @@
+import logging
+import multiprocessing as mp
+import os
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger()
+
+_MANIFEST_VERSION = 2
+_SEPARATOR = "\0"
+
+MANIFEST_DIR_NAME = ".manifests"
+
+_SCAN_CHUNK_SIZE = 256
+
+# Function applied by ``parallel_map`` in the current pool worker, sent once per worker by ``_init_map_worker``.
+_map_fn = None
+
+
+def _pack_strings(strings: Sequence[str]) -> np.ndarray:
+    return np.frombuffer(_SEPARATOR.join(strings).encode("utf-8"), dtype=np.uint8)
+
+
+def _unpack_strings(blob: np.ndarray, count: int) -> List[str]:
+    if count == 0:
+        return []
+    return blob.tobytes().decode("utf-8").split(_SEPARATOR)
+
+
+def _source_mtimes(sources: Sequence[str]) -> np.ndarray:
+    return np.array([os.stat(source).st_mtime_ns if os.path.exists(source) else -1 for source in sources], dtype=np.int64)
+
+
+def directory_sources(path: str) -> List[str]:
+    """``path`` and its immediate subdirectories, whose modification times change whenever entries are added or removed."""
+    if not os.path.isdir(path):
+        return [path]
+    return [path] + sorted(entry.path for entry in os.scandir(path) if entry.is_dir() and not entry.name.startswith("."))
+
+
+def _init_map_worker(fn: Callable[[Any], Any]):
+    global _map_fn
+    _map_fn = fn
+
+
+def _call_map_fn(item: Any) -> Any:
+    return _map_fn(item)
+
+
+def parallel_map(fn: Callable[[Any], Any], items: Sequence[Any], num_workers: Optional[int] = None) -> Iterator[Any]:
+    """Apply ``fn`` to ``items`` in a process pool, yielding results in order.
+
+    Used by corpus scans that read one small label file per utterance. ``fn`` (typically a
+    :py:func:`functools.partial` holding the storage backend) is pickled once per worker, not once per item.
+    """
+    num_workers = num_workers or mp.cpu_count()
+    if num_workers == 1 or len(items) <= _SCAN_CHUNK_SIZE:
+        yield from map(fn, items)
+        return
+
+    with mp.Pool(num_workers, initializer=_init_map_worker, initargs=(fn,)) as pool:
+        yield from pool.imap(_call_map_fn, items, chunksize=_SCAN_CHUNK_SIZE)
+
+
+def get_manifest_path(dataset_path: str, name: str) -> str:
+    """Manifests live in a hidden subdirectory so that writing them does not touch the mtime of ``dataset_path``."""
+    return os.path.join(dataset_path, MANIFEST_DIR_NAME, f"{name}.npz")
+
+
+class Manifest:
+    """Pre-computed index of one dataset split.
+
+    Each row holds the utterance id, audio path relative to ``root``, audio size in bytes,
+    normalized transcript and target length, so a dataset can be opened without touching
+    the corpus directory tree.
+
+    Args:
+        root (str): Directory audio paths are relative to.
+        ids (list of str): Utterance ids, in dataset order.
+        audio_paths (list of str): Audio paths relative to ``root``.
+        num_bytes (np.ndarray): Size in bytes of each audio file.
+        transcripts (list of str): Normalized transcripts.
+    """
+
+    def __init__(self, root: str, ids: List[str], audio_paths: List[str], num_bytes: np.ndarray, transcripts: List[str]):
+        assert len(ids) == len(audio_paths) == len(num_bytes) == len(transcripts)
+        self.root = root
+        self.ids = ids
+        self.audio_paths = audio_paths
+        self.num_bytes = np.asarray(num_bytes, dtype=np.int64)
+        self.transcripts = transcripts
+        self.target_lengths = np.array([len(transcript) for transcript in transcripts], dtype=np.int32)
+        # Where the manifest is stored, set by ``load_or_build_manifest``; caches derived from it live next to it.
+        self.path: Optional[str] = None
+
+    @classmethod
+    def from_records(
+        cls, root: str, records: Iterable[Tuple[str, str, str]], getsize: Callable[[str], int] = os.path.getsize
+    ) -> "Manifest":
+        """Build a manifest from ``(id, absolute audio path, transcript)`` records."""
+        ids, audio_paths, num_bytes, transcripts = [], [], [], []
+        missing = 0
+        for file_id, audio_path, transcript in records:
+            try:
+                size = getsize(audio_path)
+            except FileNotFoundError:
+                missing += 1
+                continue
+            ids.append(file_id)
+            audio_paths.append(os.path.relpath(audio_path, root))
+            num_bytes.append(size)
+            transcripts.append(transcript)
+        if missing:
+            logger.warning(f"Skipped {missing} utterances with missing audio under {root}")
+        return cls(root, ids, audio_paths, np.array(num_bytes, dtype=np.int64), transcripts)
+
+    def audio_path(self, n: int) -> str:
+        return os.path.join(self.root, self.audio_paths[n])
+
+    def save(self, manifest_path: str, sources: Sequence[str], transcript_version: str = "") -> None:
+        os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+        tmp_path = f"{manifest_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                version=np.array(_MANIFEST_VERSION),
+                count=np.array(len(self.ids)),
+                source_mtimes=_source_mtimes(sources),
+                transcript_version=np.array(transcript_version),
+                ids=_pack_strings(self.ids),
+                audio_paths=_pack_strings(self.audio_paths),
+                num_bytes=self.num_bytes,
+                transcripts=_pack_strings(self.transcripts),
+            )
+        os.replace(tmp_path, manifest_path)
+
+    @classmethod
+    def load(
+        cls, manifest_path: str, root: str, sources: Sequence[str], transcript_version: str = ""
+    ) -> Optional["Manifest"]:
+        """Load a manifest, or return ``None`` if it is missing, any of ``sources`` changed since it was saved,
+        or its transcripts were normalized differently."""
+        if not os.path.isfile(manifest_path):
+            return None
+
+        with np.load(manifest_path) as blob:
+            if int(blob["version"]) != _MANIFEST_VERSION:
+                return None
+            if not np.array_equal(blob["source_mtimes"], _source_mtimes(sources)):
+                return None
+            if str(blob["transcript_version"]) != transcript_version:
+                return None
+            count = int(blob["count"])
+            return cls(
+                root,
+                _unpack_strings(blob["ids"], count),
+                _unpack_strings(blob["audio_paths"], count),
+                blob["num_bytes"],
+                _unpack_strings(blob["transcripts"], count),
+            )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+def load_or_build_manifest(
+    manifest_path: str,
+    root: str,
+    sources: Sequence[str],
+    scan_fn: Callable[[], Iterable[Tuple[str, str, str]]],
+    getsize: Callable[[str], int] = os.path.getsize,
+    transcript_version: str = "",
+) -> Manifest:
+    """Return the manifest stored at ``manifest_path``, rescanning the corpus with ``scan_fn`` when it is stale.
+
+    Args:
+        manifest_path (str): Where the manifest is stored.
+        root (str): Directory audio paths are relative to.
+        sources (list of str): Files and directories whose modification times invalidate the manifest.
+        scan_fn (callable): Yields ``(id, absolute audio path, transcript)`` for every usable utterance.
+        getsize (callable, optional): Returns the size of an audio file, raising ``FileNotFoundError`` if it is missing.
+        transcript_version (str, optional): Identifies how ``scan_fn`` normalizes transcripts; a manifest saved
+            with another version is rebuilt. (Default: ``""``)
+    """
+    manifest = Manifest.load(manifest_path, root, sources, transcript_version)
+    if manifest is not None:
+        manifest.path = manifest_path
+        return manifest
+
+    logger.info(f"Building manifest {manifest_path}")
+    manifest = Manifest.from_records(root, scan_fn(), getsize)
+    manifest.path = manifest_path
+    try:
+        manifest.save(manifest_path, sources, transcript_version)
+    except OSError as e:
+        logger.warning(f"Could not save manifest {manifest_path}: {e}")
+    return manifest
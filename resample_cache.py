@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""Resample the 44.1 kHz Hallym dysarthric speech corpus to 16 kHz once, ahead of training.
+
+All utterances of a split are resampled in a process pool and stored back to back as 16 kHz int16
+samples in one file (``audio.i16``), next to an index of utterance ids, sample offsets, sample counts
+and the size of each source file (``index.npz``), in ``.resampled`` under the split directory.
+:py:class:`dataset_modules.hallym_dysarthricspeech.KORDYSARTHRICSPEECH` serves audio from the cache
+whenever it matches the split's manifest, and falls back to resampling on the fly otherwise.
+
+Example:
+python resample_cache.py --dataset-path ./speech_data/dysarthric --num-workers 16
+"""
+
+import logging
+import os
+import pathlib
+from argparse import ArgumentParser, RawTextHelpFormatter
+from functools import partial
+from typing import Optional
+
+import numpy as np
+import torch
+from common import SAMPLE_RATE
+from manifest import Manifest, _pack_strings, _unpack_strings, parallel_map
+
+logger = logging.getLogger()
+
+_CACHE_VERSION = 1
+
+RESAMPLED_DIR_NAME = ".resampled"
+AUDIO_FILENAME = "audio.i16"
+INDEX_FILENAME = "index.npz"
+
+
+def get_resampled_dir(dataset_path: str) -> str:
+    return os.path.join(dataset_path, RESAMPLED_DIR_NAME)
+
+
+def _resample_to_int16(storage, audio_path: str) -> np.ndarray:
+    waveform = storage.load_waveform(audio_path, SAMPLE_RATE).mean(0)
+    return (waveform * 32768).round_().clamp_(-32768, 32767).to(torch.int16).numpy()
+
+
+def write_resample_cache(dataset, num_workers: Optional[int] = None) -> int:
+    """Resample every utterance of ``dataset`` to 16 kHz int16 and write them to ``dataset.resampled_dir``.
+
+    Args:
+        dataset: Corpus dataset with a manifest, a storage backend and ``resampled_dir``.
+        num_workers (int or None, optional): Number of worker processes. (Default: number of CPUs)
+
+    Returns:
+        int: Total number of samples written.
+    """
+    manifest = dataset._manifest
+    output_dir = dataset.resampled_dir
+    os.makedirs(output_dir, exist_ok=True)
+
+    audio_paths = [manifest.audio_path(n) for n in range(len(manifest))]
+    lengths = np.zeros(len(manifest), dtype=np.int64)
+    audio_path = os.path.join(output_dir, AUDIO_FILENAME)
+    with open(f"{audio_path}.tmp", "wb") as f:
+        for n, samples in enumerate(parallel_map(partial(_resample_to_int16, dataset.storage), audio_paths, num_workers)):
+            f.write(samples.tobytes())
+            lengths[n] = len(samples)
+            if n % 10000 == 0:
+                logger.info(f"Resampled {n} utterances")
+    os.replace(f"{audio_path}.tmp", audio_path)
+
+    offsets = np.zeros(len(manifest), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=offsets[1:])
+    index_path = os.path.join(output_dir, INDEX_FILENAME)
+    with open(f"{index_path}.tmp", "wb") as f:
+        np.savez(
+            f,
+            version=np.array(_CACHE_VERSION),
+            count=np.array(len(manifest)),
+            ids=_pack_strings(manifest.ids),
+            source_num_bytes=manifest.num_bytes,
+            offsets=offsets,
+            lengths=lengths,
+        )
+    os.replace(f"{index_path}.tmp", index_path)
+    return int(lengths.sum())
+
+
+class ResampledAudio:
+    """16 kHz waveforms written by :py:func:`write_resample_cache`, memory-mapped.
+
+    Args:
+        resampled_dir (str): Directory containing ``audio.i16`` and ``index.npz``.
+        offsets (np.ndarray): Start of each utterance in ``audio.i16``, in samples.
+        lengths (np.ndarray): Number of samples of each utterance.
+    """
+
+    def __init__(self, resampled_dir: str, offsets: np.ndarray, lengths: np.ndarray):
+        self.resampled_dir = resampled_dir
+        self.offsets = offsets
+        self.lengths = lengths
+        self._samples = None
+
+    @classmethod
+    def load(cls, resampled_dir: str, manifest: Manifest) -> Optional["ResampledAudio"]:
+        """Open the cache, or return ``None`` if it is missing or was written for other audio than ``manifest``'s."""
+        index_path = os.path.join(resampled_dir, INDEX_FILENAME)
+        if not os.path.isfile(index_path):
+            return None
+        with np.load(index_path) as blob:
+            count = int(blob["count"])
+            if (
+                int(blob["version"]) != _CACHE_VERSION
+                or count != len(manifest)
+                or not np.array_equal(blob["source_num_bytes"], manifest.num_bytes)
+                or _unpack_strings(blob["ids"], count) != manifest.ids
+            ):
+                logger.warning(f"Ignoring resampled audio in {resampled_dir}, which does not match the dataset manifest")
+                return None
+            return cls(resampled_dir, blob["offsets"], blob["lengths"])
+
+    def __getstate__(self):
+        # The memory map is re-opened lazily in each DataLoader worker.
+        state = self.__dict__.copy()
+        state["_samples"] = None
+        return state
+
+    def __getitem__(self, n: int) -> torch.Tensor:
+        """Waveform of the n-th utterance, with shape `(1, samples)`."""
+        if self._samples is None:
+            self._samples = np.memmap(os.path.join(self.resampled_dir, AUDIO_FILENAME), dtype=np.int16, mode="r")
+        samples = self._samples[self.offsets[n] : self.offsets[n] + self.lengths[n]]
+        return torch.from_numpy(samples.astype(np.float32) / 32768).unsqueeze(0)
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+
+def parse_args():
+    parser = ArgumentParser(description=__doc__, formatter_class=RawTextHelpFormatter)
+    parser.add_argument(
+        "--dataset-path",
+        required=True,
+        type=pathlib.Path,
+        help="Path to the dysarthric speech dataset.",
+    )
+    parser.add_argument(
+        "--validation",
+        action="store_true",
+        default=False,
+        help="Resample the validation split instead of the training split.",
+    )
+    parser.add_argument(
+        "--num-workers",
+        default=None,
+        type=int,
+        help="Number of worker processes. (Default: number of CPUs)",
+    )
+    return parser.parse_args()
+
+
+def cli_main():
+    from dataset_modules.hallym_dysarthricspeech import KORDYSARTHRICSPEECH
+
+    args = parse_args()
+    dataset = KORDYSARTHRICSPEECH(args.dataset_path, not args.validation, use_resampled=False)
+    total_samples = write_resample_cache(dataset, args.num_workers)
+    logger.warning(f"Wrote {total_samples / SAMPLE_RATE / 3600:.1f} hours of 16 kHz audio of {len(dataset)} utterances")
+
+
+if __name__ == "__main__":
+    cli_main()
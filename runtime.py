@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""Transcribe audio files with a pipeline exported by ``export.py``.
+
+Only torch, sentencepiece and ``decoding.py`` are imported; the Lightning module, torchaudio and the
+training code are not needed. Audio must be 16 kHz: headerless 16-bit PCM (``.pcm``) or 16-bit WAV.
+
+Example:
+python runtime.py --model-path ./exp/model.ts --audio-paths ./sample1.wav ./sample2.pcm
+"""
+
+import json
+import logging
+import pathlib
+import resource
+import time
+import wave
+from argparse import ArgumentParser, RawTextHelpFormatter
+from typing import List
+
+import numpy as np
+import sentencepiece as spm
+import torch
+from decoding import BatchedGreedyDecoder
+
+logger = logging.getLogger()
+
+# Names of the files stored next to the scripted module by ``export.py``.
+SP_MODEL_FILE = "sp_model"
+CONFIG_FILE = "config.json"
+
+
+def load_audio(path: str, sample_rate: int) -> torch.Tensor:
+    """1-D float waveform of a headerless 16-bit PCM or 16-bit WAV file, which must be at ``sample_rate``."""
+    if path.endswith(".pcm"):
+        return torch.from_numpy(np.fromfile(path, dtype="<i2").astype(np.float32) / 32768)
+
+    with wave.open(path, "rb") as f:
+        if f.getsampwidth() != 2 or f.getframerate() != sample_rate:
+            raise ValueError(f"{path} must be 16-bit audio at {sample_rate} Hz")
+        samples = np.frombuffer(f.readframes(f.getnframes()), dtype="<i2").reshape(-1, f.getnchannels())
+    return torch.from_numpy(samples.mean(1, dtype=np.float32) / 32768)
+
+
+class ScriptedRecognizer:
+    r"""Batched greedy decoding with a scripted pipeline.
+
+    Args:
+        model_path (str): File written by ``export.py``.
+        device (str, optional): Device to run on. (Default: ``"cpu"``)
+    """
+
+    def __init__(self, model_path: str, device: str = "cpu"):
+        extra_files = {SP_MODEL_FILE: "", CONFIG_FILE: ""}
+        self.pipeline = torch.jit.load(model_path, map_location=device, _extra_files=extra_files)
+        self.sp_model = spm.SentencePieceProcessor(model_proto=extra_files[SP_MODEL_FILE])
+        config = json.loads(extra_files[CONFIG_FILE])
+        self.sample_rate = config["sample_rate"]
+        self.remove_ids = set(config["remove_ids"])
+        self.device = torch.device(device)
+        self.decoder = BatchedGreedyDecoder(self.pipeline, config["blank"])
+
+    @torch.no_grad()
+    def __call__(self, waveforms: List[torch.Tensor]) -> List[str]:
+        # Every waveform is encoded on its own, since padding would change the features and encoder output
+        # of shorter utterances; only the search runs on the batch.
+        encoder_outs, encoder_lengths = [], []
+        for waveform in waveforms:
+            lengths = torch.tensor([waveform.numel()], dtype=torch.int32, device=self.device)
+            encoder_out, encoder_length = self.pipeline(waveform[None].to(self.device), lengths)
+            encoder_outs.append(encoder_out[0, : int(encoder_length[0])])
+            encoder_lengths.append(encoder_length)
+        encoder_out = torch.nn.utils.rnn.pad_sequence(encoder_outs, batch_first=True)
+        encoder_lengths = torch.cat(encoder_lengths)
+        search_state = self.decoder.start(encoder_out.size(0), self.device)
+        self.decoder.search(encoder_out, encoder_lengths, search_state)
+        return [
+            self.sp_model.decode([token for token in tokens if token not in self.remove_ids])
+            for tokens in search_state.hypotheses
+        ]
+
+
+def parse_args():
+    parser = ArgumentParser(description=__doc__, formatter_class=RawTextHelpFormatter)
+    parser.add_argument(
+        "--model-path",
+        type=pathlib.Path,
+        help="Path to pipeline exported by export.py.",
+        required=True,
+    )
+    parser.add_argument(
+        "--audio-paths",
+        nargs="+",
+        type=pathlib.Path,
+        help="Audio files to transcribe.",
+        required=True,
+    )
+    parser.add_argument(
+        "--batch-size",
+        default=8,
+        type=int,
+        help="Number of files decoded together. (Default: 8)",
+    )
+    parser.add_argument(
+        "--use-cuda",
+        action="store_true",
+        default=False,
+        help="Run using CUDA.",
+    )
+    return parser.parse_args()
+
+
+def cli_main():
+    args = parse_args()
+    start = time.perf_counter()
+    recognizer = ScriptedRecognizer(str(args.model_path), "cuda" if args.use_cuda else "cpu")
+    logger.warning(f"Loaded {args.model_path} in {time.perf_counter() - start:.2f} s")
+
+    paths = [str(path) for path in args.audio_paths]
+    for batch_start in range(0, len(paths), args.batch_size):
+        batch_paths = paths[batch_start : batch_start + args.batch_size]
+        transcripts = recognizer([load_audio(path, recognizer.sample_rate) for path in batch_paths])
+        for path, transcript in zip(batch_paths, transcripts):
+            print(f"{path}\t{transcript}")
+
+    # ru_maxrss is in kilobytes on Linux.
+    max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    logger.warning(f"Total {time.perf_counter() - start:.2f} s; peak memory {max_rss_mb:.0f} MB")
+
+
+if __name__ == "__main__":
+    cli_main()
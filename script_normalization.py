@@ -1,5 +1,6 @@
+import hashlib
 import re
-from random import randint
+from typing import Optional, Tuple
 
 ETRI_SPECIAL_SYMBOLS = re.compile(r"[{}/*+.,?]|b/|l/|o/|n/|u/")
 DIQUEST_SPECIAL_SYMBOLS = re.compile(r"[*FfNnOoPpSs:.,?]")
@@ -7,6 +8,9 @@ SPACES = re.compile(r"\s+")
 SLASH_SEPARATED_PARENS = re.compile("(\([^()]*\)/\([^()]*\))")
 INSIDE_PARANS = re.compile("\(([^()]*)\)")
 
+# Identifies the output of ``etri_normalize`` in cached transcripts; change it whenever that output changes.
+ETRI_NORMALIZE_VERSION = "etri-2"
+
 
 def _check_paren_match(text: str):
     left = text.count('(')
@@ -18,13 +22,18 @@ def _check_paren_match(text: str):
     return True
 
 
-def _spelling_rep(text: str):
+def spelling_choice(utterance_id: str, seed: int = 0, epoch: int = 0) -> bool:
+    """Whether numbers of an utterance are written in their phonetic form, as a fixed function of its id, seed and epoch."""
+    digest = hashlib.blake2b(f"{seed}:{epoch}:{utterance_id}".encode("utf-8"), digest_size=1).digest()
+    return bool(digest[0] & 1)
+
+
+def _spelling_rep(text: str, is_spelling: bool):
     
     is_error = _check_paren_match(text)
     if is_error:
         return None
     
-    is_spelling = bool(randint(0,1))
     result = ""
     
     segment_list = SLASH_SEPARATED_PARENS.split(text)
@@ -61,18 +70,19 @@ def _check_parse_error(text: str):
     return is_error
 
 
-def etri_normalize(text: str):
+def etri_normalize(text: str, is_spelling: bool = False):
     '''
         1. Parantheses inside parantheses check
         2. Check for incorrect paranthese count match
-        3. 
+        3. Pick one form of every ``(spelling)/(phonetic)`` pair: the phonetic one for words in Latin
+           script, and for numbers only if ``is_spelling``
     '''
 
     error = _check_parse_error(text)
     if error:
         return None
 
-    modified_text = _spelling_rep(text)
+    modified_text = _spelling_rep(text, is_spelling)
     if modified_text is not None:
         text = modified_text
     else:
@@ -84,6 +94,27 @@ def etri_normalize(text: str):
     return text
 
 
+def etri_normalize_version(seed: int = 0) -> str:
+    """Identifies the transcripts ``etri_normalize_utterance`` produces with ``seed``, for cache invalidation."""
+    return f"{ETRI_NORMALIZE_VERSION}:{seed}"
+
+
+def etri_normalize_utterance(utterance_id: str, text: str, seed: int = 0, epoch: int = 0) -> Optional[str]:
+    """``etri_normalize`` with the form of numbers chosen by :py:func:`spelling_choice`."""
+    return etri_normalize(text, spelling_choice(utterance_id, seed, epoch))
+
+
+def etri_normalize_variants(text: str) -> Optional[Tuple[str, str]]:
+    """Both normalizations of ``text``: numbers in their written form and in their phonetic form.
+
+    The two are equal when ``text`` has no numeric ``(spelling)/(phonetic)`` pair.
+    """
+    written = etri_normalize(text, False)
+    if written is None:
+        return None
+    return written, etri_normalize(text, True)
+
+
 def diquest_speech_normalize(text: str):
     if INSIDE_PARANS.search(text) is not None:
         partition_list = INSIDE_PARANS.split(text)
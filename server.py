@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+"""Serve a checkpoint over local HTTP, batching concurrent requests dynamically.
+
+Endpoints:
+    POST /transcribe   Body is a WAV file, or headerless 16 kHz 16-bit PCM. Returns JSON with the transcript.
+    GET /metrics       Returns JSON with request, batch, latency and throughput statistics.
+    GET /health        Returns 200 once the model is loaded.
+
+Requests are queued and grouped into batches of similar length: a batch is formed once the oldest
+pending request has waited ``--max-wait-ms`` or ``--max-batch-size`` requests are pending, and holds
+the oldest request plus those closest to it in length, up to ``--max-batch-seconds`` of padded audio.
+Batches run one at a time on a worker thread while the event loop keeps accepting requests.
+
+Example:
+python server.py --checkpoint-path ./exp/checkpoints/last.ckpt --sp-model-path ./baseline.model --port 8000
+curl --data-binary @sample.wav http://127.0.0.1:8000/transcribe
+"""
+
+import asyncio
+import json
+import logging
+import pathlib
+import time
+from argparse import ArgumentParser, RawTextHelpFormatter
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Deque, List
+
+import numpy as np
+import sentencepiece as spm
+import torch
+from common import N_FFT, SAMPLE_RATE, BatchedFeatureExtractor, get_valid_data_pipeline
+from lightning import DECODING_BEAM, DECODING_GREEDY, Batch, ConformerRNNTModule
+from untar_unzip import _load_waveform_from_bytes
+
+logger = logging.getLogger()
+
+# Number of most recent requests latency percentiles are computed over.
+_LATENCY_WINDOW = 1000
+_MAX_BODY_BYTES = 64 * 1024 * 1024
+
+
+class _Request:
+    def __init__(self, waveform: torch.Tensor, future: asyncio.Future):
+        self.waveform = waveform
+        self.future = future
+        self.arrival = time.perf_counter()
+
+
+class ServerMetrics:
+    """Counters and recent latencies of the server, reported by ``GET /metrics``."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.audio_seconds = 0.0
+        self.compute_seconds = 0.0
+        self.latencies: Deque[float] = deque(maxlen=_LATENCY_WINDOW)
+        self.queue_waits: Deque[float] = deque(maxlen=_LATENCY_WINDOW)
+
+    def add_batch(self, requests: List[_Request], started: float, finished: float):
+        self.batches += 1
+        self.requests += len(requests)
+        self.compute_seconds += finished - started
+        for request in requests:
+            self.audio_seconds += request.waveform.numel() / SAMPLE_RATE
+            self.latencies.append(finished - request.arrival)
+            self.queue_waits.append(started - request.arrival)
+
+    def to_dict(self, pending: int) -> dict:
+        def percentiles_ms(values):
+            if not values:
+                return None
+            p50, p95, p99 = np.percentile(np.array(values), [50, 95, 99]) * 1000
+            return {"p50": p50, "p95": p95, "p99": p99}
+
+        uptime = time.perf_counter() - self.start
+        return {
+            "uptime_seconds": uptime,
+            "requests": self.requests,
+            "errors": self.errors,
+            "pending": pending,
+            "batches": self.batches,
+            "mean_batch_size": self.requests / max(self.batches, 1),
+            "requests_per_second": self.requests / uptime,
+            "audio_seconds": self.audio_seconds,
+            "real_time_factor": self.compute_seconds / self.audio_seconds if self.audio_seconds else None,
+            "latency_ms": percentiles_ms(self.latencies),
+            "queue_wait_ms": percentiles_ms(self.queue_waits),
+        }
+
+
+class DynamicBatcher:
+    r"""Groups concurrently submitted waveforms into batches and runs them on a single worker thread.
+
+    Args:
+        transcribe (Callable): Function mapping a list of 1-D waveforms to a list of transcripts.
+        max_batch_size (int): Maximum number of requests in a batch.
+        max_wait (float): Seconds the oldest pending request waits for others before its batch runs.
+        max_batch_samples (int): Maximum of batch size times longest waveform in a batch.
+        metrics (ServerMetrics): Metrics updated after every batch.
+    """
+
+    def __init__(
+        self,
+        transcribe: Callable[[List[torch.Tensor]], List[str]],
+        max_batch_size: int,
+        max_wait: float,
+        max_batch_samples: int,
+        metrics: ServerMetrics,
+    ):
+        self.transcribe = transcribe
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_batch_samples = max_batch_samples
+        self.metrics = metrics
+        self.pending: List[_Request] = []
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._arrived = asyncio.Event()
+
+    async def submit(self, waveform: torch.Tensor) -> str:
+        request = _Request(waveform, asyncio.get_running_loop().create_future())
+        self.pending.append(request)
+        self._arrived.set()
+        return await request.future
+
+    def _take_batch(self) -> List[_Request]:
+        # The oldest request always runs, together with the pending requests closest to it in length.
+        oldest = self.pending[0]
+        candidates = sorted(self.pending[1:], key=lambda r: abs(r.waveform.numel() - oldest.waveform.numel()))
+        batch, longest = [oldest], oldest.waveform.numel()
+        for request in candidates:
+            if len(batch) == self.max_batch_size:
+                break
+            new_longest = max(longest, request.waveform.numel())
+            if (len(batch) + 1) * new_longest > self.max_batch_samples:
+                continue
+            batch.append(request)
+            longest = new_longest
+        taken = set(map(id, batch))
+        self.pending = [request for request in self.pending if id(request) not in taken]
+        return batch
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self.pending:
+                self._arrived.clear()
+                await self._arrived.wait()
+            deadline = self.pending[0].arrival + self.max_wait
+            while len(self.pending) < self.max_batch_size and time.perf_counter() < deadline:
+                self._arrived.clear()
+                try:
+                    await asyncio.wait_for(self._arrived.wait(), deadline - time.perf_counter())
+                except asyncio.TimeoutError:
+                    break
+
+            batch = self._take_batch()
+            started = time.perf_counter()
+            try:
+                transcripts = await loop.run_in_executor(self._executor, self.transcribe, [r.waveform for r in batch])
+            except Exception as e:
+                logger.exception("Batch failed")
+                self.metrics.errors += len(batch)
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+                continue
+            self.metrics.add_batch(batch, started, time.perf_counter())
+            for request, transcript in zip(batch, transcripts):
+                if not request.future.done():
+                    request.future.set_result(transcript)
+
+
+class _Transcriber:
+    def __init__(self, module: ConformerRNNTModule, global_stats_path: str, decoding: str, beam_width: int):
+        self.module = module
+        self.decoding = decoding
+        self.beam_width = beam_width
+        self.feature_extractor = BatchedFeatureExtractor().to(module.device)
+        self.data_pipeline = get_valid_data_pipeline(global_stats_path).to(module.device)
+
+    @torch.no_grad()
+    def __call__(self, waveforms: List[torch.Tensor]) -> List[str]:
+        # Features are extracted from every waveform on its own, and ``decode`` encodes every utterance on
+        # its own, so that a transcript does not depend on which requests happened to share its batch.
+        device = self.module.device
+        features, feature_lengths = [], []
+        for waveform in waveforms:
+            lengths = torch.tensor([waveform.numel()], dtype=torch.int32, device=device)
+            utterance_features, utterance_lengths = self.feature_extractor(waveform[None].to(device), lengths)
+            features.append(utterance_features[0])
+            feature_lengths.append(utterance_lengths)
+        padded = torch.nn.utils.rnn.pad_sequence(features, batch_first=True)
+        batch = Batch(self.data_pipeline(padded), torch.cat(feature_lengths), None, None)
+        return self.module.decode(batch, beam_width=self.beam_width, method=self.decoding)
+
+
+def _decode_audio(body: bytes) -> torch.Tensor:
+    file_path = "request.wav" if body[:4] == b"RIFF" else "request.pcm"
+    waveform = _load_waveform_from_bytes(body, file_path, SAMPLE_RATE).mean(0)
+    # The centered STFT reflection-pads by half a window, which needs more samples than that.
+    if waveform.numel() < N_FFT // 2 + 1:
+        raise ValueError(f"Audio must have at least {N_FFT // 2 + 1} samples, but has {waveform.numel()}.")
+    return waveform
+
+
+async def _write_response(writer: asyncio.StreamWriter, status: str, payload: dict, keep_alive: bool):
+    body = json.dumps(payload, ensure_ascii=False).encode()
+    headers = [
+        f"HTTP/1.1 {status}",
+        "Content-Type: application/json; charset=utf-8",
+        f"Content-Length: {len(body)}",
+        f"Connection: {'keep-alive' if keep_alive else 'close'}",
+    ]
+    writer.write(("\r\n".join(headers) + "\r\n\r\n").encode() + body)
+    await writer.drain()
+
+
+class ASRServer:
+    """Minimal HTTP/1.1 front end of a :py:class:`DynamicBatcher`."""
+
+    def __init__(self, batcher: DynamicBatcher):
+        self.batcher = batcher
+
+    async def _handle(self, method: str, path: str, body: bytes):
+        if method == "GET" and path == "/health":
+            return "200 OK", {"status": "ok"}
+        if method == "GET" and path == "/metrics":
+            return "200 OK", self.batcher.metrics.to_dict(len(self.batcher.pending))
+        if method == "POST" and path == "/transcribe":
+            try:
+                waveform = await asyncio.get_running_loop().run_in_executor(None, _decode_audio, body)
+            except Exception as e:
+                self.batcher.metrics.errors += 1
+                return "400 Bad Request", {"error": f"Could not decode audio: {e}"}
+            try:
+                started = time.perf_counter()
+                transcript = await self.batcher.submit(waveform)
+            except Exception as e:
+                return "500 Internal Server Error", {"error": str(e)}
+            return "200 OK", {
+                "transcript": transcript,
+                "audio_seconds": waveform.numel() / SAMPLE_RATE,
+                "latency_ms": (time.perf_counter() - started) * 1000,
+            }
+        return "404 Not Found", {"error": f"No route for {method} {path}"}
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = (await reader.readline()).decode("latin-1").strip()
+                    if not line:
+                        break
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                content_length = int(headers.get("content-length", 0))
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                if content_length > _MAX_BODY_BYTES:
+                    await _write_response(writer, "413 Payload Too Large", {"error": "Request body too large"}, False)
+                    break
+                body = await reader.readexactly(content_length) if content_length else b""
+
+                status, payload = await self._handle(method, target.split("?")[0], body)
+                await _write_response(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int):
+        batcher_task = asyncio.create_task(self.batcher.run())
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        logger.warning(f"Serving on http://{host}:{port}")
+        async with server:
+            try:
+                await server.serve_forever()
+            finally:
+                batcher_task.cancel()
+
+
+def parse_args():
+    parser = ArgumentParser(description=__doc__, formatter_class=RawTextHelpFormatter)
+    parser.add_argument(
+        "--checkpoint-path",
+        type=pathlib.Path,
+        help="Path to checkpoint to serve.",
+        required=True,
+    )
+    parser.add_argument(
+        "--global-stats-path",
+        default=pathlib.Path("global_stats.json"),
+        type=pathlib.Path,
+        help="Path to JSON file containing feature means and stddevs.",
+    )
+    parser.add_argument(
+        "--sp-model-path",
+        type=pathlib.Path,
+        help="Path to SentencePiece model.",
+        required=True,
+    )
+    parser.add_argument(
+        "--host",
+        default="127.0.0.1",
+        type=str,
+        help="Address to listen on. (Default: '127.0.0.1')",
+    )
+    parser.add_argument(
+        "--port",
+        default=8000,
+        type=int,
+        help="Port to listen on. (Default: 8000)",
+    )
+    parser.add_argument(
+        "--max-batch-size",
+        default=16,
+        type=int,
+        help="Maximum number of requests decoded together. (Default: 16)",
+    )
+    parser.add_argument(
+        "--max-wait-ms",
+        default=20,
+        type=float,
+        help="Milliseconds a request waits for others to batch with. (Default: 20)",
+    )
+    parser.add_argument(
+        "--max-batch-seconds",
+        default=240,
+        type=float,
+        help="Maximum seconds of padded audio (batch size times longest request) in a batch. (Default: 240)",
+    )
+    parser.add_argument(
+        "--decoding",
+        default=DECODING_GREEDY,
+        choices=[DECODING_BEAM, DECODING_GREEDY],
+        help="Beam search per utterance, or batched greedy decoding. (Default: greedy)",
+    )
+    parser.add_argument(
+        "--beam-width",
+        default=20,
+        type=int,
+        help="Beam width of the beam search. (Default: 20)",
+    )
+    parser.add_argument(
+        "--use-cuda",
+        action="store_true",
+        default=False,
+        help="Run using CUDA.",
+    )
+    return parser.parse_args()
+
+
+def cli_main():
+    args = parse_args()
+    sp_model = spm.SentencePieceProcessor(model_file=str(args.sp_model_path))
+    module = ConformerRNNTModule.load_from_checkpoint(args.checkpoint_path, sp_model=sp_model).eval()
+    if args.use_cuda:
+        module = module.to(device="cuda")
+
+    batcher = DynamicBatcher(
+        _Transcriber(module, str(args.global_stats_path), args.decoding, args.beam_width),
+        args.max_batch_size,
+        args.max_wait_ms / 1000,
+        int(args.max_batch_seconds * SAMPLE_RATE),
+        ServerMetrics(),
+    )
+    asyncio.run(ASRServer(batcher).serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    cli_main()
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""Pack a corpus into large tar shards for sequential reading.
+
+Utterances are sorted by audio length before packing, so every shard holds utterances of similar
+length and batches drawn from consecutive samples need little padding. Each sample is stored as
+``<key>.<audio ext>`` (the original audio bytes), ``<key>.txt`` (normalized transcript) and
+``<key>.json`` (utterance id and precomputed lengths). ``shards.json`` lists the shards with the target
+length of each of their samples, from which every DDP rank can count the batches of all ranks.
+
+Example:
+python shards.py --dataset etri --dataset-path "./speech_data/한국어 음성" --output-dir ./shards/etri_train
+"""
+
+import io
+import itertools
+import json
+import logging
+import os
+import pathlib
+import random
+import tarfile
+from argparse import ArgumentParser, RawTextHelpFormatter
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+
+import torch
+from corpora import CORPORA, get_corpus
+from untar_unzip import _load_waveform_from_bytes
+from common import SAMPLE_RATE
+
+logger = logging.getLogger()
+
+SHARD_INDEX_FILENAME = "shards.json"
+
+
+def _add_member(tar: tarfile.TarFile, name: str, data: bytes):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tar.addfile(info, io.BytesIO(data))
+
+
+def write_shards(dataset, output_dir: str, shard_size: int) -> List[dict]:
+    """Write the utterances of ``dataset`` to tar shards of roughly ``shard_size`` bytes each.
+
+    Args:
+        dataset: One of the corpus datasets in ``dataset_modules``.
+        output_dir (str): Directory to write shards and ``shards.json`` to.
+        shard_size (int): Audio bytes after which a new shard is started.
+
+    Returns:
+        list of dict: Name, number of samples and target lengths of the samples of every shard.
+    """
+    manifest = dataset._manifest
+    os.makedirs(output_dir, exist_ok=True)
+
+    order = sorted(range(len(manifest)), key=lambda n: manifest.num_bytes[n])
+    shards = []
+    tar, shard_bytes = None, 0
+    for key, n in enumerate(order):
+        if tar is None or shard_bytes >= shard_size:
+            if tar is not None:
+                tar.close()
+            shards.append({"name": f"shard-{len(shards):06d}.tar", "samples": 0, "target_lengths": []})
+            tar = tarfile.open(os.path.join(output_dir, shards[-1]["name"]), "w")
+            shard_bytes = 0
+
+        audio_path = manifest.audio_path(n)
+        audio = dataset.storage.read_bytes(audio_path)
+        metadata = {
+            "id": manifest.ids[n],
+            "num_bytes": int(manifest.num_bytes[n]),
+            "target_length": int(manifest.target_lengths[n]),
+        }
+        _add_member(tar, f"{key:09d}{os.path.splitext(audio_path)[1]}", audio)
+        _add_member(tar, f"{key:09d}.txt", manifest.transcripts[n].encode("utf-8"))
+        _add_member(tar, f"{key:09d}.json", json.dumps(metadata).encode("utf-8"))
+        shards[-1]["samples"] += 1
+        shards[-1]["target_lengths"].append(metadata["target_length"])
+        shard_bytes += len(audio)
+
+        if key % 10000 == 0:
+            logger.info(f"Packed {key} utterances into {len(shards)} shards")
+
+    if tar is not None:
+        tar.close()
+
+    with open(os.path.join(output_dir, SHARD_INDEX_FILENAME), "w") as f:
+        json.dump({"sample_rate": SAMPLE_RATE, "shards": shards}, f, indent=2)
+
+    return shards
+
+
+def _iter_shard(shard_path: str) -> Iterator[dict]:
+    # Members of one sample are adjacent in the tar file, so the shard is read strictly sequentially.
+    sample, current_key = {}, None
+    with tarfile.open(shard_path, "r|") as tar:
+        for member in tar:
+            key, ext = member.name.split(".", 1)
+            if key != current_key and sample:
+                yield sample
+                sample = {}
+            current_key = key
+            sample[ext] = tar.extractfile(member).read()
+    if sample:
+        yield sample
+
+
+def _decode_sample(sample: dict) -> Tuple[torch.Tensor, int, str, dict]:
+    metadata = json.loads(sample.pop("json"))
+    transcript = sample.pop("txt").decode("utf-8")
+    ext, audio = next(iter(sample.items()))
+    waveform = _load_waveform_from_bytes(audio, f"audio.{ext}", SAMPLE_RATE)
+    return waveform, SAMPLE_RATE, transcript, metadata
+
+
+def _sample_target_length(sample: tuple) -> int:
+    return sample[3]["target_length"]
+
+
+def _batch_stream(
+    samples: Iterator, max_tokens: int, batch_size: Optional[int], target_length_fn: Callable[[Any], int] = _sample_target_length
+) -> Iterator[List]:
+    batch, token_count = [], 0
+    for sample in samples:
+        target_length = target_length_fn(sample)
+        if batch and (token_count + target_length > max_tokens or (batch_size and len(batch) == batch_size)):
+            yield batch
+            batch, token_count = [], 0
+        batch.append(sample)
+        token_count += target_length
+    if batch:
+        yield batch
+
+
+class ShardedIterableDataset(torch.utils.data.IterableDataset):
+    """Streams batches from shards written by :py:func:`write_shards`.
+
+    Shards are shuffled per epoch and split between DDP ranks and DataLoader workers, then each
+    shard is read sequentially. Because shards are sorted by length, consecutive samples are grouped
+    into length-homogeneous batches by token count, and batches (not samples) pass through a shuffle
+    buffer so that batches from different shards are interleaved.
+
+    Shards hold different numbers of token-capped batches, so every rank counts the batches of all
+    ranks from the target lengths in ``shards.json`` and stops after as many as the rank with the
+    fewest; otherwise ranks would run different numbers of steps and DDP would hang in allreduce.
+
+    Args:
+        shards_dir (str): Directory containing ``shards.json``.
+        max_tokens (int): Maximum sum of target lengths in a batch.
+        batch_size (int or None, optional): Maximum number of utterances in a batch. (Default: ``None``)
+        shuffle (bool, optional): Whether to shuffle shards and batches. (Default: ``True``)
+        shuffle_buffer_size (int, optional): Number of batches held in the shuffle buffer. (Default: 100)
+        seed (int, optional): Base seed for shuffling, combined with the epoch. (Default: 0)
+    """
+
+    def __init__(
+        self,
+        shards_dir: str,
+        max_tokens: int,
+        batch_size: Optional[int] = None,
+        shuffle: bool = True,
+        shuffle_buffer_size: int = 100,
+        seed: int = 0,
+    ):
+        super().__init__()
+        with open(os.path.join(shards_dir, SHARD_INDEX_FILENAME)) as f:
+            index = json.load(f)
+        if any("target_lengths" not in shard for shard in index["shards"]):
+            raise ValueError(f"{shards_dir} was written without target lengths; rewrite it with shards.py.")
+        self.shard_paths = [os.path.join(shards_dir, shard["name"]) for shard in index["shards"]]
+        self.shard_target_lengths = [shard["target_lengths"] for shard in index["shards"]]
+        self.max_tokens = max_tokens
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.shuffle_buffer_size = shuffle_buffer_size
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    @staticmethod
+    def _rank() -> Tuple[int, int]:
+        if torch.distributed.is_available() and torch.distributed.is_initialized():
+            return torch.distributed.get_rank(), torch.distributed.get_world_size()
+        return 0, 1
+
+    def _rank_shards(self, rank: int, world_size: int) -> List[int]:
+        if len(self.shard_paths) < world_size:
+            raise ValueError(f"{len(self.shard_paths)} shards cannot be split between {world_size} ranks.")
+        shards = list(range(len(self.shard_paths)))
+        if self.shuffle:
+            random.Random(self.seed + self.epoch).shuffle(shards)
+
+        # Every rank gets the same number of shards, so that batch counts only differ by shard contents.
+        shards = shards[: len(shards) // world_size * world_size]
+        return shards[rank::world_size]
+
+    def _num_batches(self, shards: List[int]) -> int:
+        target_lengths = (length for shard in shards for length in self.shard_target_lengths[shard])
+        return sum(1 for _ in _batch_stream(target_lengths, self.max_tokens, self.batch_size, int))
+
+    def _worker_quota(self, rank: int, world_size: int, worker_id: int, num_workers: int) -> int:
+        """Number of batches this worker yields, so that every rank yields as many as the rank with the fewest."""
+        num_batches = [
+            [self._num_batches(self._rank_shards(other, world_size)[worker::num_workers]) for worker in range(num_workers)]
+            for other in range(world_size)
+        ]
+        steps = min(sum(worker_batches) for worker_batches in num_batches)
+
+        # Share ``steps`` between this rank's workers one batch at a time, capped by what each worker holds.
+        quotas = [0] * num_workers
+        while steps:
+            for worker in range(num_workers):
+                if steps and quotas[worker] < num_batches[rank][worker]:
+                    quotas[worker] += 1
+                    steps -= 1
+        return quotas[worker_id]
+
+    def __iter__(self) -> Iterator[List[tuple]]:
+        rank, world_size = self._rank()
+        worker_info = torch.utils.data.get_worker_info()
+        worker_id, num_workers = (0, 1) if worker_info is None else (worker_info.id, worker_info.num_workers)
+        shards = self._rank_shards(rank, world_size)[worker_id::num_workers]
+        quota = self._worker_quota(rank, world_size, worker_id, num_workers)
+        rng = random.Random(f"{self.seed}-{self.epoch}-{rank}-{worker_id}")
+
+        def samples():
+            for shard in shards:
+                for sample in _iter_shard(self.shard_paths[shard]):
+                    yield _decode_sample(sample)
+
+        def batches():
+            buffer = []
+            for batch in _batch_stream(samples(), self.max_tokens, self.batch_size):
+                if not self.shuffle:
+                    yield batch
+                    continue
+                buffer.append(batch)
+                if len(buffer) >= self.shuffle_buffer_size:
+                    yield buffer.pop(rng.randrange(len(buffer)))
+
+            rng.shuffle(buffer)
+            yield from buffer
+
+        yield from itertools.islice(batches(), quota)
+
+
+def parse_args():
+    parser = ArgumentParser(description=__doc__, formatter_class=RawTextHelpFormatter)
+    parser.add_argument("--dataset", type=str, choices=CORPORA, required=True)
+    parser.add_argument(
+        "--dataset-path",
+        required=True,
+        type=pathlib.Path,
+        help="Path to dataset.",
+    )
+    parser.add_argument(
+        "--output-dir",
+        required=True,
+        type=pathlib.Path,
+        help="Directory to write shards to.",
+    )
+    parser.add_argument(
+        "--validation",
+        action="store_true",
+        default=False,
+        help="Pack the validation split instead of the training split.",
+    )
+    parser.add_argument(
+        "--shard-size-mb",
+        default=512,
+        type=int,
+        help="Approximate size of each shard in megabytes. (Default: 512)",
+    )
+    return parser.parse_args()
+
+
+def cli_main():
+    args = parse_args()
+    dataset = get_corpus(args.dataset, args.dataset_path, not args.validation)
+    shards = write_shards(dataset, str(args.output_dir), args.shard_size_mb * 1024 * 1024)
+    logger.warning(f"Wrote {sum(shard['samples'] for shard in shards)} utterances to {len(shards)} shards")
+
+
+if __name__ == "__main__":
+    cli_main()
@@ -0,0 +1,282 @@
+import fnmatch
+import io
+import logging
+import mmap
+import os
+import struct
+import tarfile
+import zipfile
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, TextIO, Tuple
+
+import numpy as np
+from audio_io import WAV_HEADER_BYTES, AudioInfo, probe, probe_header
+from manifest import _pack_strings, _unpack_strings
+from untar_unzip import _extract_archives, _load_waveform, _load_waveform_from_bytes
+
+logger = logging.getLogger()
+
+_INDEX_VERSION = 1
+_ZIP_LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+_ZIP_LOCAL_HEADER_MAGIC = b"PK\x03\x04"
+
+
+def _glob_match(relative_path: str, pattern: str) -> bool:
+    # Same semantics as ``Path.glob``: every component has to match and ``*`` does not cross ``/``.
+    path_parts = relative_path.split("/")
+    pattern_parts = pattern.split("/")
+    return len(path_parts) == len(pattern_parts) and all(
+        fnmatch.fnmatchcase(part, part_pattern) for part, part_pattern in zip(path_parts, pattern_parts)
+    )
+
+
+class FileStorage:
+    """Default storage backend: archives are extracted next to themselves and files are read from disk."""
+
+    manifest_suffix = ""
+
+    def unpack(self, extract_fn: Callable, args: List[Tuple]):
+        _extract_archives(extract_fn, args)
+
+    def glob(self, root: str, pattern: str) -> Iterator[str]:
+        return (path.as_posix() for path in Path(root).glob(pattern))
+
+    def rglob(self, root: str, pattern: str) -> Iterator[str]:
+        return (path.as_posix() for path in Path(root).rglob(pattern))
+
+    def open(self, file_path: str) -> TextIO:
+        return open(file_path)
+
+    def read_bytes(self, file_path: str) -> bytes:
+        with open(file_path, "rb") as f:
+            return f.read()
+
+    def getsize(self, file_path: str) -> int:
+        return os.path.getsize(file_path)
+
+    def read_header(self, file_path: str, num_bytes: int) -> bytes:
+        """Read at most the first ``num_bytes`` bytes of a file."""
+        with open(file_path, "rb") as f:
+            return f.read(num_bytes)
+
+    def probe(self, file_path: str) -> AudioInfo:
+        """Number of frames and sample rate of an audio file, from its size and header."""
+        return probe(file_path)
+
+    def load_waveform(self, file_path: str, exp_sample_rate: int):
+        return _load_waveform(file_path, exp_sample_rate)
+
+
+class _ArchiveIndex:
+    """Offsets of every member of one archive, keyed by the member name with leading directories stripped.
+
+    Members of uncompressed tar files and stored zip members are read with a single slice of a memory map.
+    Deflated zip members store ``-(position in the zip info list + 1)`` as their offset and are
+    decompressed through :py:mod:`zipfile`.
+    """
+
+    def __init__(self, archive_path: str, n_directories_stripped: int, names: List[str], offsets: np.ndarray, sizes: np.ndarray):
+        self.archive_path = archive_path
+        self.n_directories_stripped = n_directories_stripped
+        self.names = names
+        self.offsets = offsets
+        self.sizes = sizes
+
+    @classmethod
+    def build(cls, archive_path: str, n_directories_stripped: int) -> "_ArchiveIndex":
+        if archive_path.endswith(".zip"):
+            members = cls._zip_members(archive_path)
+        else:
+            members = cls._tar_members(archive_path)
+
+        names, offsets, sizes = [], [], []
+        for name, offset, size in members:
+            names.append(name.split("/", n_directories_stripped)[-1])
+            offsets.append(offset)
+            sizes.append(size)
+        return cls(archive_path, n_directories_stripped, names, np.array(offsets, dtype=np.int64), np.array(sizes, dtype=np.int64))
+
+    @staticmethod
+    def _tar_members(archive_path: str) -> Iterator[Tuple[str, int, int]]:
+        with tarfile.open(archive_path, "r:") as tar:
+            for member in tar:
+                if member.isfile():
+                    yield member.name, member.offset_data, member.size
+
+    @staticmethod
+    def _zip_members(archive_path: str) -> Iterator[Tuple[str, int, int]]:
+        with zipfile.ZipFile(archive_path, "r", metadata_encoding="cp949") as zfile, open(archive_path, "rb") as f:
+            for info_idx, info in enumerate(zfile.infolist()):
+                if info.is_dir():
+                    continue
+                if info.compress_type != zipfile.ZIP_STORED:
+                    yield info.filename, -(info_idx + 1), info.file_size
+                    continue
+                # The local header may carry a different extra field than the central directory.
+                f.seek(info.header_offset)
+                header = _ZIP_LOCAL_HEADER.unpack(f.read(_ZIP_LOCAL_HEADER.size))
+                if header[0] != _ZIP_LOCAL_HEADER_MAGIC:
+                    raise zipfile.BadZipFile(f"Bad local header for {info.filename} in {archive_path}")
+                offset = info.header_offset + _ZIP_LOCAL_HEADER.size + header[-2] + header[-1]
+                yield info.filename, offset, info.file_size
+
+    def save(self, index_path: str):
+        stat = os.stat(self.archive_path)
+        tmp_path = f"{index_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                version=np.array(_INDEX_VERSION),
+                archive_size=np.array(stat.st_size),
+                archive_mtime_ns=np.array(stat.st_mtime_ns),
+                n_directories_stripped=np.array(self.n_directories_stripped),
+                count=np.array(len(self.names)),
+                names=_pack_strings(self.names),
+                offsets=self.offsets,
+                sizes=self.sizes,
+            )
+        os.replace(tmp_path, index_path)
+
+    @classmethod
+    def load(cls, archive_path: str, n_directories_stripped: int, index_path: str) -> Optional["_ArchiveIndex"]:
+        if not os.path.isfile(index_path):
+            return None
+
+        stat = os.stat(archive_path)
+        with np.load(index_path) as blob:
+            if int(blob["version"]) != _INDEX_VERSION or int(blob["n_directories_stripped"]) != n_directories_stripped:
+                return None
+            if int(blob["archive_size"]) != stat.st_size or int(blob["archive_mtime_ns"]) != stat.st_mtime_ns:
+                return None
+            count = int(blob["count"])
+            return cls(archive_path, n_directories_stripped, _unpack_strings(blob["names"], count), blob["offsets"], blob["sizes"])
+
+
+class ArchiveStorage(FileStorage):
+    """Storage backend that serves files straight out of uncompressed tar and zip archives.
+
+    ``unpack`` indexes each archive once, storing the index as ``<archive>.index.npz``, instead of
+    extracting it. Paths are the ones the files would have after extraction, so datasets address
+    files the same way with either backend. Compressed tar archives (e.g. Solugate ``.tar.gz`` labels)
+    cannot be read randomly and are still extracted; files missing from every index are read from disk.
+    """
+
+    manifest_suffix = ".archive"
+
+    def __init__(self):
+        self._indexes: List[_ArchiveIndex] = []
+        self._members: Dict[str, Tuple[int, int]] = {}
+        self._maps: Dict[int, mmap.mmap] = {}
+        self._zipfiles: Dict[int, zipfile.ZipFile] = {}
+
+    def __getstate__(self):
+        # Memory maps and open zip files are re-created lazily in each DataLoader worker.
+        state = self.__dict__.copy()
+        state["_maps"] = {}
+        state["_zipfiles"] = {}
+        return state
+
+    def unpack(self, extract_fn: Callable, args: List[Tuple]):
+        to_extract = []
+        for arg in args:
+            from_path, to_path, _, n_directories_stripped = arg
+            from_path = os.fspath(from_path)
+            if from_path.endswith(".gz"):
+                to_extract.append(arg)
+                continue
+            self._add_archive(from_path, os.fspath(to_path), n_directories_stripped)
+
+        if to_extract:
+            _extract_archives(extract_fn, to_extract)
+
+    def _add_archive(self, archive_path: str, to_path: str, n_directories_stripped: int):
+        index_path = f"{archive_path}.index.npz"
+        index = _ArchiveIndex.load(archive_path, n_directories_stripped, index_path)
+        if index is None:
+            logger.info(f"Indexing {archive_path}")
+            index = _ArchiveIndex.build(archive_path, n_directories_stripped)
+            try:
+                index.save(index_path)
+            except OSError as e:
+                logger.warning(f"Could not save archive index {index_path}: {e}")
+
+        archive_idx = len(self._indexes)
+        self._indexes.append(index)
+        for member_idx, name in enumerate(index.names):
+            self._members[os.path.normpath(os.path.join(to_path, name))] = (archive_idx, member_idx)
+
+    def _relative_paths(self, root: str) -> Iterator[Tuple[str, str]]:
+        root = os.path.normpath(root) + os.sep
+        for path in self._members:
+            if path.startswith(root):
+                yield path, path[len(root):].replace(os.sep, "/")
+
+    def glob(self, root: str, pattern: str) -> Iterator[str]:
+        yield from (path for path, relative_path in self._relative_paths(root) if _glob_match(relative_path, pattern))
+        yield from (path for path in super().glob(root, pattern) if os.path.normpath(path) not in self._members)
+
+    def rglob(self, root: str, pattern: str) -> Iterator[str]:
+        yield from (
+            path
+            for path, relative_path in self._relative_paths(root)
+            if fnmatch.fnmatchcase(relative_path.rsplit("/", 1)[-1], pattern)
+        )
+        yield from (path for path in super().rglob(root, pattern) if os.path.normpath(path) not in self._members)
+
+    def _get_map(self, archive_idx: int) -> mmap.mmap:
+        if archive_idx not in self._maps:
+            with open(self._indexes[archive_idx].archive_path, "rb") as f:
+                self._maps[archive_idx] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._maps[archive_idx]
+
+    def _get_zipfile(self, archive_idx: int) -> zipfile.ZipFile:
+        if archive_idx not in self._zipfiles:
+            self._zipfiles[archive_idx] = zipfile.ZipFile(self._indexes[archive_idx].archive_path, "r", metadata_encoding="cp949")
+        return self._zipfiles[archive_idx]
+
+    def read_bytes(self, file_path: str) -> bytes:
+        if os.path.normpath(file_path) not in self._members:
+            return super().read_bytes(file_path)
+        archive_idx, member_idx = self._members[os.path.normpath(file_path)]
+        index = self._indexes[archive_idx]
+        offset = int(index.offsets[member_idx])
+
+        if offset < 0:
+            zfile = self._get_zipfile(archive_idx)
+            return zfile.read(zfile.infolist()[-offset - 1])
+
+        return self._get_map(archive_idx)[offset:offset + int(index.sizes[member_idx])]
+
+    def open(self, file_path: str) -> TextIO:
+        if os.path.normpath(file_path) not in self._members:
+            return super().open(file_path)
+        return io.StringIO(self.read_bytes(file_path).decode("utf-8"))
+
+    def getsize(self, file_path: str) -> int:
+        member = self._members.get(os.path.normpath(file_path))
+        if member is None:
+            return super().getsize(file_path)
+        return int(self._indexes[member[0]].sizes[member[1]])
+
+    def read_header(self, file_path: str, num_bytes: int) -> bytes:
+        member = self._members.get(os.path.normpath(file_path))
+        if member is None:
+            return super().read_header(file_path, num_bytes)
+        archive_idx, member_idx = member
+        index = self._indexes[archive_idx]
+        offset = int(index.offsets[member_idx])
+        if offset < 0:
+            zfile = self._get_zipfile(archive_idx)
+            with zfile.open(zfile.infolist()[-offset - 1]) as f:
+                return f.read(num_bytes)
+        return self._get_map(archive_idx)[offset:offset + min(num_bytes, int(index.sizes[member_idx]))]
+
+    def probe(self, file_path: str) -> AudioInfo:
+        if os.path.normpath(file_path) not in self._members:
+            return super().probe(file_path)
+        return probe_header(self.read_header(file_path, WAV_HEADER_BYTES), self.getsize(file_path), file_path)
+
+    def load_waveform(self, file_path: str, exp_sample_rate: int):
+        if os.path.normpath(file_path) not in self._members:
+            return super().load_waveform(file_path, exp_sample_rate)
+        return _load_waveform_from_bytes(self.read_bytes(file_path), file_path, exp_sample_rate)
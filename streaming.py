@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""Transcribe audio chunk by chunk, as it would arrive from a live stream.
+
+Features are computed incrementally and match offline extraction frame for frame. The Conformer is run
+on each chunk only, with every layer attending to (and convolving over) a cache of its own inputs from
+previous chunks instead of the whole utterance, and greedy decoding carries its hypothesis across
+chunks. Because the model was trained with full context, chunked transcripts can differ from offline
+ones; longer chunks and left context bring them closer.
+
+Example:
+python streaming.py --checkpoint-path ./exp/checkpoints/last.ckpt --sp-model-path ./baseline.model \\
+    --audio-path ./sample.pcm --chunk-ms 400
+"""
+
+import logging
+import pathlib
+import time
+from argparse import ArgumentParser, RawTextHelpFormatter
+from typing import List, NamedTuple, Optional, Tuple
+
+import sentencepiece as spm
+import torch
+from common import (
+    HOP_LENGTH,
+    N_FFT,
+    N_MELS,
+    SAMPLE_RATE,
+    BatchedFeatureExtractor,
+    GlobalStatsNormalization,
+    piecewise_linear_log,
+)
+from lightning import ConformerRNNTModule
+from storage import FileStorage
+from untar_unzip import _load_waveform_from_bytes
+
+logger = logging.getLogger()
+
+# Reflection padding of the centered STFT used for offline features.
+_STFT_PADDING = N_FFT // 2
+
+
+class StreamingFeatureExtractor(torch.nn.Module):
+    """Normalized log-mel features of a waveform fed in pieces of any size.
+
+    Emits the same frames as ``spectrogram_transform`` followed by ``piecewise_linear_log`` and
+    ``GlobalStatsNormalization`` on the whole waveform: the start of the stream is reflection padded once
+    enough samples have arrived, and :py:meth:`flush` reflection pads its end.
+
+    Args:
+        global_stats_path (str): Path to JSON file containing feature means and stddevs.
+    """
+
+    def __init__(self, global_stats_path: str):
+        super().__init__()
+        self.extractor = BatchedFeatureExtractor()
+        self.normalization = GlobalStatsNormalization(global_stats_path)
+        self.reset()
+
+    def reset(self):
+        self._buffer = torch.zeros(0, device=self.extractor.window.device)
+        self._started = False
+
+    def _frames(self, samples: torch.Tensor) -> torch.Tensor:
+        spectrogram = torch.stft(
+            samples, N_FFT, hop_length=HOP_LENGTH, window=self.extractor.window, center=False, return_complex=True
+        ).abs().pow(2)
+        return self.normalization(piecewise_linear_log(torch.matmul(spectrogram.transpose(0, 1), self.extractor.mel_filterbank)))
+
+    def _take_frames(self) -> torch.Tensor:
+        if not self._started or self._buffer.numel() < N_FFT:
+            return torch.zeros(0, N_MELS, device=self.extractor.window.device)
+        num_frames = (self._buffer.numel() - N_FFT) // HOP_LENGTH + 1
+        frames = self._frames(self._buffer[: (num_frames - 1) * HOP_LENGTH + N_FFT])
+        self._buffer = self._buffer[num_frames * HOP_LENGTH :]
+        return frames
+
+    def forward(self, samples: torch.Tensor) -> torch.Tensor:
+        """Append ``samples`` (1-D) and return the frames, with shape `(T, 80)`, that became complete."""
+        self._buffer = torch.cat([self._buffer, samples])
+        if not self._started and self._buffer.numel() > _STFT_PADDING:
+            self._buffer = torch.cat([self._buffer[1 : _STFT_PADDING + 1].flip(0), self._buffer])
+            self._started = True
+        return self._take_frames()
+
+    def flush(self) -> torch.Tensor:
+        """Return the remaining frames at the end of the stream."""
+        if not self._started:
+            # Streams shorter than the padding are padded as a whole, like offline extraction.
+            waveform = self._buffer
+            if waveform.numel() == 0:
+                return torch.zeros(0, N_MELS, device=self.extractor.window.device)
+            padded = torch.nn.functional.pad(waveform[None, None], (_STFT_PADDING, _STFT_PADDING), mode="reflect")[0, 0]
+            self.reset()
+            return self._frames(padded)
+        # Reflect the last samples of the stream, which the buffer still holds because a window overlaps them.
+        self._buffer = torch.cat([self._buffer, self._buffer[-_STFT_PADDING - 1 : -1].flip(0)])
+        frames = self._take_frames()
+        self.reset()
+        return frames
+
+
+def _conformer_layer_step(
+    layer, x: torch.Tensor, conv_cache: torch.Tensor, attention_cache: torch.Tensor, left_context: int
+) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    # Same computation as ``torchaudio.models.conformer.ConformerLayer.forward`` on the frames ``x`` of one
+    # chunk, with shape `(T, B, D)`, except that convolution and attention also see the cached inputs of
+    # earlier frames instead of the full utterance.
+    conv_left = (layer.conv_module.sequential[2].kernel_size[0] - 1) // 2
+
+    def apply_convolution(x, conv_cache):
+        conv_input = torch.cat([conv_cache, x])
+        conv_out = layer.conv_module(conv_input.transpose(0, 1)).transpose(0, 1)[-x.size(0) :]
+        return x + conv_out, conv_input[max(conv_input.size(0) - conv_left, 0) :]
+
+    residual = x
+    x = layer.ffn1(x)
+    x = x * 0.5 + residual
+
+    if layer.convolution_first:
+        x, conv_cache = apply_convolution(x, conv_cache)
+
+    residual = x
+    attention_input = torch.cat([attention_cache, x])
+    keys = layer.self_attn_layer_norm(attention_input)
+    x, _ = layer.self_attn(query=keys[-x.size(0) :], key=keys, value=keys, need_weights=False)
+    x = layer.self_attn_dropout(x)
+    x = x + residual
+    # Not ``[-left_context:]``, which keeps the whole history when ``left_context`` is 0.
+    attention_cache = attention_input[max(attention_input.size(0) - left_context, 0) :]
+
+    if not layer.convolution_first:
+        x, conv_cache = apply_convolution(x, conv_cache)
+
+    residual = x
+    x = layer.ffn2(x)
+    x = x * 0.5 + residual
+
+    return layer.final_layer_norm(x), conv_cache, attention_cache
+
+
+class StreamingConformerEncoder(torch.nn.Module):
+    """Runs the Conformer transcriber of ``conformer_rnnt_model`` one chunk of frames at a time.
+
+    Args:
+        transcriber: ``model.transcriber`` of a model built by ``conformer_rnnt_model``.
+        left_context (int): Number of earlier frames every layer keeps for self-attention.
+    """
+
+    def __init__(self, transcriber, left_context: int):
+        super().__init__()
+        self.transcriber = transcriber
+        self.left_context = left_context
+
+    def init_state(self, device: torch.device) -> List[Tuple[torch.Tensor, torch.Tensor]]:
+        dim = self.transcriber.input_linear.out_features
+        empty = torch.zeros(0, 1, dim, device=device)
+        return [(empty, empty) for _ in self.transcriber.conformer.conformer_layers]
+
+    def forward(
+        self, features: torch.Tensor, state: List[Tuple[torch.Tensor, torch.Tensor]]
+    ) -> Tuple[torch.Tensor, List[Tuple[torch.Tensor, torch.Tensor]]]:
+        """
+        Args:
+            features (torch.Tensor): Normalized features of one chunk, with shape `(1, T, 80)`, where `T` is
+                a multiple of the time reduction stride.
+            state (list): Layer caches from :py:meth:`init_state` or the previous chunk.
+
+        Returns:
+            (torch.Tensor, list): Encoder output of the chunk, with shape `(1, T', D)`, and updated caches.
+        """
+        lengths = torch.tensor([features.size(1)], device=features.device)
+        x, _ = self.transcriber.time_reduction(features, lengths)
+        x = self.transcriber.input_linear(x).transpose(0, 1)
+        new_state = []
+        for layer, (conv_cache, attention_cache) in zip(self.transcriber.conformer.conformer_layers, state):
+            x, conv_cache, attention_cache = _conformer_layer_step(layer, x, conv_cache, attention_cache, self.left_context)
+            new_state.append((conv_cache, attention_cache))
+        x = self.transcriber.layer_norm(self.transcriber.output_linear(x.transpose(0, 1)))
+        return x, new_state
+
+
+class ChunkStats(NamedTuple):
+    audio_seconds: float
+    compute_seconds: float
+
+
+class StreamingRecognizer:
+    r"""Transcribes one audio stream incrementally.
+
+    Args:
+        module (ConformerRNNTModule): Trained model, in eval mode.
+        global_stats_path (str): Path to JSON file containing feature means and stddevs.
+        chunk_frames (int, optional): Number of feature frames (10 ms each) encoded at once. (Default: 40)
+        left_context (int, optional): Number of earlier encoder frames every Conformer layer attends to. (Default: 100)
+    """
+
+    def __init__(self, module: ConformerRNNTModule, global_stats_path: str, chunk_frames: int = 40, left_context: int = 100):
+        stride = module.model.transcriber.time_reduction.stride
+        if chunk_frames % stride != 0:
+            raise ValueError(f"chunk_frames must be a multiple of the time reduction stride {stride}.")
+        self.module = module
+        self.chunk_frames = chunk_frames
+        self.device = module.device
+        self.feature_extractor = StreamingFeatureExtractor(global_stats_path).to(self.device)
+        self.encoder = StreamingConformerEncoder(module.model.transcriber, left_context)
+        self.decoder = module._get_greedy_decoder()
+        self.reset()
+
+    def reset(self):
+        self.feature_extractor.reset()
+        self._features = torch.zeros(0, N_MELS, device=self.device)
+        self._encoder_state = self.encoder.init_state(self.device)
+        self._search_state = self.decoder.start(1, self.device)
+        self.chunk_stats: List[ChunkStats] = []
+
+    @torch.no_grad()
+    def _encode(self, num_frames: int):
+        features, self._features = self._features[:num_frames], self._features[num_frames:]
+        encoder_out, self._encoder_state = self.encoder(features.unsqueeze(0), self._encoder_state)
+        self.decoder.search(encoder_out, torch.tensor([encoder_out.size(1)], device=self.device), self._search_state)
+
+    @torch.no_grad()
+    def accept_waveform(self, samples: torch.Tensor, final: bool = False) -> str:
+        """Feed the next samples of the stream, a 1-D tensor at 16 kHz, and return the transcript so far.
+
+        With ``final=True`` the stream ends: remaining frames are encoded and the final transcript returned.
+        """
+        start = time.perf_counter()
+        new_features = [self.feature_extractor(samples.to(self.device))]
+        if final:
+            new_features.append(self.feature_extractor.flush())
+        self._features = torch.cat([self._features] + new_features)
+
+        while self._features.size(0) >= self.chunk_frames:
+            self._encode(self.chunk_frames)
+        if final and self._features.size(0) > 0:
+            stride = self.encoder.transcriber.time_reduction.stride
+            self._encode(self._features.size(0) // stride * stride)
+            self._features = self._features[:0]
+
+        self.chunk_stats.append(ChunkStats(samples.numel() / SAMPLE_RATE, time.perf_counter() - start))
+        return self.transcript()
+
+    def transcript(self) -> str:
+        return self.module._tokens_to_text(self._search_state.hypotheses[0])
+
+    def real_time_factor(self) -> Optional[float]:
+        audio_seconds = sum(stats.audio_seconds for stats in self.chunk_stats)
+        if audio_seconds == 0:
+            return None
+        return sum(stats.compute_seconds for stats in self.chunk_stats) / audio_seconds
+
+
+def parse_args():
+    parser = ArgumentParser(description=__doc__, formatter_class=RawTextHelpFormatter)
+    parser.add_argument(
+        "--checkpoint-path",
+        type=pathlib.Path,
+        help="Path to checkpoint to use for inference.",
+        required=True,
+    )
+    parser.add_argument(
+        "--global-stats-path",
+        default=pathlib.Path("global_stats.json"),
+        type=pathlib.Path,
+        help="Path to JSON file containing feature means and stddevs.",
+    )
+    parser.add_argument(
+        "--sp-model-path",
+        type=pathlib.Path,
+        help="Path to SentencePiece model.",
+        required=True,
+    )
+    parser.add_argument(
+        "--audio-path",
+        type=pathlib.Path,
+        help="Audio file (16 kHz PCM or WAV) to stream.",
+        required=True,
+    )
+    parser.add_argument(
+        "--chunk-ms",
+        default=400,
+        type=int,
+        help="Duration of the audio chunks fed to the recognizer and of encoder chunks. (Default: 400)",
+    )
+    parser.add_argument(
+        "--left-context",
+        default=100,
+        type=int,
+        help="Number of earlier encoder frames every Conformer layer attends to. (Default: 100)",
+    )
+    parser.add_argument(
+        "--use-cuda",
+        action="store_true",
+        default=False,
+        help="Run using CUDA.",
+    )
+    return parser.parse_args()
+
+
+def cli_main():
+    args = parse_args()
+    sp_model = spm.SentencePieceProcessor(model_file=str(args.sp_model_path))
+    module = ConformerRNNTModule.load_from_checkpoint(args.checkpoint_path, sp_model=sp_model).eval()
+    if args.use_cuda:
+        module = module.to(device="cuda")
+
+    audio_path = str(args.audio_path)
+    waveform = _load_waveform_from_bytes(FileStorage().read_bytes(audio_path), audio_path, SAMPLE_RATE)[0]
+    chunk_samples = args.chunk_ms * SAMPLE_RATE // 1000
+    recognizer = StreamingRecognizer(
+        module, str(args.global_stats_path), chunk_frames=chunk_samples // HOP_LENGTH, left_context=args.left_context
+    )
+
+    for start in range(0, waveform.numel(), chunk_samples):
+        chunk = waveform[start : start + chunk_samples]
+        transcript = recognizer.accept_waveform(chunk, final=start + chunk_samples >= waveform.numel())
+        stats = recognizer.chunk_stats[-1]
+        logger.warning(f"{start / SAMPLE_RATE:.2f}s: {stats.compute_seconds * 1000:.1f} ms; {transcript}")
+
+    latencies = sorted(stats.compute_seconds for stats in recognizer.chunk_stats)
+    logger.warning(
+        f"Chunks: {len(latencies)}; median compute latency: {latencies[len(latencies) // 2] * 1000:.1f} ms; "
+        f"max: {latencies[-1] * 1000:.1f} ms; real-time factor: {recognizer.real_time_factor():.3f}"
+    )
+
+
+if __name__ == "__main__":
+    cli_main()
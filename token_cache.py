@@ -0,0 +1,161 @@
+import hashlib
+import logging
+import os
+from functools import partial
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import sentencepiece as spm
+import torch
+from manifest import _pack_strings, _unpack_strings, parallel_map
+from transcript_cache import _text_hashes
+
+logger = logging.getLogger()
+
+_CACHE_VERSION = 1
+
+TOKENS_FILENAME = "tokens.npz"
+
+# SentencePiece models of the current process, loaded once per path by ``_encode``.
+_sp_models: Dict[str, spm.SentencePieceProcessor] = {}
+
+
+def sp_model_hash(sp_model_path: str) -> str:
+    with open(sp_model_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _encode(sp_model_path: str, text: str) -> List[int]:
+    if sp_model_path not in _sp_models:
+        _sp_models[sp_model_path] = spm.SentencePieceProcessor(model_file=sp_model_path)
+    return _sp_models[sp_model_path].encode(text)
+
+
+class TargetCache:
+    """Token ids of every utterance of a split, stored back to back in one int32 array.
+
+    Args:
+        ids (list of str): Utterance ids, in dataset order.
+        text_hashes (np.ndarray): Hash of the transcript each row was encoded from.
+        tokens (np.ndarray): Token ids of all utterances, concatenated.
+        offsets (np.ndarray): Start of each utterance in ``tokens``.
+        lengths (np.ndarray): Number of tokens of each utterance.
+    """
+
+    def __init__(self, ids: List[str], text_hashes: np.ndarray, tokens: np.ndarray, offsets: np.ndarray, lengths: np.ndarray):
+        self.ids = ids
+        self.text_hashes = text_hashes
+        self.tokens = tokens
+        self.offsets = offsets
+        self.lengths = lengths
+
+    def __getitem__(self, n: int) -> np.ndarray:
+        return self.tokens[self.offsets[n] : self.offsets[n] + self.lengths[n]]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def save(self, cache_path: str, model_hash: str):
+        tmp_path = f"{cache_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                version=np.array(_CACHE_VERSION),
+                model_hash=np.array(model_hash),
+                count=np.array(len(self.ids)),
+                ids=_pack_strings(self.ids),
+                text_hashes=self.text_hashes,
+                tokens=self.tokens,
+                offsets=self.offsets,
+                lengths=self.lengths,
+            )
+        os.replace(tmp_path, cache_path)
+
+    @classmethod
+    def load(cls, cache_path: str, model_hash: str) -> Optional["TargetCache"]:
+        """Load a cache, or return ``None`` if it is missing or was encoded with another SentencePiece model."""
+        if not os.path.isfile(cache_path):
+            return None
+        with np.load(cache_path) as blob:
+            if int(blob["version"]) != _CACHE_VERSION or str(blob["model_hash"]) != model_hash:
+                return None
+            count = int(blob["count"])
+            return cls(
+                _unpack_strings(blob["ids"], count), blob["text_hashes"], blob["tokens"], blob["offsets"], blob["lengths"]
+            )
+
+
+def load_or_encode_targets(
+    cache_path: str,
+    ids: Sequence[str],
+    transcripts: Sequence[str],
+    sp_model_path: str,
+    num_workers: Optional[int] = None,
+) -> TargetCache:
+    """Token ids of ``transcripts``, reusing rows cached by utterance id.
+
+    A cached row is reused when the cache was encoded with the same SentencePiece model (compared by file
+    hash) and its utterance's transcript is unchanged; all other transcripts are encoded in a process pool
+    and the cache is rewritten.
+
+    Args:
+        cache_path (str): Where the token ids are stored.
+        ids (list of str): Utterance ids, in dataset order.
+        transcripts (list of str): Normalized transcript of every utterance.
+        sp_model_path (str): Path to SentencePiece model.
+        num_workers (int or None, optional): Number of worker processes. (Default: number of CPUs)
+    """
+    model_hash = sp_model_hash(sp_model_path)
+    text_hashes = _text_hashes(transcripts)
+    cached = TargetCache.load(cache_path, model_hash)
+    if cached is not None and cached.ids == list(ids) and np.array_equal(cached.text_hashes, text_hashes):
+        return cached
+
+    cached_rows = {}
+    if cached is not None:
+        cached_rows = {file_id: n for n, file_id in enumerate(cached.ids)}
+    targets: List[Optional[np.ndarray]] = [None] * len(ids)
+    pending = []
+    for n, (file_id, text_hash) in enumerate(zip(ids, text_hashes.tolist())):
+        row = cached_rows.get(file_id)
+        if row is not None and int(cached.text_hashes[row]) == text_hash:
+            targets[n] = cached[row]
+        else:
+            pending.append(n)
+
+    logger.info(f"Encoding {len(pending)} of {len(ids)} transcripts for {cache_path}")
+    encode = partial(_encode, sp_model_path)
+    for n, tokens in zip(pending, parallel_map(encode, [transcripts[n] for n in pending], num_workers)):
+        targets[n] = np.array(tokens, dtype=np.int32)
+
+    lengths = np.array([len(tokens) for tokens in targets], dtype=np.int32)
+    offsets = np.zeros(len(ids), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=offsets[1:])
+    tokens = np.concatenate(targets) if targets else np.zeros(0, dtype=np.int32)
+    target_cache = TargetCache(list(ids), text_hashes, tokens.astype(np.int32, copy=False), offsets, lengths)
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        target_cache.save(cache_path, model_hash)
+    except OSError as e:
+        logger.warning(f"Could not save token ids {cache_path}: {e}")
+    return target_cache
+
+
+class TokenizedDataset(torch.utils.data.Dataset):
+    """Appends the cached token ids of each utterance, as an int32 tensor, to the items of ``dataset``.
+
+    Args:
+        dataset: Corpus dataset or :py:class:`feature_cache.FeatureCacheDataset`.
+        targets (TargetCache): Token ids of ``dataset``, in the same order.
+    """
+
+    def __init__(self, dataset, targets: TargetCache):
+        assert len(dataset) == len(targets)
+        self.dataset = dataset
+        self.targets = targets
+
+    def __getitem__(self, n: int):
+        return tuple(self.dataset[n]) + (torch.from_numpy(self.targets[n]),)
+
+    def __len__(self) -> int:
+        return len(self.dataset)
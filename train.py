@@ -3,6 +3,7 @@ from argparse import ArgumentParser
 
 import sentencepiece as spm
 
+from corpora import CORPORA, CORPUS_ETRI
 from lightning import ConformerRNNTModule
 from pytorch_lightning import seed_everything, Trainer
 from pytorch_lightning.callbacks import LearningRateMonitor, ModelCheckpoint
@@ -39,14 +40,32 @@ def run_train(args):
         num_nodes=args.nodes,
         accelerator="gpu",
         strategy="ddp",
+        # BucketBatchSampler splits batches between ranks itself.
+        use_distributed_sampler=False,
         callbacks=callbacks,
         reload_dataloaders_every_n_epochs=1,
         gradient_clip_val=10.0,
     )
 
     sp_model = spm.SentencePieceProcessor(model_file=str(args.sp_model_path))
-    model = ConformerRNNTModule(sp_model)
-    data_module = get_data_module(str(args.korspeech_path), str(args.global_stats_path), str(args.sp_model_path))
+    model = ConformerRNNTModule(sp_model, global_stats_path=str(args.global_stats_path) if args.features_on_device else None)
+    data_module = get_data_module(
+        str(args.korspeech_path),
+        str(args.global_stats_path),
+        str(args.sp_model_path),
+        train_shards_path=str(args.train_shards_path) if args.train_shards_path else None,
+        features_path=str(args.features_path) if args.features_path else None,
+        features_on_device=args.features_on_device,
+        max_frames=args.max_frames,
+        max_joiner_elements=args.max_joiner_elements,
+        corpora=args.corpora,
+        corpus_weights=args.corpus_weights,
+        temperature=args.mixing_temperature,
+        speed_factors=args.speed_factors,
+        noise_dir=str(args.noise_dir) if args.noise_dir else None,
+        rir_dir=str(args.rir_dir) if args.rir_dir else None,
+        augmented_features=args.augmented_features,
+    )
     trainer.fit(model, data_module, ckpt_path=args.checkpoint_path)
 
 
@@ -82,6 +101,83 @@ def cli_main():
         help="Path to SentencePiece model.",
         required=True,
     )
+    parser.add_argument(
+        "--train-shards-path",
+        default=None,
+        type=pathlib.Path,
+        help="Directory of training shards written by shards.py. If given, training data is streamed from it.",
+    )
+    parser.add_argument(
+        "--features-path",
+        default=None,
+        type=pathlib.Path,
+        help="Directory of log-mel features written by feature_cache.py. If given, features are read from it.",
+    )
+    parser.add_argument(
+        "--features-on-device",
+        action="store_true",
+        default=False,
+        help="Compute features on the training device instead of in DataLoader workers.",
+    )
+    parser.add_argument(
+        "--speed-factors",
+        nargs="+",
+        default=None,
+        type=float,
+        help="Speed perturbation factors, e.g. 0.9 1.0 1.1. With --features-path, selects the variants written by "
+        "feature_cache.py instead. (Default: no speed perturbation)",
+    )
+    parser.add_argument(
+        "--noise-dir",
+        default=None,
+        type=pathlib.Path,
+        help="Directory of 16 kHz noise recordings mixed into training utterances. (Default: no noise)",
+    )
+    parser.add_argument(
+        "--rir-dir",
+        default=None,
+        type=pathlib.Path,
+        help="Directory of 16 kHz room impulse responses applied to training utterances. (Default: no reverberation)",
+    )
+    parser.add_argument(
+        "--augmented-features",
+        action="store_true",
+        default=False,
+        help="With --features-path, read the noisy or reverberant variants written by feature_cache.py with "
+        "--noise-dir or --rir-dir instead of the clean ones.",
+    )
+    parser.add_argument(
+        "--corpora",
+        nargs="+",
+        default=[CORPUS_ETRI],
+        choices=CORPORA,
+        help="Corpora to train on, mixed batch by batch. (Default: etri)",
+    )
+    parser.add_argument(
+        "--corpus-weights",
+        nargs="+",
+        default=None,
+        type=float,
+        help="Sampling weight of each corpus in --corpora. (Default: corpus sizes)",
+    )
+    parser.add_argument(
+        "--mixing-temperature",
+        default=1.0,
+        type=float,
+        help="Temperature applied to corpus weights; higher values sample corpora more uniformly. (Default: 1.0)",
+    )
+    parser.add_argument(
+        "--max-frames",
+        default=None,
+        type=int,
+        help="Maximum number of padded feature frames in a batch. (Default: no limit)",
+    )
+    parser.add_argument(
+        "--max-joiner-elements",
+        default=None,
+        type=int,
+        help="Maximum size of the padded RNN-T joiner output of a batch. (Default: no limit)",
+    )
     parser.add_argument(
         "--nodes",
         default=1,
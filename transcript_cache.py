@@ -0,0 +1,106 @@
+import hashlib
+import logging
+import os
+from functools import partial
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from manifest import _pack_strings, _unpack_strings, parallel_map
+
+logger = logging.getLogger()
+
+_CACHE_VERSION = 1
+
+
+def _normalize_item(normalize: Callable[[str, str], Optional[str]], item: Tuple[str, str]) -> Optional[str]:
+    return normalize(*item)
+
+
+def _text_hashes(texts: Sequence[str]) -> np.ndarray:
+    return np.array(
+        [int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little", signed=True) for text in texts],
+        dtype=np.int64,
+    )
+
+
+def _load_cache(cache_path: str, normalizer_version: str) -> Dict[str, Tuple[int, Optional[str]]]:
+    if not os.path.isfile(cache_path):
+        return {}
+    with np.load(cache_path) as blob:
+        if int(blob["version"]) != _CACHE_VERSION or str(blob["normalizer_version"]) != normalizer_version:
+            return {}
+        count = int(blob["count"])
+        ids = _unpack_strings(blob["ids"], count)
+        normalized = _unpack_strings(blob["normalized"], count)
+        return {
+            file_id: (int(text_hash), text if is_valid else None)
+            for file_id, text_hash, text, is_valid in zip(ids, blob["hashes"], normalized, blob["valid"])
+        }
+
+
+def _save_cache(
+    cache_path: str, normalizer_version: str, ids: Sequence[str], hashes: np.ndarray, normalized: Sequence[Optional[str]]
+):
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = f"{cache_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(
+            f,
+            version=np.array(_CACHE_VERSION),
+            normalizer_version=np.array(normalizer_version),
+            count=np.array(len(ids)),
+            ids=_pack_strings(ids),
+            hashes=hashes,
+            normalized=_pack_strings([text if text is not None else "" for text in normalized]),
+            valid=np.array([text is not None for text in normalized], dtype=bool),
+        )
+    os.replace(tmp_path, cache_path)
+
+
+def load_or_normalize(
+    cache_path: str,
+    ids: Sequence[str],
+    raw_texts: Sequence[str],
+    normalize: Callable[[str, str], Optional[str]],
+    normalizer_version: str,
+    num_workers: Optional[int] = None,
+) -> List[Optional[str]]:
+    """Normalize the transcripts of one split, reusing results cached by utterance id.
+
+    A cached result is reused when its utterance's raw transcript is unchanged (compared by hash) and the
+    cache was written with the same ``normalizer_version``; all other transcripts are normalized in a
+    process pool and the cache is rewritten.
+
+    Args:
+        cache_path (str): Where the normalized transcripts are stored.
+        ids (list of str): Utterance ids, unique within the split.
+        raw_texts (list of str): Raw transcript of every utterance.
+        normalize (callable): Picklable function of an utterance id and its raw transcript, returning the
+            normalized transcript or ``None`` to drop the utterance.
+        normalizer_version (str): Identifies the behaviour of ``normalize``; change it to invalidate the cache.
+        num_workers (int or None, optional): Number of worker processes. (Default: number of CPUs)
+
+    Returns:
+        list of (str or None): Normalized transcript of every utterance, in the order of ``ids``.
+    """
+    hashes = _text_hashes(raw_texts)
+    cached = _load_cache(cache_path, normalizer_version)
+    normalized: List[Optional[str]] = [None] * len(ids)
+    pending = []
+    for n, (file_id, text_hash) in enumerate(zip(ids, hashes.tolist())):
+        entry = cached.get(file_id)
+        if entry is not None and entry[0] == text_hash:
+            normalized[n] = entry[1]
+        else:
+            pending.append(n)
+
+    if pending or len(cached) != len(ids):
+        logger.info(f"Normalizing {len(pending)} of {len(ids)} transcripts for {cache_path}")
+        items = [(ids[n], raw_texts[n]) for n in pending]
+        for n, text in zip(pending, parallel_map(partial(_normalize_item, normalize), items, num_workers)):
+            normalized[n] = text
+        try:
+            _save_cache(cache_path, normalizer_version, ids, hashes, normalized)
+        except OSError as e:
+            logger.warning(f"Could not save normalized transcripts {cache_path}: {e}")
+    return normalized
@@ -1,101 +1,108 @@
-import json
-import math
-from functools import partial
-from typing import List
+from typing import List, Optional
 
 import sentencepiece as spm
 import torch
-import torchaudio
+from augmentation import WaveformAugmentation, find_audio_files
+from common import BatchedFeatureExtractor, get_train_data_pipeline, get_valid_data_pipeline
+from corpora import CORPUS_ETRI
 from data_module import korSpeechDataModule
-from lightning import Batch
+from lightning import Batch, WaveformBatch
 
 
-_decibel = 2 * 20 * math.log10(torch.iinfo(torch.int16).max)
-_gain = pow(10, 0.05 * _decibel)
+_feature_extractor = BatchedFeatureExtractor()
 
-_spectrogram_transform = torchaudio.transforms.MelSpectrogram(sample_rate=16000, n_fft=400, n_mels=80, hop_length=160)
 
+def _pad_targets(targets: List[torch.Tensor]):
+    # One masked scatter of all token ids into the padded batch, instead of a tensor and copy per sample.
+    lengths = torch.tensor([len(elem) for elem in targets], dtype=torch.int32)
+    padded = torch.ones(len(targets), int(lengths.max()) if len(targets) else 0, dtype=torch.int32)
+    padded[torch.arange(padded.size(1)) < lengths[:, None]] = torch.cat(targets).to(torch.int32)
+    return padded, lengths
 
-def _piecewise_linear_log(x):
-    x = x * _gain
-    x[x > math.e] = torch.log(x[x > math.e])
-    x[x <= math.e] = x[x <= math.e] / math.e
-    return x
 
+def _extract_labels(sp_model, samples: List):
+    # Samples from ``token_cache.TokenizedDataset`` carry their token ids after the transcript; shard samples
+    # carry a metadata dict there instead.
+    if all(len(sample) > 3 and isinstance(sample[3], torch.Tensor) for sample in samples):
+        return _pad_targets([sample[3] for sample in samples])
+    return _pad_targets([torch.tensor(tokens, dtype=torch.int32) for tokens in sp_model.encode([sample[2] for sample in samples])])
 
-class FunctionalModule(torch.nn.Module):
-    def __init__(self, functional):
-        super().__init__()
-        self.functional = functional
-
-    def forward(self, input):
-        return self.functional(input)
-
-
-class GlobalStatsNormalization(torch.nn.Module):
-    def __init__(self, global_stats_path):
-        super().__init__()
-
-        with open(global_stats_path) as f:
-            blob = json.loads(f.read())
-
-        self.mean = torch.tensor(blob["mean"])
-        self.invstddev = torch.tensor(blob["invstddev"])
 
-    def forward(self, input):
-        return (input - self.mean) * self.invstddev
+def _extract_waveforms(samples: List):
+    waveforms = [sample[0].squeeze(0) for sample in samples]
+    lengths = torch.tensor([elem.shape[0] for elem in waveforms], dtype=torch.int32)
+    return torch.nn.utils.rnn.pad_sequence(waveforms, batch_first=True), lengths
 
 
-def _extract_labels(sp_model, samples: List):
-    targets = [sp_model.encode(sample[2]) for sample in samples]
-    lengths = torch.tensor([len(elem) for elem in targets]).to(dtype=torch.int32)
-    targets = torch.nn.utils.rnn.pad_sequence(
-        [torch.tensor(elem) for elem in targets],
-        batch_first=True,
-        padding_value=1.0,
-    ).to(dtype=torch.int32)
-    return targets, lengths
+def _extract_features(data_pipeline, samples: List):
+    waveforms, waveform_lengths = _extract_waveforms(samples)
+    features, lengths = _feature_extractor(waveforms, waveform_lengths)
+    return data_pipeline(features), lengths
 
 
-def _extract_features(data_pipeline, samples: List):
-    mel_features = [_spectrogram_transform(sample[0].squeeze()).transpose(1, 0) for sample in samples]
-    features = torch.nn.utils.rnn.pad_sequence(mel_features, batch_first=True)
+def _extract_cached_features(data_pipeline, samples: List):
+    # Samples from ``FeatureCacheDataset`` already hold log-mel frames.
+    log_mel_features = [sample[0] for sample in samples]
+    features = torch.nn.utils.rnn.pad_sequence(log_mel_features, batch_first=True).to(torch.float32)
     features = data_pipeline(features)
-    lengths = torch.tensor([elem.shape[0] for elem in mel_features], dtype=torch.int32)
+    lengths = torch.tensor([elem.shape[0] for elem in log_mel_features], dtype=torch.int32)
     return features, lengths
 
 
+def _get_extract_features(precomputed_features: bool, features_on_device: bool):
+    if precomputed_features and features_on_device:
+        raise ValueError("Precomputed features cannot also be extracted on the training device.")
+    return _extract_cached_features if precomputed_features else _extract_features
+
+
 class TrainTransform:
-    def __init__(self, global_stats_path: str, sp_model_path: str):
+    def __init__(
+        self,
+        global_stats_path: str,
+        sp_model_path: str,
+        precomputed_features: bool = False,
+        features_on_device: bool = False,
+        augmentation: Optional[WaveformAugmentation] = None,
+    ):
+        if precomputed_features and augmentation is not None:
+            raise ValueError("Precomputed features cannot be augmented; write augmented variants with feature_cache.py.")
         self.sp_model = spm.SentencePieceProcessor(model_file=sp_model_path)
-        self.train_data_pipeline = torch.nn.Sequential(
-            FunctionalModule(_piecewise_linear_log),
-            GlobalStatsNormalization(global_stats_path),
-            FunctionalModule(partial(torch.transpose, dim0=1, dim1=2)),
-            torchaudio.transforms.FrequencyMasking(31),
-            torchaudio.transforms.FrequencyMasking(31),
-            torchaudio.transforms.TimeMasking(41, p=0.2),
-            torchaudio.transforms.TimeMasking(41, p=0.2),
-            FunctionalModule(partial(torch.transpose, dim0=1, dim1=2)),
-        )
+        self.extract_features = _get_extract_features(precomputed_features, features_on_device)
+        self.features_on_device = features_on_device
+        self.augmentation = augmentation
+        self.train_data_pipeline = get_train_data_pipeline(global_stats_path)
 
     def __call__(self, samples: List):
-        features, feature_lengths = _extract_features(self.train_data_pipeline, samples)
         targets, target_lengths = _extract_labels(self.sp_model, samples)
+        if self.augmentation is not None:
+            samples = [(self.augmentation(sample[0]),) + tuple(sample[1:]) for sample in samples]
+        if self.features_on_device:
+            # Features are computed by ``ConformerRNNTModule`` once the batch is on the training device.
+            waveforms, waveform_lengths = _extract_waveforms(samples)
+            return WaveformBatch(waveforms, waveform_lengths, targets, target_lengths)
+        features, feature_lengths = self.extract_features(self.train_data_pipeline, samples)
         return Batch(features, feature_lengths, targets, target_lengths)
 
 
 class ValTransform:
-    def __init__(self, global_stats_path: str, sp_model_path: str):
+    def __init__(
+        self,
+        global_stats_path: str,
+        sp_model_path: str,
+        precomputed_features: bool = False,
+        features_on_device: bool = False,
+    ):
         self.sp_model = spm.SentencePieceProcessor(model_file=sp_model_path)
-        self.valid_data_pipeline = torch.nn.Sequential(
-            FunctionalModule(_piecewise_linear_log),
-            GlobalStatsNormalization(global_stats_path),
-        )
+        self.extract_features = _get_extract_features(precomputed_features, features_on_device)
+        self.features_on_device = features_on_device
+        self.valid_data_pipeline = get_valid_data_pipeline(global_stats_path)
 
     def __call__(self, samples: List):
-        features, feature_lengths = _extract_features(self.valid_data_pipeline, samples)
         targets, target_lengths = _extract_labels(self.sp_model, samples)
+        if self.features_on_device:
+            waveforms, waveform_lengths = _extract_waveforms(samples)
+            return WaveformBatch(waveforms, waveform_lengths, targets, target_lengths)
+        features, feature_lengths = self.extract_features(self.valid_data_pipeline, samples)
         return Batch(features, feature_lengths, targets, target_lengths)
 
 
@@ -107,13 +114,68 @@ class TestTransform:
         return self.val_transforms([sample]), [sample]
 
 
-def get_data_module(korspeech_path, global_stats_path, sp_model_path):
-    train_transform = TrainTransform(global_stats_path=global_stats_path, sp_model_path=sp_model_path)
-    val_transform = ValTransform(global_stats_path=global_stats_path, sp_model_path=sp_model_path)
+def get_data_module(
+    korspeech_path,
+    global_stats_path,
+    sp_model_path,
+    train_shards_path=None,
+    features_path=None,
+    features_on_device=False,
+    max_frames=None,
+    max_joiner_elements=None,
+    corpora=(CORPUS_ETRI,),
+    corpus_weights=None,
+    temperature=1.0,
+    pretokenized_targets=True,
+    speed_factors=None,
+    noise_dir=None,
+    rir_dir=None,
+    augmented_features=False,
+):
+    precomputed_features = features_path is not None
+    augmentation = None
+    if precomputed_features:
+        # Augmented variants are precomputed by ``feature_cache.py``; the speed factors and ``augmented_features`` select them.
+        if noise_dir or rir_dir:
+            raise ValueError(
+                "Noise and reverberation of precomputed features are applied by feature_cache.py; "
+                "read its augmented variants with augmented_features."
+            )
+    elif augmented_features:
+        raise ValueError("Augmented features are only read from a feature cache.")
+    elif speed_factors or noise_dir or rir_dir:
+        augmentation = WaveformAugmentation(
+            speed_factors or [1.0],
+            find_audio_files(noise_dir) if noise_dir else (),
+            find_audio_files(rir_dir) if rir_dir else (),
+        )
+    train_transform = TrainTransform(
+        global_stats_path=global_stats_path,
+        sp_model_path=sp_model_path,
+        precomputed_features=precomputed_features,
+        features_on_device=features_on_device,
+        augmentation=augmentation,
+    )
+    val_transform = ValTransform(
+        global_stats_path=global_stats_path,
+        sp_model_path=sp_model_path,
+        precomputed_features=precomputed_features,
+        features_on_device=features_on_device,
+    )
     test_transform = TestTransform(global_stats_path=global_stats_path, sp_model_path=sp_model_path)
     return korSpeechDataModule(
         korspeech_path=korspeech_path,
         train_transform=train_transform,
         val_transform=val_transform,
         test_transform=test_transform,
+        train_shards_path=train_shards_path,
+        features_path=features_path,
+        max_frames=max_frames,
+        max_joiner_elements=max_joiner_elements,
+        corpora=corpora,
+        corpus_weights=corpus_weights,
+        temperature=temperature,
+        sp_model_path=sp_model_path if pretokenized_targets else None,
+        speed_factors=speed_factors if precomputed_features else None,
+        augmented_features=augmented_features,
     )
\ No newline at end of file
@@ -1,9 +1,14 @@
+import hashlib
+import json
 import logging
+import math
+import multiprocessing as mp
 import os
 import tarfile
 import zipfile
-from typing import List, Optional
+from typing import Callable, List, Optional, Tuple
 from pathlib import Path
+from audio_io import PCM_BYTES_PER_SAMPLE, WAV_HEADER_BYTES, decode_audio_bytes, load_audio, probe_header
 from common import (
     SAMPLE_RATE,
     DYS_SAMPLE_RATE
@@ -13,58 +18,210 @@ import torchaudio
 
 _resampler = torchaudio.transforms.Resample(DYS_SAMPLE_RATE, SAMPLE_RATE, lowpass_filter_width=12)
 
-def _extract_tar(from_path: str, to_path: Optional[str] = None, overwrite: bool = False, n_directories_stripped: int = 0,) -> List[str]:
+_LEDGER_DIR_NAME = ".extracted"
+_PROGRESS_INTERVAL = 1000
+_FINGERPRINT_CHUNK_SIZE = 1 << 20
+
+
+def _archive_fingerprint(from_path: str) -> dict:
+    # Hashing the head and tail of the archive identifies re-copied archives whose mtime changed
+    # without reading hundreds of gigabytes.
+    stat = os.stat(from_path)
+    digest = hashlib.sha1(str(stat.st_size).encode())
+    with open(from_path, "rb") as f:
+        digest.update(f.read(_FINGERPRINT_CHUNK_SIZE))
+        if stat.st_size > _FINGERPRINT_CHUNK_SIZE:
+            f.seek(-_FINGERPRINT_CHUNK_SIZE, os.SEEK_END)
+            digest.update(f.read(_FINGERPRINT_CHUNK_SIZE))
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha1": digest.hexdigest()}
+
+
+def _ledger_path(from_path: str, to_path: str) -> str:
+    return os.path.join(to_path, _LEDGER_DIR_NAME, f"{os.path.basename(from_path)}.json")
+
+
+def _read_ledger(from_path: str, to_path: str, n_directories_stripped: int) -> Optional[dict]:
+    """Return the extraction record of ``from_path`` if it matches the archive on disk, else ``None``."""
+    ledger_path = _ledger_path(from_path, to_path)
+    if not os.path.isfile(ledger_path):
+        return None
+
+    with open(ledger_path) as f:
+        record = json.load(f)
+
+    if record["n_directories_stripped"] != n_directories_stripped:
+        return None
+
+    stat = os.stat(from_path)
+    if record["size"] != stat.st_size:
+        return None
+    if record["mtime_ns"] != stat.st_mtime_ns:
+        if record["sha1"] != _archive_fingerprint(from_path)["sha1"]:
+            return None
+        record["mtime_ns"] = stat.st_mtime_ns
+        _write_ledger(from_path, to_path, record)
+
+    return record
+
+
+def _write_ledger(from_path: str, to_path: str, record: dict):
+    ledger_path = _ledger_path(from_path, to_path)
+    os.makedirs(os.path.dirname(ledger_path), exist_ok=True)
+    tmp_path = f"{ledger_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(record, f)
+    os.replace(tmp_path, ledger_path)
+
+
+def _start_ledger(from_path: str, to_path: str, overwrite: bool, n_directories_stripped: int) -> dict:
+    record = None if overwrite else _read_ledger(from_path, to_path, n_directories_stripped)
+    if record is None:
+        record = _archive_fingerprint(from_path)
+        record.update(archive=from_path, n_directories_stripped=n_directories_stripped, members=None, done=0, complete=False)
+    return record
+
+
+def _is_extracted(from_path: str, to_path: Optional[str] = None, overwrite: bool = False, n_directories_stripped: int = 0) -> bool:
     if to_path is None:
         to_path = os.path.dirname(from_path)
-    
+    if overwrite:
+        return False
+    record = _read_ledger(from_path, to_path, n_directories_stripped)
+    return record is not None and record["complete"]
+
+
+def _is_member_extracted(file_path: str, size: int) -> bool:
+    # A size mismatch means the member was cut off by an interrupted run.
+    return os.path.isfile(file_path) and os.path.getsize(file_path) == size
+
+
+def _extract_tar(from_path: str, to_path: Optional[str] = None, overwrite: bool = False, n_directories_stripped: int = 0,) -> int:
+    """Extract a tar archive, resuming from the last recorded member if a previous run was interrupted.
+
+    Returns:
+        int: Number of members in the archive.
+    """
+    if to_path is None:
+        to_path = os.path.dirname(from_path)
+
+    record = _start_ledger(from_path, to_path, overwrite, n_directories_stripped)
+    if record["complete"]:
+        logging.info(f"{from_path} already extracted.")
+        return record["members"]
+
     mode = "r"
     if from_path.endswith("tar.gz"):
         mode = "r:gz"
     
     with tarfile.open(from_path, mode) as tar:
-        logging.info("Opened tar file {}.", from_path)
-        files = []
-        for member in tar.getmembers():
+        logging.info(f"Opened tar file {from_path}.")
+        members = tar.getmembers()
+        record["members"] = len(members)
+        for idx in range(record["done"], len(members)):
+            member = members[idx]
             member.path = member.path.split('/', n_directories_stripped)[-1]
             file_path = os.path.join(to_path, member.path)
-            if member.isfile():
-                files.append(file_path)
-                if os.path.exists(file_path):
-                    logging.info("{} already extracted.".format(file_path))
-                    if not overwrite:
-                        continue
-            tar.extract(member, to_path)
-            
-        return files
-
-
-def _extract_zip(from_path: str, to_path: Optional[str] = None, overwrite: bool = False, n_directories_stripped: int = 0,) -> List[str]:
+            if not (member.isfile() and not overwrite and _is_member_extracted(file_path, member.size)):
+                tar.extract(member, to_path)
+
+            if (idx + 1) % _PROGRESS_INTERVAL == 0:
+                record["done"] = idx + 1
+                _write_ledger(from_path, to_path, record)
+
+    record["done"] = record["members"]
+    record["complete"] = True
+    _write_ledger(from_path, to_path, record)
+    return record["members"]
+
+
+def _extract_zip(from_path: str, to_path: Optional[str] = None, overwrite: bool = False, n_directories_stripped: int = 0,) -> int:
+    """Extract a zip archive, resuming from the last recorded member if a previous run was interrupted.
+
+    Returns:
+        int: Number of members in the archive.
+    """
     if to_path is None:
         to_path = os.path.dirname(from_path)
 
+    record = _start_ledger(from_path, to_path, overwrite, n_directories_stripped)
+    if record["complete"]:
+        logging.info(f"{from_path} already extracted.")
+        return record["members"]
+
     with zipfile.ZipFile(from_path, "r", metadata_encoding='cp949') as zfile:
-        logging.info("Opened zip file {}.", from_path)
-        files = zfile.namelist()
-        for file_info in zfile.infolist():
+        logging.info(f"Opened zip file {from_path}.")
+        infolist = zfile.infolist()
+        record["members"] = len(infolist)
+        for idx in range(record["done"], len(infolist)):
+            file_info = infolist[idx]
             file_info.filename = file_info.filename.split('/', n_directories_stripped)[-1]
             file_path = os.path.join(to_path, file_info.filename)
-            if os.path.exists(file_path):
-                logging.info("{} already extracted.".format(file_path))
-                if not overwrite:
-                    continue
-            zfile.extract(file_info, to_path)
-            
-    return files
+            if file_info.is_dir() or overwrite or not _is_member_extracted(file_path, file_info.file_size):
+                zfile.extract(file_info, to_path)
 
-def _load_waveform(
-    file_path: str,
-    exp_sample_rate: int,
-):
-    waveform, sample_rate = torchaudio.load(file_path)
-    
+            if (idx + 1) % _PROGRESS_INTERVAL == 0:
+                record["done"] = idx + 1
+                _write_ledger(from_path, to_path, record)
+
+    record["done"] = record["members"]
+    record["complete"] = True
+    _write_ledger(from_path, to_path, record)
+    return record["members"]
+
+
+def _extract_archives(extract_fn: Callable, args: List[Tuple]):
+    """Run ``extract_fn`` over ``args`` in a process pool, skipping archives the ledger marks as extracted.
+
+    Args:
+        extract_fn (callable): :py:func:`_extract_tar` or :py:func:`_extract_zip`.
+        args (list of tuple): ``(from_path, to_path, overwrite, n_directories_stripped)`` per archive.
+    """
+    pending = [arg for arg in args if not _is_extracted(*arg)]
+    if not pending:
+        return
+
+    with mp.Pool(min(mp.cpu_count(), len(pending))) as pool:
+        pool.starmap(extract_fn, pending, chunksize=1)
+
+
+def _resample_if_needed(waveform, sample_rate: int, exp_sample_rate: int):
     if exp_sample_rate != sample_rate:
         if sample_rate == DYS_SAMPLE_RATE:
             waveform = _resampler(waveform)
         else:
             raise ValueError(f"sample rate should be {exp_sample_rate}, but got {sample_rate}")
     return waveform
+
+
+def _load_waveform(
+    file_path: str,
+    exp_sample_rate: int,
+):
+    waveform, sample_rate = load_audio(file_path)
+    return _resample_if_needed(waveform, sample_rate, exp_sample_rate)
+
+
+def _load_waveform_from_bytes(
+    data: bytes,
+    file_path: str,
+    exp_sample_rate: int,
+):
+    """Decode audio read from an archive member. ``file_path`` is only used to detect headerless PCM."""
+    waveform, sample_rate = decode_audio_bytes(data, file_path)
+    return _resample_if_needed(waveform, sample_rate, exp_sample_rate)
+
+
+def _num_samples_from_header(header: bytes, num_bytes: int, file_path: str, exp_sample_rate: int) -> int:
+    """Number of samples ``_load_waveform`` yields for a file, computed from its size and header without decoding.
+
+    Args:
+        header (bytes): First bytes of the file, at least ``WAV_HEADER_BYTES`` of them for WAV files.
+            Ignored for headerless PCM.
+        num_bytes (int): Size of the file.
+        file_path (str): Path of the file, used to detect headerless PCM.
+        exp_sample_rate (int): Sample rate the waveform is resampled to.
+    """
+    info = probe_header(header, num_bytes, file_path)
+    if info.sample_rate != exp_sample_rate:
+        return math.ceil(info.num_frames * exp_sample_rate / info.sample_rate)
+    return info.num_frames